@@ -1,13 +1,44 @@
 import streamlit as st
-from openai import OpenAI
-from coderag.config import OPENAI_API_KEY, OPENAI_CHAT_MODEL
-from prompt_flow import execute_rag_flow
+from coderag.config import INDEX_SHARDS, SEARCH_SHARDS, QUERY_SERVER_URL
+from coderag.clients import get_client
+from coderag import query_cache
+from prompt_flow import stream_rag_flow
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY)
+
+@st.cache_resource
+def openai_client():
+    """The OpenAI client and its connection pool, created once per server process rather than on every rerun."""
+    return get_client()
+
+
+@st.cache_resource(show_spinner="Loading the index...")
+def index_shards():
+    """
+    Map the index once per server process; each question then only checks for a newer
+    generation. A missing index raises, and is not cached, so a later rerun picks it up.
+    """
+    from coderag.index import SHARDS, get_snapshots
+    get_snapshots()
+    return SHARDS
+
+
+openai_client()
+if not QUERY_SERVER_URL:
+    try:
+        index_shards()
+    except FileNotFoundError as e:
+        st.warning(f"Index not built yet: {e}")
 
 st.title("CodeRAG: Your Coding Assistant")
 
+# Repositories to search, when several are indexed
+shards = None
+if len(INDEX_SHARDS) > 1:
+    with st.sidebar:
+        shards = st.multiselect(
+            "Repositories", list(INDEX_SHARDS), default=SEARCH_SHARDS or list(INDEX_SHARDS)
+        ) or None
+
 # Initialize chat history
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -28,12 +59,20 @@ if prompt := st.chat_input("What is your coding question?"):
         full_response = ""
 
         try:
-            response = execute_rag_flow(prompt)
-            message_placeholder.markdown(response)
-            full_response = response
+            # Render the answer progressively as it streams in
+            for piece in stream_rag_flow(prompt, shards=shards):
+                full_response += piece
+                message_placeholder.markdown(full_response + "▌")
+            message_placeholder.markdown(full_response)
         except Exception as e:
             error_message = f"Error in RAG flow execution: {str(e)}"
             st.error(error_message)
             full_response = error_message
 
-    st.session_state.messages.append({"role": "assistant", "content": full_response})
\ No newline at end of file
+    st.session_state.messages.append({"role": "assistant", "content": full_response})
+
+# Query cache counters (shared by every session served by this process)
+with st.sidebar:
+    st.subheader("Query cache")
+    for tier, counts in query_cache.stats().items():
+        st.caption(f"{tier}: {counts['hits']} hits / {counts['misses']} misses ({counts['entries']} entries)")
\ No newline at end of file
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Recall-versus-latency report for the approximate index types against exact (flat) search.
+
+Vectors are drawn from a Gaussian mixture so that neighbourhoods have structure,
+like real embeddings. Run from the repository root:
+
+    python -m benchmarks.ann_recall --n 50000 --dim 1536 --nprobe 4 16 64 --ef-search 32 64 128
+"""
+
+import argparse
+import json
+import time
+import numpy as np
+from coderag.index_factory import build_index, tune, pq_subquantizers
+
+
+def clustered_vectors(n, dim, n_clusters, rng):
+    centers = rng.standard_normal((n_clusters, dim)).astype('float32')
+    labels = rng.integers(0, n_clusters, n)
+    vectors = centers[labels] + 0.35 * rng.standard_normal((n, dim)).astype('float32')
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def measure(index, queries, k, truth):
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - start)
+        found.append(ids[0])
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "recall_at_k": float(recall),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ANN recall vs latency against the flat index")
+    parser.add_argument("--n", type=int, default=20000, help="Indexed vectors")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists (0 = ~sqrt(n))")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--pq-m", type=int, default=32)
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    vectors = clustered_vectors(args.n, args.dim, args.clusters, rng)
+    queries = clustered_vectors(args.queries, args.dim, args.clusters, rng)
+    ids = np.arange(args.n)
+    common = {"dim": args.dim, "nlist": args.nlist, "pq_m": pq_subquantizers(args.dim, args.pq_m)}
+
+    rows = []
+
+    def report(index_type, build_seconds, param, index, truth):
+        row = {"index": index_type, "param": param, "build_s": round(build_seconds, 3)}
+        row.update(measure(index, queries, args.k, truth))
+        rows.append(row)
+        print(f"{index_type:>9} {param:>14} {row['build_s']:>8.2f} {row['recall_at_k']:>9.3f} "
+              f"{row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f}")
+
+    print(f"{'index':>9} {'param':>14} {'build_s':>8} {'recall@' + str(args.k):>9} {'p50_ms':>8} {'p95_ms':>8}")
+    start = time.perf_counter()
+    flat = build_index(ids, vectors, index_type="flat", **common)
+    flat_build = time.perf_counter() - start
+    _, truth = flat.search(queries, args.k)
+    report("flat", flat_build, "exact", flat, truth)
+
+    for index_type, param_name, values in (
+        ("hnsw", "efSearch", args.ef_search),
+        ("ivf_flat", "nprobe", args.nprobe),
+        ("ivf_pq", "nprobe", args.nprobe),
+    ):
+        start = time.perf_counter()
+        index = build_index(ids, vectors, index_type=index_type, **common)
+        build_seconds = time.perf_counter() - start
+        for value in values:
+            if param_name == "efSearch":
+                tune(index, ef_search=value)
+            else:
+                tune(index, nprobe=value)
+            report(index_type, build_seconds, f"{param_name}={value}", index, truth)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2)
+        print(f"Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
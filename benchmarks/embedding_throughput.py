@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Offline throughput benchmark for the batched embedding pipeline.
+
+Uses the fake embedding backend with a simulated per-request latency, so it needs
+no API key. Run from the repository root:
+
+    python -m benchmarks.embedding_throughput --docs 5000 --latency-ms 200 --concurrency 1 4 8
+"""
+
+import argparse
+import time
+from coderag.embeddings import fake_embed_batch
+from coderag.pipeline import embed_documents
+
+
+def synthetic_documents(n, lines_per_doc):
+    for i in range(n):
+        body = "\n".join(f"    value_{i}_{j} = compute_{j % 17}(item_{j % 5})" for j in range(lines_per_doc))
+        yield {"text": f"def function_{i}(item):\n{body}\n    return value_{i}_0\n"}
+
+
+def run(n_docs, lines_per_doc, latency_ms, concurrency, max_tokens, max_items):
+    def backend(texts):
+        time.sleep(latency_ms / 1000.0)  # Simulated round trip
+        return fake_embed_batch(texts)
+
+    start = time.perf_counter()
+    count = 0
+    for _, embedding in embed_documents(
+        synthetic_documents(n_docs, lines_per_doc), concurrency=concurrency,
+        embed_fn=backend, max_tokens=max_tokens, max_items=max_items
+    ):
+        if embedding is not None:
+            count += 1
+    elapsed = time.perf_counter() - start
+    return count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the embedding pipeline offline")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--lines-per-doc", type=int, default=40)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Simulated latency per request")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--max-tokens", type=int, default=100000)
+    parser.add_argument("--max-items", type=int, default=256)
+    args = parser.parse_args()
+
+    # Baseline: one text per request, one request at a time (the old full_reindex behaviour)
+    configs = [(1, 1)] + [(c, args.max_items) for c in args.concurrency]
+    print(f"{'concurrency':>11} {'batch':>6} {'docs':>7} {'seconds':>9} {'docs/s':>9}")
+    for concurrency, max_items in configs:
+        count, elapsed = run(args.docs, args.lines_per_doc, args.latency_ms,
+                             concurrency, args.max_tokens, max_items)
+        print(f"{concurrency:>11} {max_items:>6} {count:>7} {elapsed:>9.2f} {count / elapsed:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Import-time budget for the query entry points.
+
+Imports each module in a fresh interpreter (python -X importtime), takes the median
+over several runs, and checks that it stays within the budget and does not load
+modules that should only be imported on first use (openai, faiss, numpy). Exits
+non-zero when a budget is exceeded, so it can run in CI. Run from the repository root:
+
+    python -m benchmarks.import_time --budget-ms 250 --runs 5
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Entry point -> modules it must not import at startup
+TARGETS = {
+    "cli": ("openai", "faiss", "numpy"),
+    "prompt_flow": ("openai", "faiss", "numpy"),
+    "coderag.query_client": ("openai", "faiss", "numpy"),
+}
+
+
+def import_ms(module):
+    """Cumulative import time of module in a fresh interpreter, in ms."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True
+    )
+    for line in reversed(result.stderr.splitlines()):
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000.0
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+def loaded_modules(module, candidates):
+    """Which of candidates are in sys.modules after importing module."""
+    result = subprocess.run(
+        [sys.executable, "-c", f"import sys, json, {module}; "
+                               f"print(json.dumps([m for m in {list(candidates)!r} if m in sys.modules]))"],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the query entry points")
+    parser.add_argument("--modules", nargs="+", default=list(TARGETS), help="Modules to import")
+    parser.add_argument("--budget-ms", type=float, default=250.0, help="Allowed median import time per module")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':>22} {'median_ms':>9} {'max_ms':>8}  eagerly loaded")
+    for module in args.modules:
+        times = [import_ms(module) for _ in range(args.runs)]
+        eager = loaded_modules(module, TARGETS.get(module, ()))
+        median = statistics.median(times)
+        print(f"{module:>22} {median:>9.1f} {max(times):>8.1f}  {', '.join(eager) or '-'}")
+        if median > args.budget_ms:
+            failures.append(f"{module} imports in {median:.0f} ms (budget {args.budget_ms:g} ms)")
+        if eager:
+            failures.append(f"{module} imports {', '.join(eager)} at startup")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Cost of publishing small index updates, fully offline.
+
+Builds a shard over a synthetic corpus, then repeatedly changes a few files and
+publishes the change, either appended as a segment (IndexShard.save, what the file
+monitor does) or as a full rewrite of the index (IndexShard.merge). Reports the
+time per publish, bytes written per publish, the time readers take to reload the
+published index and p50 search latency with the accumulated segments. Embeddings
+come from the deterministic fake backend. Run from the repository root:
+
+    python -m benchmarks.index_updates --size 50000 --saves 8 --files-per-save 2
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import numpy as np
+from benchmarks.retrieval import synthetic_corpus, directory_mb, percentiles
+
+CHUNKS_PER_FILE = 50
+
+
+def written_mb(directory, before):
+    """MB of files in directory that were not there before."""
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for name in set(os.listdir(directory)) - before) / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish cost of small updates: appended segments vs full rewrites")
+    parser.add_argument("--size", type=int, default=50000, help="Corpus size in chunks")
+    parser.add_argument("--dim", type=int, default=256, help="Fake embedding dimension")
+    parser.add_argument("--saves", type=int, default=8, help="Updates published per mode")
+    parser.add_argument("--files-per-save", type=int, default=2, help="Files changed per update")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="coderag-bench-")
+    # Configure the fake backend and a scratch index before anything reads coderag.config
+    os.environ["EMBEDDING_BACKEND"] = "fake"
+    os.environ["EMBEDDING_DIM"] = str(args.dim)
+    os.environ["ENABLE_EMBEDDING_CACHE"] = "false"
+    os.environ["INDEX_DIR"] = os.path.join(workdir, "index")
+    os.environ["WATCHED_DIR"] = workdir
+    os.environ.pop("INDEX_SHARDS", None)
+    os.environ.setdefault("OPENAI_API_KEY", "unused-by-fake-backend")
+
+    from coderag.embeddings import fake_embed_batch
+    from coderag.index import IndexShard, get_shard
+    from coderag.search import search_code
+
+    try:
+        rng = np.random.default_rng(args.seed)
+        texts, tokens, ranks = synthetic_corpus(args.size, rng)
+        vectors = np.concatenate([fake_embed_batch(texts[i:i + 4096], dim=args.dim, latency_ms=0)
+                                  for i in range(0, args.size, 4096)])
+        writer = get_shard()
+        files = [os.path.join(workdir, f"f{i}.py") for i in range(0, args.size, CHUNKS_PER_FILE)]
+        for number, filepath in enumerate(files):
+            start = number * CHUNKS_PER_FILE
+            writer.upsert(filepath, [{"content": text, "embedding": vector} for text, vector in
+                                     zip(texts[start:start + CHUNKS_PER_FILE], vectors[start:start + CHUNKS_PER_FILE])])
+        writer.save()
+        queries = [" ".join(list(dict.fromkeys(row[np.argsort(-rank)]))[:4])
+                   for row, rank in zip(tokens[:args.queries], ranks[:args.queries])]
+        print(f"{args.size} chunks, {directory_mb(writer.directory):.1f} MB on disk, "
+              f"{args.files_per_save} changed files ({args.files_per_save * CHUNKS_PER_FILE} chunks) per update")
+
+        print(f"{'mode':>8} {'publish_ms':>10} {'written_mb':>10} {'reload_ms':>9} {'search_p50_ms':>13}")
+        version = 0
+        for mode, publish in (("segment", writer.save), ("full", writer.merge)):
+            publish_ms, written, reload_ms = [], [], []
+            for _ in range(args.saves):
+                version += 1
+                for filepath in rng.choice(files, args.files_per_save, replace=False):
+                    changed = [f"# revision {version}\n{text}" for text in texts[:CHUNKS_PER_FILE]]
+                    writer.upsert(filepath, [{"content": text, "embedding": vector} for text, vector in
+                                             zip(changed, fake_embed_batch(changed, dim=args.dim, latency_ms=0))])
+                before = set(os.listdir(writer.directory))
+                start = time.perf_counter()
+                publish()
+                publish_ms.append((time.perf_counter() - start) * 1000)
+                written.append(written_mb(writer.directory, before))
+
+                # A reader process sees the new header and maps the published index
+                reader = IndexShard(writer.name, writer.root, writer.directory, writer.manifest_file)
+                start = time.perf_counter()
+                snapshot = reader.get_snapshot()
+                reload_ms.append((time.perf_counter() - start) * 1000)
+
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                search_code(query, k=10, snapshot=[snapshot])
+                latencies.append((time.perf_counter() - start) * 1000)
+            print(f"{mode:>8} {statistics.median(publish_ms):>10.1f} {statistics.median(written):>10.2f} "
+                  f"{statistics.median(reload_ms):>9.1f} {percentiles(latencies)['p50_ms']:>13.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
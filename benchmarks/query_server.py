@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Load benchmark of the query server against in-process search, fully offline.
+
+Closed-loop clients each send queries back to back, either calling search_code
+in-process (every query is its own embedding request and FAISS search) or through
+query servers started with server.py, with and without micro-batching. Reports
+queries per second, p50/p95/p99 latency and embedding requests per query for each
+concurrency level. Embeddings come from the fake backend with a simulated
+per-request latency. Run from the repository root:
+
+    python -m benchmarks.query_server --size 20000 --clients 1 8 32 --latency-ms 50
+"""
+
+import argparse
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import numpy as np
+from benchmarks.retrieval import synthetic_corpus, percentiles
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(window_ms, max_batch, workers):
+    """Run server.py in its own process, as deployed; returns (process, url) once it answers."""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "server.py", "--port", str(port), "--batch-window-ms", str(window_ms),
+         "--batch-max", str(max_batch), "--workers", str(workers)],
+        stdout=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url + "/health", timeout=1).close()
+            return process, url
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("query server did not start")
+
+
+def server_metrics(url):
+    with urllib.request.urlopen(url + "/metrics") as response:
+        return response.read().decode("utf-8")
+
+
+def embedding_requests(text):
+    """Embedding requests sent so far, from metrics in the Prometheus text format."""
+    match = re.search(r'^coderag_stage_seconds_count\{stage="embedding_request"\} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+
+def run_clients(search, queries, clients, duration):
+    """Run closed-loop clients for duration seconds; returns (queries per second, latencies in ms)."""
+    latencies = [[] for _ in range(clients)]
+    stop = time.perf_counter() + duration
+
+    def client(number):
+        i = number
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            search(queries[i % len(queries)])
+            latencies[number].append((time.perf_counter() - start) * 1000)
+            i += clients
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    merged = [latency for per_client in latencies for latency in per_client]
+    return len(merged) / elapsed, merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query server throughput and tail latency under concurrent load")
+    parser.add_argument("--size", type=int, default=20000, help="Corpus size in chunks")
+    parser.add_argument("--dim", type=int, default=256, help="Fake embedding dimension")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Simulated latency per embedding request")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per run")
+    parser.add_argument("--batch-window-ms", type=float, default=5.0)
+    parser.add_argument("--batch-max", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4, help="Batches the batching server processes at once")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="coderag-bench-")
+    # Configure the fake backend and a scratch index before anything reads coderag.config
+    os.environ["EMBEDDING_BACKEND"] = "fake"
+    os.environ["FAKE_EMBEDDING_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["EMBEDDING_DIM"] = str(args.dim)
+    os.environ["ENABLE_QUERY_CACHE"] = "false"
+    os.environ["ENABLE_EMBEDDING_CACHE"] = "false"
+    os.environ["INDEX_DIR"] = os.path.join(workdir, "index")
+    os.environ.pop("INDEX_SHARDS", None)
+    os.environ.pop("SEARCH_SHARDS", None)
+    os.environ.setdefault("OPENAI_API_KEY", "unused-by-fake-backend")
+
+    from coderag import storage, query_client
+    from coderag import metrics
+    from coderag.bm25 import BM25Index
+    from coderag.config import INDEX_DIR
+    from coderag.embeddings import fake_embed_batch, embedding_model_name
+    from coderag.index import get_snapshots
+    from coderag.search import search_code
+    from coderag.vector_store import VectorStore
+
+    processes = []
+    try:
+        rng = np.random.default_rng(args.seed)
+        texts, tokens, ranks = synthetic_corpus(args.size, rng)
+        vectors = np.concatenate([fake_embed_batch(texts[i:i + 4096], dim=args.dim, latency_ms=0)
+                                  for i in range(0, args.size, 4096)])
+        ids = np.arange(args.size, dtype='int64')
+        store = VectorStore(args.dim)
+        store.add(ids, vectors)
+        entries = [{"content": text, "filename": f"f{i // 50}.py", "filepath": f"pkg/f{i // 50}.py",
+                    "name": f"fn_{i}", "line_start": 1, "line_end": text.count("\n") + 1}
+                   for i, text in enumerate(texts)]
+        storage.write_generation(
+            INDEX_DIR, ids, store.unit, store.norms, entries, (), BM25Index.from_documents(zip(ids.tolist(), texts)),
+            None, dim=args.dim, model=embedding_model_name(), metric="cosine", index_type="flat"
+        )
+        del vectors, store
+        snapshots = get_snapshots()
+        queries = [" ".join(list(dict.fromkeys(row[np.argsort(-rank)]))[:4]) for row, rank in zip(tokens, ranks)]
+
+        # The same server with and without micro-batching (one query per batch, a worker per client)
+        unbatched, unbatched_url = start_server(0, 1, max(args.clients))
+        processes.append(unbatched)
+        batched, batched_url = start_server(args.batch_window_ms, args.batch_max, args.workers)
+        processes.append(batched)
+
+        modes = {
+            "in-process": (lambda query: search_code(query, k=args.k, snapshot=snapshots), metrics.render_prometheus),
+            "unbatched": (lambda query: query_client.search(query, k=args.k, url=unbatched_url),
+                          lambda: server_metrics(unbatched_url)),
+            "batched": (lambda query: query_client.search(query, k=args.k, url=batched_url),
+                        lambda: server_metrics(batched_url)),
+        }
+        print(f"{args.size} chunks, {args.latency_ms:g} ms per embedding request, "
+              f"{args.batch_window_ms:g} ms batch window")
+        print(f"{'mode':>10} {'clients':>7} {'qps':>8} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} {'req/query':>9}")
+        for clients in args.clients:
+            for mode, (search, current_metrics) in modes.items():
+                before = embedding_requests(current_metrics())
+                qps, latencies = run_clients(search, queries, clients, args.duration)
+                per_query = (embedding_requests(current_metrics()) - before) / len(latencies)
+                stats = percentiles(latencies)
+                print(f"{mode:>10} {clients:>7} {qps:>8.1f} {stats['p50_ms']:>8.2f} "
+                      f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} {per_query:>9.2f}")
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
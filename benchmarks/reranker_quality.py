@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+NDCG and latency of each reranker over hybrid search results.
+
+Queries are the first docstring line of functions and methods in a source tree
+(this repository by default); the docstrings are stripped from the indexed chunks,
+so each query has exactly one relevant chunk that doesn't contain the query text.
+With --variants, each query is searched together with its query_variants (synonym
+expansion and intent rewrite), as retrieve() does. Embeddings use the configured backend (EMBEDDING_BACKEND=fake works offline).
+Run from the repository root:
+
+    python -m benchmarks.reranker_quality --rerankers none features cross_encoder llm --json rerank.json
+    python -m benchmarks.reranker_quality --variants
+"""
+
+import argparse
+import ast
+import json
+import math
+import os
+import textwrap
+import time
+import numpy as np
+from coderag.bm25 import BM25Index
+from coderag.code_chunker import extract_code_elements
+from coderag.config import EMBEDDING_DIM
+from coderag.embeddings import embed_batch
+from coderag.index import IndexSnapshot
+from coderag.index_factory import build_index
+from coderag.query_enhancement import query_variants
+from coderag.rerankers import get_reranker
+from coderag.search import search_code
+from coderag.vector_store import VectorStore
+
+
+def docstring_span(chunk_content):
+    """(first docstring line, content without the docstring) for a function chunk, or None."""
+    try:
+        # Methods are indented; dedenting keeps line numbers
+        tree = ast.parse(textwrap.dedent(chunk_content))
+    except SyntaxError:
+        return None
+    function = next((node for node in tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))), None)
+    docstring = ast.get_docstring(function) if function else None
+    if not docstring or len(docstring.split()) < 4:
+        return None
+    node = function.body[0]
+    lines = chunk_content.split('\n')
+    return docstring.strip().split('\n')[0], '\n'.join(lines[:node.lineno - 1] + lines[node.end_lineno:])
+
+
+def build_dataset(root):
+    """Chunks (id -> metadata) and (query, relevant id) pairs from the Python files under root."""
+    metadata = {}
+    queries = []
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and d not in ("__pycache__", "node_modules", "benchmarks")]
+        for file in sorted(files):
+            if not file.endswith(".py"):
+                continue
+            path = os.path.join(directory, file)
+            with open(path, encoding="utf-8") as f:
+                content = f.read()
+            for chunk in extract_code_elements(content, path):
+                chunk_id = len(metadata)
+                entry = dict(chunk, filename=file, filepath=os.path.relpath(path, root))
+                if chunk["type"] in ("function", "method"):
+                    split = docstring_span(chunk["content"])
+                    if split is not None:
+                        query, entry["content"] = split
+                        queries.append((query, chunk_id))
+                metadata[chunk_id] = entry
+    return metadata, queries
+
+
+def build_snapshot(metadata):
+    ids = list(metadata)
+    texts = [f"# {m['filepath']} ({m['type']} {m['name']})\n{m['content']}" for m in metadata.values()]
+    vectors = np.concatenate([embed_batch(texts[i:i + 256]) for i in range(0, len(texts), 256)])
+    store = VectorStore(EMBEDDING_DIM)
+    store.add(ids, vectors)
+    bm25 = BM25Index.from_documents((i, m['content']) for i, m in metadata.items())
+    return IndexSnapshot(build_index(ids, vectors, index_type="flat"), metadata, store, bm25, 1, None)
+
+
+def ndcg_at_k(ranked_ids, relevant, k):
+    for rank, chunk in enumerate(ranked_ids[:k]):
+        if chunk == relevant:
+            return 1.0 / math.log2(rank + 2)
+    return 0.0
+
+
+def reciprocal_rank(ranked_ids, relevant):
+    for rank, chunk in enumerate(ranked_ids):
+        if chunk == relevant:
+            return 1.0 / (rank + 1)
+    return 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reranker NDCG and latency over hybrid search candidates")
+    parser.add_argument("--root", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help="Source tree to build queries from")
+    parser.add_argument("--rerankers", nargs="+", default=["none", "features"],
+                        help="Backends to compare: none (hybrid search order), features, cross_encoder, llm")
+    parser.add_argument("--candidates", type=int, default=20, help="Search results handed to the reranker")
+    parser.add_argument("--k", type=int, default=5, help="Cutoff for NDCG@k")
+    parser.add_argument("--max-queries", type=int, default=200)
+    parser.add_argument("--variants", action="store_true", help="Also search each query's rewrites (query_variants)")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    metadata, queries = build_dataset(args.root)
+    queries = queries[:args.max_queries]
+    snapshot = build_snapshot(metadata)
+    # search_code copies fields out of metadata; map results back to chunk ids by location
+    ids_by_location = {(entry["filepath"], entry["line_start"]): chunk for chunk, entry in metadata.items()}
+    print(f"{len(metadata)} chunks, {len(queries)} queries, {args.candidates} candidates per query")
+
+    candidates = []
+    for query, relevant in queries:
+        variants = query_variants(query) if args.variants else None
+        results = search_code(query, k=args.candidates, snapshot=snapshot, variants=variants)
+        for result in results:
+            result["_id"] = ids_by_location[(result["filepath"], result["line_start"])]
+        candidates.append((query, relevant, results))
+    in_pool = np.mean([any(r["_id"] == relevant for r in results) for _, relevant, results in candidates])
+    print(f"Relevant chunk among the candidates for {in_pool:.1%} of queries")
+
+    print(f"{'reranker':>14} {'ndcg@' + str(args.k):>8} {'mrr':>6} {'p50_ms':>8} {'p95_ms':>8}")
+    rows = []
+    for name in args.rerankers:
+        reranker = get_reranker(name)
+        ndcgs, rrs, latencies = [], [], []
+        try:
+            for query, relevant, results in candidates:
+                start = time.perf_counter()
+                ranked = reranker.rerank(query, list(results), top_k=args.k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                ranked_ids = [result["_id"] for result in ranked]
+                ndcgs.append(ndcg_at_k(ranked_ids, relevant, args.k))
+                rrs.append(reciprocal_rank(ranked_ids, relevant))
+        except ImportError as e:
+            print(f"{name:>14} skipped: {e}")
+            continue
+        row = {
+            "reranker": name,
+            "ndcg_at_k": float(np.mean(ndcgs)),
+            "mrr": float(np.mean(rrs)),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+        }
+        rows.append(row)
+        print(f"{name:>14} {row['ndcg_at_k']:>8.3f} {row['mrr']:>6.3f} {row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "queries": len(candidates), "results": rows}, f, indent=2)
+        print(f"Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
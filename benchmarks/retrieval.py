@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+End-to-end retrieval benchmark over synthetic corpora, fully offline.
+
+For each corpus size and FAISS index type it reports build time, time to save and
+load the on-disk index, p50/p95/p99 latency of search_code and of the keyword
+search alone, resident memory of the loaded index, on-disk size, recall@k of the
+semantic stage against exact search, and how often the chunk a query was drawn
+from comes back in the top k. Queries naming a function ("where is `fn_42`
+defined") measure the symbol table path: p50 latency and hit@1. Embeddings come from the deterministic fake backend.
+Run from the repository root:
+
+    python -m benchmarks.retrieval --sizes 1000 10000 100000 --json retrieval.json
+    python -m benchmarks.retrieval --sizes 1000 10000 --baseline retrieval.json  # compare with an earlier run
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")  # Same as coderag.index_factory, which reads config on import
+
+
+def rss_mb():
+    """Current resident set size in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def directory_mb(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files) / 2 ** 20
+
+
+def synthetic_corpus(n, rng, vocabulary=20000, tokens_per_chunk=40):
+    """
+    n code-like chunks whose identifiers follow a Zipf distribution, like real code.
+    Returns (texts, tokens per chunk, frequency rank of each token).
+    """
+    words = np.array([f"{a}_{b}" for a in ("get", "set", "load", "save", "parse", "build", "index", "query",
+                                           "embed", "cache", "file", "path", "node", "rank", "score", "token",
+                                           "chunk", "batch", "vector", "store")
+                      for b in range(vocabulary // 20)])
+    draws = np.minimum(rng.zipf(1.3, size=(n, tokens_per_chunk)) - 1, len(words) - 1)
+    permutation = rng.permutation(len(words))
+    tokens = words[permutation[draws]]
+    return [
+        f"def fn_{i}({row[0]}, {row[1]}):\n    " + "\n    ".join(
+            f"{row[j]} = {row[j + 1]}({row[j + 2]})" for j in range(2, tokens_per_chunk - 2, 3)
+        )
+        for i, row in enumerate(tokens)
+    ], tokens, draws
+
+
+def percentiles(values_ms):
+    values = np.array(values_ms)
+    return {f"p{p}_ms": float(np.percentile(values, p)) for p in (50, 95, 99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark over synthetic corpora")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="Corpus sizes in chunks")
+    parser.add_argument("--index-types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument("--dim", type=int, default=256, help="Fake embedding dimension")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--baseline", help="Earlier --json report to compare latencies and recall against")
+    args = parser.parse_args()
+
+    # Configure the fake backend before anything reads coderag.config
+    os.environ["EMBEDDING_BACKEND"] = "fake"
+    os.environ["FAKE_EMBEDDING_LATENCY_MS"] = "0"
+    os.environ["EMBEDDING_DIM"] = str(args.dim)
+    os.environ["ENABLE_QUERY_CACHE"] = "false"
+    os.environ["ENABLE_EMBEDDING_CACHE"] = "false"
+    os.environ.setdefault("OPENAI_API_KEY", "unused-by-fake-backend")
+
+    import faiss
+    from coderag import storage
+    from coderag.bm25 import BM25Index
+    from coderag.embeddings import fake_embed_batch, embedding_model_name
+    from coderag.index import IndexShard
+    from coderag.index_factory import build_index, min_training_vectors
+    from coderag.search import search_code, keyword_search, semantic_search
+    from coderag.symbols import SymbolIndex
+    from coderag.vector_store import VectorStore
+
+    rng = np.random.default_rng(args.seed)
+    rows = []
+    workdir = tempfile.mkdtemp(prefix="coderag-bench-")
+    try:
+        for size in args.sizes:
+            start = time.perf_counter()
+            texts, tokens, ranks = synthetic_corpus(size, rng)
+            vectors = np.concatenate([fake_embed_batch(texts[i:i + 4096], dim=args.dim)
+                                      for i in range(0, size, 4096)])
+            embed_seconds = time.perf_counter() - start
+            ids = np.arange(size, dtype='int64')
+            entries = [{"content": text, "filename": f"f{i // 50}.py", "filepath": f"pkg/f{i // 50}.py",
+                        "type": "function", "name": f"fn_{i}", "line_start": 1, "line_end": text.count("\n") + 1}
+                       for i, text in enumerate(texts)]
+            sources = rng.choice(size, size=min(args.queries, size), replace=False)
+            # Like a user naming the identifiers they remember: the chunk's four rarest ones
+            queries = [" ".join(list(dict.fromkeys(tokens[i][np.argsort(-ranks[i])]))[:4]) for i in sources]
+            print(f"\n{size} chunks (generated and embedded in {embed_seconds:.1f}s), {len(queries)} queries")
+            print(f"{'index':>9} {'build_s':>8} {'save_s':>7} {'load_s':>7} {'search_p50':>10} {'p95':>7} "
+                  f"{'p99':>7} {'kw_p50':>7} {'rss_mb':>7} {'disk_mb':>8} {'recall':>7} {'hit@k':>6} "
+                  f"{'sym_p50':>7} {'sym@1':>6}")
+
+            # Exact cosine top k per query: the ground truth for the ANN recall
+            query_vectors = fake_embed_batch(queries, dim=args.dim)
+            unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            similarities = unit @ (query_vectors / np.maximum(np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12)).T
+            exact = [set(np.argpartition(-column, args.k)[:args.k].tolist()) for column in similarities.T]
+            del unit, similarities
+            for index_type in args.index_types:
+                if size < min_training_vectors(index_type):
+                    print(f"{index_type:>9} skipped: needs {min_training_vectors(index_type)} vectors to train")
+                    continue
+                start = time.perf_counter()
+                faiss_index = build_index(ids, vectors, index_type=index_type, dim=args.dim)
+                store = VectorStore(args.dim)
+                store.add(ids, vectors)
+                bm25 = BM25Index.from_documents(zip(ids.tolist(), texts))
+                symbols = SymbolIndex.from_entries(zip(ids.tolist(), entries))
+                build_seconds = time.perf_counter() - start
+
+                # Publish a generation and map it back the same way the query side does
+                directory = os.path.join(workdir, f"{size}-{index_type}")
+                shard = IndexShard(f"{size}-{index_type}", workdir, directory, os.path.join(workdir, "manifest.json"))
+                faiss_bytes = None if index_type == "flat" else faiss.serialize_index(faiss_index).tobytes()
+                start = time.perf_counter()
+                storage.write_generation(
+                    directory, ids, store.unit, store.norms, entries, (), bm25, faiss_bytes, symbols,
+                    dim=args.dim, model=embedding_model_name(), metric="cosine", index_type=index_type
+                )
+                save_seconds = time.perf_counter() - start
+                del faiss_index, store, bm25, symbols, faiss_bytes
+
+                rss_before = rss_mb()
+                start = time.perf_counter()
+                snapshot = shard.get_snapshot()
+                load_seconds = time.perf_counter() - start
+                loaded_rss = rss_mb() - rss_before
+
+                search_ms, keyword_ms, semantic_ids, hits = [], [], [], 0
+                for query, source, query_vector in zip(queries, sources, query_vectors):
+                    start = time.perf_counter()
+                    results = search_code(query, k=args.k, metric="cosine", snapshot=snapshot)
+                    search_ms.append((time.perf_counter() - start) * 1000)
+                    hits += any(result["name"] == f"fn_{source}" for result in results)
+                    start = time.perf_counter()
+                    keyword_search(query, snapshot.bm25, args.k)
+                    keyword_ms.append((time.perf_counter() - start) * 1000)
+                    found, scores = semantic_search(snapshot, query_vector[None, :], args.k, "cosine")
+                    semantic_ids.append({found[i] for i in np.argsort(scores)[::-1][:args.k]})
+                recall = np.mean([len(found & truth) / max(len(truth), 1) for found, truth in zip(semantic_ids, exact)])
+
+                symbol_ms, symbol_hits = [], 0
+                for source in sources:
+                    start = time.perf_counter()
+                    results = search_code(f"where is `fn_{source}` defined", k=args.k, metric="cosine", snapshot=snapshot)
+                    symbol_ms.append((time.perf_counter() - start) * 1000)
+                    symbol_hits += bool(results) and results[0]["name"] == f"fn_{source}"
+
+                row = {
+                    "size": size, "index": index_type, "dim": args.dim, "model": embedding_model_name(),
+                    "build_s": build_seconds, "save_s": save_seconds, "load_s": load_seconds,
+                    "search": percentiles(search_ms), "keyword_search": percentiles(keyword_ms),
+                    "loaded_rss_mb": loaded_rss, "disk_mb": directory_mb(directory),
+                    "recall_at_k": float(recall), "hit_at_k": hits / len(queries),
+                    "symbol_search": percentiles(symbol_ms), "symbol_hit_at_1": symbol_hits / len(sources),
+                }
+                rows.append(row)
+                print(f"{index_type:>9} {build_seconds:>8.2f} {save_seconds:>7.2f} {load_seconds:>7.3f} "
+                      f"{row['search']['p50_ms']:>10.2f} {row['search']['p95_ms']:>7.2f} "
+                      f"{row['search']['p99_ms']:>7.2f} {row['keyword_search']['p50_ms']:>7.2f} "
+                      f"{loaded_rss:>7.1f} {row['disk_mb']:>8.1f} {recall:>7.3f} {row['hit_at_k']:>6.3f} "
+                      f"{row['symbol_search']['p50_ms']:>7.2f} {row['symbol_hit_at_1']:>6.3f}")
+                del snapshot, shard
+                shutil.rmtree(directory, ignore_errors=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"config": vars(args), "storage_format": storage.FORMAT_VERSION, "results": rows}
+    if args.baseline:
+        compare(report, args.baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+
+
+def compare(report, baseline_path):
+    """Print the change of p50/p95 search latency and recall against an earlier report."""
+    with open(baseline_path) as f:
+        baseline = {(row["size"], row["index"]): row for row in json.load(f)["results"]}
+    print(f"\nChange against {baseline_path}:")
+    for row in report["results"]:
+        old = baseline.get((row["size"], row["index"]))
+        if old is None:
+            continue
+        changes = [
+            f"{key} {old['search'][key]:.2f} -> {row['search'][key]:.2f} ms "
+            f"({(row['search'][key] / max(old['search'][key], 1e-9) - 1) * 100:+.0f}%)"
+            for key in ("p50_ms", "p95_ms")
+        ]
+        changes.append(f"recall {old['recall_at_k']:.3f} -> {row['recall_at_k']:.3f}")
+        print(f"  {row['size']:>8} {row['index']:>9}: " + ", ".join(changes))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,19 +5,39 @@ Simple CLI for CodeRAG - Query only (no indexing)
 
 import argparse
 import sys
-from openai import OpenAI
-from coderag.config import OPENAI_API_KEY
-from prompt_flow import execute_rag_flow
+from coderag.config import QUERY_SERVER_URL
+from coderag import query_cache, query_client
+from coderag.metrics import trace, format_trace, render_prometheus, write_metrics
+from prompt_flow import stream_rag_flow
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY)
 
+def print_streamed(query, metric=None, profile=False, shards=None):
+    """Print the answer as it is generated; with profile, follow it with the time spent in each stage."""
+    with trace() as spans:
+        for piece in stream_rag_flow(query, metric=metric, shards=shards):
+            print(piece, end="", flush=True)
+        print()
+    if profile:
+        print("\n⏱️  Profile:")
+        print(format_trace(spans))
+    write_metrics()
 
-def interactive_mode():
+
+def interactive_mode(metric=None, profile=False, shards=None):
     """Interactive chat mode"""
     print("CodeRAG CLI - Interactive Mode")
-    print("Type 'quit', 'exit', or 'q' to exit")
+    print("Type 'quit', 'exit', or 'q' to exit, 'stats' for cache statistics, 'metrics' for all metrics")
     print("-" * 40)
+
+    # Load the index once up front (or check the query server); later queries reuse it until the files change
+    try:
+        if QUERY_SERVER_URL:
+            query_client.health()
+        else:
+            from coderag.index import get_snapshots
+            get_snapshots(shards)
+    except Exception as e:
+        print(f"⚠️  Index not loaded yet: {e}")
     
     while True:
         try:
@@ -29,10 +49,19 @@ def interactive_mode():
             
             if not query:
                 continue
+
+            if query.lower() == 'stats':
+                for tier, counts in query_cache.stats().items():
+                    print(f"{tier}: {counts['hits']} hits, {counts['misses']} misses, {counts['entries']} entries")
+                continue
+
+            if query.lower() == 'metrics':
+                print(render_prometheus(), end="")
+                continue
                 
             print("\n🔍 Searching...")
-            response = execute_rag_flow(query)
-            print(f"\n📝 Response:\n{response}")
+            print("\n📝 Response:")
+            print_streamed(query, metric, profile, shards)
             
         except KeyboardInterrupt:
             print("\n\nGoodbye!")
@@ -41,13 +70,13 @@ def interactive_mode():
             print(f"\n❌ Error: {str(e)}")
 
 
-def single_query(query):
+def single_query(query, metric=None, profile=False, shards=None):
     """Execute a single query"""
     try:
         print(f"Query: {query}")
         print("-" * 40)
-        response = execute_rag_flow(query)
-        print(f"Response:\n{response}")
+        print("Response:")
+        print_streamed(query, metric, profile, shards)
     except Exception as e:
         print(f"Error: {str(e)}")
         sys.exit(1)
@@ -76,15 +105,26 @@ You can select the distance metric via CLI with --distance
         action='store_true',
         help='Force interactive mode (default if no query provided)'
     )
+
+    parser.add_argument(
+        '--shards', type=lambda value: [name.strip() for name in value.split(",") if name.strip()],
+        default=None, help='Comma-separated index shards to search (default: SEARCH_SHARDS, else all)'
+    )
+
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Print the time spent in each stage (embedding, search, rerank, generation) after every answer'
+    )
     
     args = parser.parse_args()
     
     # If query is provided, run single query mode
     if args.query:
-        single_query(args.query)
+        single_query(args.query, metric=args.distance, profile=args.profile, shards=args.shards)
     else:
         # Default to interactive mode
-        interactive_mode()
+        interactive_mode(metric=args.distance, profile=args.profile, shards=args.shards)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,89 @@
+import heapq
+import math
+import pickle
+import re
+from collections import Counter
+from operator import itemgetter
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+def tokenize(text):
+    """Split text into lowercase word tokens (same tokenization as query terms)."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """
+    Inverted index with BM25 scoring.
+
+    Postings map each term to {doc_id: term frequency}, so a query only walks the
+    posting lists of its own terms instead of re-tokenizing the whole corpus.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, doc_id, text):
+        """Index a document under doc_id."""
+        terms = tokenize(text)
+        for term, tf in Counter(terms).items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self.doc_lengths[doc_id] = len(terms)
+        self.total_length += len(terms)
+
+    def remove(self, doc_id, text):
+        """Remove a document; text must be what it was indexed with."""
+        if doc_id not in self.doc_lengths:
+            return
+        for term in set(tokenize(text)):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def idf(self, term):
+        """Inverse document frequency of a term (BM25+ style, never negative)."""
+        df = len(self.postings.get(term, ()))
+        n = len(self.doc_lengths)
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k=10):
+        """Return up to k (doc_id, score) pairs with the highest BM25 score."""
+        if not self.doc_lengths:
+            return []
+        avg_length = self.total_length / len(self.doc_lengths) or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=itemgetter(1))
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    @classmethod
+    def from_documents(cls, documents, **kwargs):
+        """Build an index from an iterable of (doc_id, text) pairs."""
+        bm25 = cls(**kwargs)
+        for doc_id, text in documents:
+            bm25.add(doc_id, text)
+        return bm25
@@ -0,0 +1,34 @@
+import threading
+from .config import OPENAI_API_KEY
+
+# openai is imported on first use: it takes longer to import than the rest of coderag
+_clients = {}  # (async, max_retries) -> client
+_clients_lock = threading.Lock()
+
+def get_client(max_retries=2):
+    """
+    The process-wide OpenAI client, created on first use. Clients with other
+    max_retries are copies sharing its HTTP connection pool.
+    """
+    return _get_client(False, max_retries)
+
+def get_async_client(max_retries=2):
+    """The process-wide AsyncOpenAI client; see get_client."""
+    return _get_client(True, max_retries)
+
+def _get_client(asynchronous, max_retries):
+    key = (asynchronous, max_retries)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                shared = next((c for (a, _), c in _clients.items() if a == asynchronous), None)
+                if shared is not None:
+                    client = shared.with_options(max_retries=max_retries)
+                else:
+                    import openai
+                    client_class = openai.AsyncOpenAI if asynchronous else openai.OpenAI
+                    client = client_class(api_key=OPENAI_API_KEY, max_retries=max_retries)
+                _clients[key] = client
+    return client
@@ -1,84 +1,157 @@
 import ast
 import re
+from .config import ENABLE_CODE_CHUNKING, CODE_CHUNK_MAX_LINES
 
-def extract_code_elements(content, filepath):
-    """Extract functions, classes, and important code blocks with context."""
+# Recorded in the manifest: changing the chunking scheme invalidates every stored chunk
+CHUNKER_VERSION = "ast-3" if ENABLE_CODE_CHUNKING else "file"
+
+DEFINITIONS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+def _first_line(node):
+    """1-based first line of a statement, including its decorators."""
+    return min([node.lineno] + [decorator.lineno for decorator in getattr(node, 'decorator_list', [])])
+
+def _with_leading_comments(lines, start, floor):
+    """Move a 1-based start line up over the comment lines directly above it (not past floor)."""
+    while start - 1 > floor and lines[start - 2].strip().startswith('#'):
+        start -= 1
+    return start
+
+def _make_chunk(lines, start, end, chunk_type, name, max_lines):
+    """One chunk per span of 1-based inclusive lines, split into parts if longer than max_lines."""
     chunks = []
-    
+    for part, part_start in enumerate(range(start, end + 1, max_lines)):
+        part_end = min(end, part_start + max_lines - 1)
+        content = '\n'.join(lines[part_start - 1:part_end])
+        if not content.strip():
+            continue
+        chunk = {
+            "content": content,
+            "type": chunk_type,
+            "name": name,
+            "line_start": part_start,
+            "line_end": part_end
+        }
+        if end - start + 1 > max_lines:
+            chunk["part"] = part + 1
+        chunks.append(chunk)
+    return chunks
+
+def _span(lines, start, end):
+    """A 1-based inclusive span without its leading and trailing blank lines."""
+    while start < end and not lines[start - 1].strip():
+        start += 1
+    while end > start and not lines[end - 1].strip():
+        end -= 1
+    return start, end
+
+def _chunk_body(body, lines, floor, scope, header_start, body_end, max_lines):
+    """
+    Chunk a module or class body.
+
+    Functions become one chunk each (nested functions stay inside them), classes
+    recurse so every method is its own chunk, and runs of other statements are
+    grouped. In a class the first run also carries the class header, so the class
+    chunk holds the signature, docstring and attributes but no method bodies.
+    Each statement's span runs from the comments directly above it to the line before
+    the next statement's, or to body_end, so every line of the body is in some chunk.
+    """
+    if not body:
+        return []
+    starts = []
+    previous_end = floor
+    for node in body:
+        starts.append(_with_leading_comments(lines, _first_line(node), previous_end))
+        previous_end = node.end_lineno
+    if header_start is None:
+        starts[0] = floor + 1  # Comments above the first statement, such as a license header
+    ends = [start - 1 for start in starts[1:]] + [body_end]
+
+    chunks = []
+    run_start = header_start
+    run_end = None
+    if header_start is not None:
+        # The class header ends right before its first body statement (and that statement's comments)
+        run_end = max(header_start, starts[0] - 1)
+    run_type = "class" if scope else "block"
+    run_name = scope or "module"
+
+    def flush():
+        if run_start is not None and run_end is not None:
+            chunks.extend(_make_chunk(lines, *_span(lines, run_start, run_end), run_type, run_name, max_lines))
+
+    for node, start, end in zip(body, starts, ends):
+        if isinstance(node, DEFINITIONS):
+            flush()
+            qualified = f"{scope}.{node.name}" if scope else node.name
+            if isinstance(node, ast.ClassDef):
+                chunks.extend(_chunk_body(node.body, lines, start, qualified, start, end, max_lines))
+            else:
+                chunk_type = "method" if scope else "function"
+                chunks.extend(_make_chunk(lines, *_span(lines, start, end), chunk_type, qualified, max_lines))
+            run_start, run_end = None, None
+        else:
+            if run_start is None:
+                run_start = start
+            run_end = end
+    flush()
+    return chunks
+
+def extract_code_elements(content, filepath, max_lines=CODE_CHUNK_MAX_LINES):
+    """
+    Split a Python file into functions, methods, class headers and module-level blocks.
+
+    Chunks don't overlap and cover every non-blank line; each has its exact 1-based,
+    inclusive line_start/line_end, so a hit returns only that span. Spans longer than
+    max_lines are split into parts.
+    """
+    lines = content.split('\n')
     try:
-        # Parse Python AST
         tree = ast.parse(content)
-        
-        lines = content.split('\n')
-        
-        for node in ast.walk(tree):
-            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
-                start_line = node.lineno - 1
-                end_line = node.end_lineno if hasattr(node, 'end_lineno') else start_line + 10
-                
-                # Get the actual code block
-                code_block = '\n'.join(lines[start_line:end_line])
-                
-                # Add context (docstring, imports above)
-                context_start = max(0, start_line - 5)
-                context_lines = lines[context_start:start_line]
-                
-                # Filter relevant context (imports, comments)
-                context = '\n'.join([
-                    line for line in context_lines 
-                    if line.strip().startswith(('import', 'from', '#', '"""', "'''"))
-                ])
-                
-                chunk_content = f"{context}\n\n{code_block}" if context else code_block
-                
-                chunks.append({
-                    "content": chunk_content,
-                    "type": "function" if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) else "class",
-                    "name": node.name,
-                    "line_start": start_line + 1,
-                    "line_end": end_line
-                })
-        
-        # If no functions/classes found, chunk by logical blocks
-        if not chunks:
-            chunks = chunk_by_blocks(content, filepath)
-            
+        chunks = _chunk_body(tree.body, lines, 0, None, None, len(lines), max_lines)
     except SyntaxError:
         # Fallback for malformed Python files
         chunks = chunk_by_blocks(content, filepath)
-    
-    return chunks if chunks else [{"content": content, "type": "file", "name": "full_file"}]
+
+    return chunks if chunks else [whole_file_chunk(content)]
+
+def whole_file_chunk(content):
+    return {"content": content, "type": "file", "name": "full_file", "line_start": 1, "line_end": content.count('\n') + 1}
+
+def file_chunks(content, filepath):
+    """Chunks to index for a file: AST chunks with ENABLE_CODE_CHUNKING, otherwise the whole file."""
+    if ENABLE_CODE_CHUNKING:
+        return extract_code_elements(content, filepath)
+    return [whole_file_chunk(content)]
 
 def chunk_by_blocks(content, filepath, max_lines=50):
     """Fallback chunking by logical blocks."""
     lines = content.split('\n')
     chunks = []
     current_chunk = []
-    current_lines = 0
-    
-    for line in lines:
+    chunk_start = 1
+
+    def add_chunk(chunk_lines, start):
+        chunks.append({
+            "content": '\n'.join(chunk_lines),
+            "type": "block",
+            "name": f"block_{len(chunks)}",
+            "line_start": start,
+            "line_end": start + len(chunk_lines) - 1
+        })
+
+    for line_number, line in enumerate(lines, 1):
         current_chunk.append(line)
-        current_lines += 1
-        
+
         # Split on class/function definitions or when chunk gets too large
-        if (line.strip().startswith(('def ', 'class ', 'async def ')) and current_lines > 10) or current_lines >= max_lines:
+        if (re.match(r'\s*(async\s+def|def|class)\s', line) and len(current_chunk) > 10) or len(current_chunk) >= max_lines:
             if len(current_chunk) > 1:  # Don't create tiny chunks
-                chunks.append({
-                    "content": '\n'.join(current_chunk[:-1]),
-                    "type": "block",
-                    "name": f"block_{len(chunks)}",
-                    "line_start": len(chunks) * max_lines + 1
-                })
+                add_chunk(current_chunk[:-1], chunk_start)
                 current_chunk = [line]
-                current_lines = 1
-    
+                chunk_start = line_number
+
     # Add remaining lines
     if current_chunk:
-        chunks.append({
-            "content": '\n'.join(current_chunk),
-            "type": "block",
-            "name": f"block_{len(chunks)}",
-            "line_start": len(chunks) * max_lines + 1
-        })
-    
-    return chunks
\ No newline at end of file
+        add_chunk(current_chunk, chunk_start)
+
+    return chunks
@@ -13,26 +13,135 @@ OPENAI_CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-4")
 # Embedding dimension (from .env or fallback)
 EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 1536))
 
+# Embedding backend: "openai", or "fake" for deterministic offline vectors (benchmarks, tests)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower()
+FAKE_EMBEDDING_LATENCY_MS = float(os.getenv("FAKE_EMBEDDING_LATENCY_MS", "0"))
+
+# Embedding request batching, concurrency and retry settings
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "100000"))  # Token budget per request
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))  # Max texts per request
+EMBEDDING_MAX_INPUT_TOKENS = int(os.getenv("EMBEDDING_MAX_INPUT_TOKENS", "8191"))  # Per-text model limit
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))  # Batches in flight
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+EMBEDDING_RETRY_BASE_DELAY = float(os.getenv("EMBEDDING_RETRY_BASE_DELAY", "1.0"))  # Seconds
+
+# FAISS index type: flat (exact), hnsw, ivf_flat or ivf_pq. IVF types are trained automatically when the
+# index is saved (it stays flat until FAISS_TRAIN_MIN_VECTORS vectors exist). FAISS_NLIST=0 picks ~sqrt(n).
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+FAISS_TRAIN_MIN_VECTORS = int(os.getenv("FAISS_TRAIN_MIN_VECTORS", "5000"))
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", "0"))
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "64"))  # PQ sub-quantizers (must divide EMBEDDING_DIM)
+FAISS_PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", "8"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_EF_CONSTRUCTION = int(os.getenv("FAISS_EF_CONSTRUCTION", "80"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+
 # Distance metric for retrieval
 RAG_DISTANCE_METRIC = os.getenv("RAG_DISTANCE_METRIC", "cosine")
 
 # Hybrid search settings
-HYBRID_SEARCH_ALPHA = float(os.getenv("HYBRID_SEARCH_ALPHA", "0.7"))  # Semantic vs keyword weight
+HYBRID_SEARCH_ALPHA = float(os.getenv("HYBRID_SEARCH_ALPHA", "0.5"))  # Semantic vs keyword weight in the rank fusion
+# Also search the synonym expansion and intent rewrite of each question (embedded in the same request)
 ENABLE_QUERY_EXPANSION = os.getenv("ENABLE_QUERY_EXPANSION", "true").lower() == "true"
+RRF_K = int(os.getenv("RRF_K", "2"))  # Rank fusion constant; small, so each ranking's top hits stay ahead of its tail
 ENABLE_LLM_RERANKING = os.getenv("ENABLE_LLM_RERANKING", "true").lower() == "true"
-ENABLE_CODE_CHUNKING = os.getenv("ENABLE_CODE_CHUNKING", "false").lower() == "true"
+# Result reranker: "features" (local, CPU-only), "cross_encoder" (local model), "llm" (OPENAI_CHAT_MODEL) or "none"
+RERANKER = os.getenv("RERANKER", "features")
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_SKIP_MARGIN = float(os.getenv("RERANK_SKIP_MARGIN", "0.25"))  # Skip the rerank call when the top hit leads the rest by this much on a raw signal (0 = always rerank)
+ENABLE_CODE_CHUNKING = os.getenv("ENABLE_CODE_CHUNKING", "true").lower() == "true"
+CODE_CHUNK_MAX_LINES = int(os.getenv("CODE_CHUNK_MAX_LINES", "200"))  # Longer definitions are split into parts
+
+# In-process query cache: query embeddings, ranked results (per index generation) and answers
+ENABLE_QUERY_CACHE = os.getenv("ENABLE_QUERY_CACHE", "true").lower() == "true"
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))  # Seconds
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1024"))  # Per tier
+
+# Prompt tokens available for retrieved code in the answer request
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+
+# Local query server (server.py): address, how long it gathers concurrent searches into one batch, and the
+# largest batch. Clients (cli.py, app.py) search through it instead of loading the index when QUERY_SERVER_URL is set.
+QUERY_SERVER_HOST = os.getenv("QUERY_SERVER_HOST", "127.0.0.1")
+QUERY_SERVER_PORT = int(os.getenv("QUERY_SERVER_PORT", "8765"))
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "64"))
+QUERY_SERVER_WORKERS = int(os.getenv("QUERY_SERVER_WORKERS", "4"))  # Batches processed concurrently
+QUERY_SERVER_URL = os.getenv("QUERY_SERVER_URL", "")
+QUERY_SERVER_TIMEOUT = float(os.getenv("QUERY_SERVER_TIMEOUT", "30"))  # Seconds
+
+# Where to write stage latency histograms and API/token/cache counters in Prometheus text format ("" = don't)
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+
+# BM25 keyword scoring parameters
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Symbol table lookups: queries naming a known function, method or class are answered from it (plus keyword
+# hits) without an embedding request; symbol hits are fused into the ranking with weight SYMBOL_BOOST (less when partial)
+ENABLE_SYMBOL_SEARCH = os.getenv("ENABLE_SYMBOL_SEARCH", "true").lower() == "true"
+SYMBOL_BOOST = float(os.getenv("SYMBOL_BOOST", "1.0"))
 
 # Project directory (from .env)
 WATCHED_DIR = os.getenv("WATCHED_DIR", os.path.join(os.getcwd(), 'CodeRAG'))
 
 FAISS_INDEX_FILE = os.getenv("FAISS_INDEX_FILE", os.path.join(WATCHED_DIR, 'coderag_index.faiss'))
 
+# Deleted vectors are tombstoned and purged from FAISS in the background once enough accumulate
+INDEX_COMPACT_INTERVAL = float(os.getenv("INDEX_COMPACT_INTERVAL", "30"))  # Seconds between checks
+INDEX_COMPACT_MIN_TOMBSTONES = int(os.getenv("INDEX_COMPACT_MIN_TOMBSTONES", "64"))
+
+# Saves append small segments; the compactor merges them into a new base once there are this many,
+# or once they hold this fraction of the base's rows
+INDEX_MERGE_SEGMENTS = int(os.getenv("INDEX_MERGE_SEGMENTS", "8"))
+INDEX_MERGE_RATIO = float(os.getenv("INDEX_MERGE_RATIO", "0.1"))
+
+# File monitor: per-path debounce window, worker threads and max paths applied per batch
+MONITOR_DEBOUNCE_SECONDS = float(os.getenv("MONITOR_DEBOUNCE_SECONDS", "0.5"))
+MONITOR_WORKERS = int(os.getenv("MONITOR_WORKERS", "2"))
+MONITOR_BATCH_SIZE = int(os.getenv("MONITOR_BATCH_SIZE", "256"))
+
+# Manifest of indexed files (path, mtime, size, content hash, row ids) used for incremental reindexing
+INDEX_MANIFEST_FILE = os.getenv(
+    "INDEX_MANIFEST_FILE", os.path.join(os.path.dirname(FAISS_INDEX_FILE), 'coderag_manifest.json')
+)
+
+# Directory holding the versioned, memory-mapped index (vectors, metadata, keyword index, ANN structure)
+INDEX_DIR = os.getenv("INDEX_DIR", os.path.join(os.path.dirname(FAISS_INDEX_FILE), 'coderag_index'))
+
+# Named index shards, one per repository or path prefix: "name=/path,name=/path". Each shard has its own
+# files (INDEX_DIR/<name>/) and generation. Unset: a single shard over WATCHED_DIR stored directly in INDEX_DIR.
+INDEX_SHARDS = {
+    name.strip(): os.path.abspath(os.path.expanduser(path.strip()))
+    for name, _, path in (item.partition("=") for item in os.getenv("INDEX_SHARDS", "").split(",") if item.strip())
+}
+# Name of the only shard when INDEX_SHARDS is not set
+DEFAULT_SHARD = "default"
+# Shards searched by default (comma-separated names; empty = all), and threads searching them in parallel
+SEARCH_SHARDS = [name.strip() for name in os.getenv("SEARCH_SHARDS", "").split(",") if name.strip()]
+SHARD_SEARCH_WORKERS = int(os.getenv("SHARD_SEARCH_WORKERS", "8"))
+
+# Persistent embedding cache keyed by (model, content hash), stored next to the FAISS index
+ENABLE_EMBEDDING_CACHE = os.getenv("ENABLE_EMBEDDING_CACHE", "true").lower() == "true"
+EMBEDDING_CACHE_FILE = os.getenv(
+    "EMBEDDING_CACHE_FILE", os.path.join(os.path.dirname(FAISS_INDEX_FILE), 'embedding_cache.sqlite')
+)
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024"))
+
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Absolute, like the shard roots the walks start from
 IGNORE_PATHS = [
-    os.path.join(WATCHED_DIR, ".venv"),
-    os.path.join(WATCHED_DIR, "node_modules"),
-    os.path.join(WATCHED_DIR, "__pycache__"),
-    os.path.join(WATCHED_DIR, ".git"),
-    os.path.join(WATCHED_DIR, "tests"),
-]
\ No newline at end of file
+    os.path.join(os.path.abspath(WATCHED_DIR), ".venv"),
+    os.path.join(os.path.abspath(WATCHED_DIR), "node_modules"),
+    os.path.join(os.path.abspath(WATCHED_DIR), "__pycache__"),
+    os.path.join(os.path.abspath(WATCHED_DIR), ".git"),
+    os.path.join(os.path.abspath(WATCHED_DIR), "tests"),
+]
+# Extra gitignore-style patterns (comma-separated, relative to WATCHED_DIR), and whether to honor WATCHED_DIR/.gitignore
+IGNORE_PATTERNS = [p.strip() for p in os.getenv("IGNORE_PATTERNS", "").split(",") if p.strip()]
+USE_GITIGNORE = os.getenv("USE_GITIGNORE", "true").lower() == "true"
+
+# Processes reading, hashing and chunking files during reindexing (1 = in-process)
+DISCOVERY_WORKERS = int(os.getenv("DISCOVERY_WORKERS", str(os.cpu_count() or 1)))
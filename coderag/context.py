@@ -0,0 +1,133 @@
+import hashlib
+from functools import lru_cache
+from .config import OPENAI_CHAT_MODEL, CONTEXT_MAX_TOKENS
+
+try:
+    import tiktoken
+except ImportError:  # Optional: fall back to the character-based estimate
+    tiktoken = None
+
+_encodings = {}
+
+# Code averages roughly 3 characters per token; err on the side of smaller estimates per char
+CHARS_PER_TOKEN = 3
+
+def estimate_tokens(text):
+    """Cheap, conservative token estimate used for request packing."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def _get_encoding(model=OPENAI_CHAT_MODEL):
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")
+    return _encodings[model]
+
+@lru_cache(maxsize=8192)
+def count_tokens(text):
+    """Prompt tokens in text for OPENAI_CHAT_MODEL (tiktoken if installed, else an estimate); cached per text."""
+    if tiktoken is None:
+        return estimate_tokens(text)
+    return len(_get_encoding().encode(text, disallowed_special=()))
+
+def truncate_tokens(text, max_tokens, model):
+    """
+    text cut to at most max_tokens tokens of model: exactly with tiktoken, else to
+    max_tokens UTF-8 bytes, since no token is shorter than a byte.
+    """
+    data = text.encode('utf-8')
+    if len(data) <= max_tokens:
+        return text
+    if tiktoken is None:
+        return data[:max_tokens].decode('utf-8', errors='ignore')
+    tokens = _get_encoding(model).encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return _get_encoding(model).decode(tokens[:max_tokens])
+
+def merge_spans(results):
+    """
+    Collapse results into non-overlapping blocks: exact duplicates are dropped and
+    chunks of the same file (and shard) whose line ranges overlap or touch are joined
+    into one block. A block keeps the best rank of its parts and the sum of their scores.
+    """
+    blocks = []
+    seen = set()
+    by_file = {}
+    for rank, result in enumerate(results):
+        location = (result.get('shard'), result['filepath'])
+        key = hashlib.sha256(f"{location}\0{result['content']}".encode('utf-8')).digest()
+        if key in seen:
+            continue
+        seen.add(key)
+        block = dict(result, rank=rank, score=result.get('score', 0.0), names=[result.get('name')])
+        if result.get('line_start') is None:
+            blocks.append(block)
+        else:
+            by_file.setdefault(location, []).append(block)
+
+    for spans in by_file.values():
+        spans.sort(key=lambda block: block['line_start'])
+        current = spans[0]
+        for block in spans[1:]:
+            if block['line_start'] <= current['line_end'] + 1:
+                if block['line_end'] > current['line_end']:
+                    overlap = current['line_end'] - block['line_start'] + 1
+                    extra = block['content'].split('\n')[max(0, overlap):]
+                    current['content'] = current['content'] + '\n' + '\n'.join(extra)
+                    current['line_end'] = block['line_end']
+                current['rank'] = min(current['rank'], block['rank'])
+                current['score'] += block['score']
+                current['names'] = current['names'] + block['names']
+                for key in ('semantic_score', 'keyword_score', 'symbol_score'):
+                    if key in block:
+                        current[key] = max(current.get(key, 0), block[key])
+            else:
+                blocks.append(current)
+                current = block
+        blocks.append(current)
+
+    for block in blocks:
+        block['name'] = ", ".join(name for name in block.pop('names') if name) or None
+    return blocks
+
+def _truncate_lines(content, max_tokens):
+    """Longest prefix of whole lines that fits in max_tokens."""
+    kept = []
+    used = 0
+    for line in content.split('\n'):
+        tokens = count_tokens(line + '\n')
+        if used + tokens > max_tokens:
+            break
+        kept.append(line)
+        used += tokens
+    return '\n'.join(kept)
+
+def pack_context(results, format_block, max_tokens=CONTEXT_MAX_TOKENS):
+    """
+    Choose which result blocks go into the prompt within max_tokens.
+
+    format_block(number, block) renders one block. The best-ranked block is always
+    included (cut at a line boundary if it alone is too big); the rest are picked by
+    score per token, then everything is emitted in rank order. Returns the rendered parts.
+    """
+    blocks = merge_spans(results)
+    if not blocks:
+        return []
+    blocks.sort(key=lambda block: block['rank'])
+    costs = [count_tokens(format_block(i + 1, block)) for i, block in enumerate(blocks)]
+
+    chosen = [0]
+    budget = max_tokens - costs[0]
+    if budget < 0:
+        header = count_tokens(format_block(1, dict(blocks[0], content="")))
+        blocks[0] = dict(blocks[0], content=_truncate_lines(blocks[0]['content'], max(0, max_tokens - header)))
+        budget = 0
+    by_value = sorted(range(1, len(blocks)), key=lambda i: blocks[i]['score'] / max(costs[i], 1), reverse=True)
+    for i in by_value:
+        if costs[i] <= budget:
+            chosen.append(i)
+            budget -= costs[i]
+
+    return [format_block(number, blocks[i]) for number, i in enumerate(sorted(chosen), 1)]
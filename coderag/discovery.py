@@ -0,0 +1,195 @@
+import os
+import re
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .code_chunker import file_chunks
+from .embedding_cache import content_hash
+from .config import WATCHED_DIR, IGNORE_PATHS, IGNORE_PATTERNS, USE_GITIGNORE, DISCOVERY_WORKERS
+
+# Files handed to each worker process per task; amortizes inter-process overhead
+TASK_CHUNKSIZE = 16
+
+# Below this many files, starting worker processes costs more than it saves
+MIN_PARALLEL_FILES = 256
+
+def _pattern_regex(pattern):
+    """Translate one gitignore glob (without "!" or trailing "/") into a regex over relative paths."""
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            parts.append("/.*")
+            i += 3
+        elif pattern[i] == "*":
+            parts.append(".*" if pattern.startswith("**", i) else "[^/]*")
+            i += 2 if pattern.startswith("**", i) else 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 1:]:
+            end = pattern.index("]", i + 1)
+            parts.append("[" + pattern[i + 1:end].replace("!", "^", 1) + "]")
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    # Patterns without a slash match a name at any depth
+    prefix = "^" if anchored else "^(?:.*/)?"
+    return re.compile(prefix + "".join(parts) + "$")
+
+def compile_patterns(lines):
+    """Parse gitignore lines into (regex, negated, directory_only) rules, in order."""
+    rules = []
+    for line in lines:
+        line = line.rstrip("\n").rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+        directory_only = line.endswith("/")
+        line = line.rstrip("/")
+        if line:
+            rules.append((_pattern_regex(line), negated, directory_only))
+    return rules
+
+def _load_rules(root_dir=WATCHED_DIR):
+    lines = list(IGNORE_PATTERNS)
+    gitignore = os.path.join(root_dir, ".gitignore")
+    if USE_GITIGNORE and os.path.isfile(gitignore):
+        with open(gitignore, "r", encoding="utf-8", errors="replace") as f:
+            lines.extend(f.readlines())
+    return compile_patterns(lines)
+
+RULES = _load_rules()
+
+# Ignore rules and IGNORE_PATHS of other roots (index shards), loaded on first use
+_root_rules = {os.path.abspath(WATCHED_DIR): RULES}
+
+def rules_for(root_dir):
+    root_dir = os.path.abspath(root_dir)
+    if root_dir not in _root_rules:
+        _root_rules[root_dir] = _load_rules(root_dir)
+    return _root_rules[root_dir]
+
+def _ignore_paths(root_dir):
+    """IGNORE_PATHS (absolute, defined under WATCHED_DIR) carried over to root_dir."""
+    root_dir = os.path.abspath(root_dir)
+    watched_dir = os.path.abspath(WATCHED_DIR)
+    if root_dir == watched_dir:
+        return IGNORE_PATHS
+    return [os.path.join(root_dir, os.path.relpath(path, watched_dir)) for path in IGNORE_PATHS]
+
+def _matches(relpath, is_dir, rules):
+    """Last matching rule wins, as in gitignore."""
+    ignored = False
+    for regex, negated, directory_only in rules:
+        if directory_only and not is_dir:
+            continue
+        if regex.match(relpath):
+            ignored = not negated
+    return ignored
+
+def should_ignore_path(path, is_dir=False, rules=None, root_dir=WATCHED_DIR):
+    """
+    Check if a path is ignored: under one of the IGNORE_PATHS prefixes, or matched
+    (itself or one of its parent directories) by the gitignore-style patterns of root_dir.
+    """
+    absolute = os.path.abspath(path)
+    for ignore_path in _ignore_paths(root_dir):
+        if absolute.startswith(ignore_path):
+            return True
+    rules = rules_for(root_dir) if rules is None else rules
+    if not rules:
+        return False
+    relpath = os.path.relpath(path, root_dir).replace(os.sep, "/")
+    if relpath.startswith("../"):
+        return False
+    parts = relpath.split("/")
+    for depth in range(1, len(parts)):
+        if _matches("/".join(parts[:depth]), True, rules):
+            return True
+    return _matches(relpath, is_dir, rules)
+
+def is_source_file(filename):
+    return filename.endswith(".py")
+
+def iter_source_paths(root_dir=WATCHED_DIR):
+    """Walk root_dir and yield the path of every source file that is not ignored, never entering ignored directories."""
+    for root, dirs, files in os.walk(root_dir):
+        # Prune in place so os.walk skips ignored subtrees entirely
+        dirs[:] = [d for d in dirs if not should_ignore_path(os.path.join(root, d), is_dir=True, root_dir=root_dir)]
+        for file in files:
+            filepath = os.path.join(root, file)
+            if is_source_file(file) and not should_ignore_path(filepath, root_dir=root_dir):
+                yield filepath
+
+def prepare_file(filepath, root_dir=WATCHED_DIR):
+    """
+    Read, hash and chunk one file (runs in a worker process); relpath is relative to root_dir.
+    Returns an embedding-pipeline document, or None if the file can't be read.
+    """
+    try:
+        st = os.stat(filepath)
+        with open(filepath, "r", encoding="utf-8") as f:
+            text = f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"Error reading file {filepath}: {e}")
+        return None
+    return {
+        "text": text,
+        "filename": os.path.basename(filepath),
+        "filepath": filepath,
+        "relpath": os.path.relpath(filepath, root_dir),
+        "hash": content_hash(text),
+        "mtime": st.st_mtime_ns,
+        "size": st.st_size,
+        "chunks": file_chunks(text, filepath)
+    }
+
+def prepare_documents(paths, workers=DISCOVERY_WORKERS, chunksize=TASK_CHUNKSIZE, root_dir=WATCHED_DIR):
+    """
+    Yield prepared documents for paths, fanning the CPU-bound reading, hashing and
+    parsing out to a process pool. Results stream out as tasks complete (not in
+    path order) and the number of queued tasks is bounded, so embedding can start
+    while discovery is still walking the tree.
+    """
+    paths = iter(paths)
+    head = list(islice(paths, MIN_PARALLEL_FILES))
+    if workers <= 1 or len(head) < MIN_PARALLEL_FILES:
+        for path in chain(head, paths):
+            document = prepare_file(path, root_dir)
+            if document is not None:
+                yield document
+        return
+    paths = chain(head, paths)
+
+    pending = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batch = []
+        for path in paths:
+            batch.append(path)
+            if len(batch) < chunksize:
+                continue
+            pending.add(pool.submit(_prepare_many, batch, root_dir))
+            batch = []
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from _collect(done)
+        if batch:
+            pending.add(pool.submit(_prepare_many, batch, root_dir))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from _collect(done)
+
+def _prepare_many(paths, root_dir):
+    return [document for document in (prepare_file(path, root_dir) for path in paths) if document is not None]
+
+def _collect(done):
+    for future in done:
+        yield from future.result()
@@ -27,3 +27,40 @@ def euclidean_distance(a, b):
     a = np.array(a)
     b = np.array(b)
     return -float(np.linalg.norm(a - b))
+
+
+# Batched forms: score every candidate in one matrix-vector product.
+# `unit_matrix` holds L2-normalized rows and `norms` their original lengths,
+# as kept by VectorStore.
+
+def dot_product_batch(query, unit_matrix, norms):
+    """Dot product of query with every row; returns a float32 array."""
+    query = np.asarray(query, dtype='float32').reshape(-1)
+    return (unit_matrix @ query) * norms
+
+def cosine_similarity_batch(query, unit_matrix):
+    """Cosine similarity of query with every (already normalized) row, in [-1, 1]."""
+    query = np.asarray(query, dtype='float32').reshape(-1)
+    norm = np.linalg.norm(query)
+    if norm == 0:
+        return np.zeros(len(unit_matrix), dtype='float32')
+    return unit_matrix @ (query / norm)
+
+def euclidean_distance_batch(query, unit_matrix, norms):
+    """Negative Euclidean distance to every row (higher is more similar)."""
+    query = np.asarray(query, dtype='float32').reshape(-1)
+    dots = (unit_matrix @ query) * norms
+    squared = np.dot(query, query) + norms * norms - 2.0 * dots
+    return -np.sqrt(np.maximum(squared, 0.0))
+
+METRICS = ("cosine", "dot", "euclidean")
+
+def similarity_batch(metric, query, unit_matrix, norms):
+    """Score all rows with the named metric ("cosine", "dot" or "euclidean")."""
+    if metric == "cosine":
+        return cosine_similarity_batch(query, unit_matrix)
+    if metric == "dot":
+        return dot_product_batch(query, unit_matrix, norms)
+    if metric == "euclidean":
+        return euclidean_distance_batch(query, unit_matrix, norms)
+    raise ValueError(f"Unknown distance metric: {metric}")
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+def content_hash(text):
+    """Stable hash of the exact text that gets embedded."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by (model name, content hash).
+
+    Backed by a single SQLite file; when the stored vectors exceed max_bytes the
+    least recently used entries are evicted. Safe to share between threads, and
+    WAL mode lets the indexer and query processes use the same file.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # The first (full) index run starts before anything else has created the index directory
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL, PRIMARY KEY (model, hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def get_many(self, model, hashes):
+        """Return {hash: float32 vector} for the hashes present in the cache."""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *chunk]
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype='float32')
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(now, model, key) for key in found]
+                )
+            self.hits += sum(1 for key in hashes if key in found)
+            self.misses += sum(1 for key in hashes if key not in found)
+        return found
+
+    def put_many(self, model, items):
+        """Store (hash, vector) pairs, then evict least recently used entries if over budget."""
+        now = time.time()
+        rows = [(model, key, np.asarray(vector, dtype='float32').tobytes(), now) for key, vector in items]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for row in rows:
+                previous = self._conn.execute(
+                    "SELECT LENGTH(vector) FROM embeddings WHERE model = ? AND hash = ?", row[:2]
+                ).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (model, hash, vector, last_used) VALUES (?, ?, ?, ?)", row
+                )
+                self._total_bytes += len(row[2]) - (previous[0] if previous else 0)
+            self._conn.execute("COMMIT")
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop the oldest entries until the cache is back under 90% of its budget."""
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        rows = self._conn.execute(
+            "SELECT model, hash, LENGTH(vector) FROM embeddings ORDER BY last_used"
+        )
+        victims = []
+        for model, key, size in rows:
+            if self._total_bytes - freed <= target:
+                break
+            victims.append((model, key))
+            freed += size
+        rows.close()
+        self._conn.execute("BEGIN")
+        self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND hash = ?", victims)
+        self._conn.execute("COMMIT")
+        self._total_bytes -= freed
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes": self._total_bytes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,20 +1,181 @@
-from openai import OpenAI
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
 import numpy as np
-from .config import OPENAI_API_KEY, OPENAI_EMBEDDING_MODEL
+from .config import (
+    OPENAI_EMBEDDING_MODEL, EMBEDDING_DIM, EMBEDDING_BACKEND,
+    FAKE_EMBEDDING_LATENCY_MS, EMBEDDING_MAX_INPUT_TOKENS, EMBEDDING_MAX_RETRIES,
+    EMBEDDING_RETRY_BASE_DELAY, ENABLE_EMBEDDING_CACHE, EMBEDDING_CACHE_FILE, EMBEDDING_CACHE_MAX_MB
+)
+from .embedding_cache import EmbeddingCache, content_hash
+from .context import truncate_tokens
+from .clients import get_client, get_async_client
+from . import metrics
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY)
+_cache = None
+_cache_lock = threading.Lock()
+_cache_failed = False
+
+def fake_embed_batch(texts, dim=EMBEDDING_DIM, latency_ms=FAKE_EMBEDDING_LATENCY_MS):
+    """
+    Deterministic offline embeddings: hashed bag-of-words, L2-normalized.
+    Texts sharing tokens get similar vectors, so retrieval behaves plausibly without an API.
+    """
+    if latency_ms:
+        time.sleep(latency_ms / 1000.0)
+    vectors = np.zeros((len(texts), dim), dtype='float32')
+    for row, text in enumerate(texts):
+        for token in re.findall(r'\w+', text.lower()):
+            digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], 'little') % dim
+            vectors[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vectors[row])
+        if norm == 0:
+            vectors[row, row % dim] = 1.0
+        else:
+            vectors[row] /= norm
+    return vectors
+
+def _request_inputs(texts):
+    # The API rejects empty strings and texts over the model's token limit
+    return [truncate_tokens(text, EMBEDDING_MAX_INPUT_TOKENS, OPENAI_EMBEDDING_MODEL) or " " for text in texts]
+
+def _retry_delay(attempt, error):
+    delay = EMBEDDING_RETRY_BASE_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5)
+    print(f"Embedding request failed ({error.__class__.__name__}), retrying in {delay:.1f}s...")
+    return delay
+
+def _retryable_errors():
+    """Errors worth retrying: rate limits and transient server/network failures."""
+    from openai import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+    return RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+
+def is_input_error(error):
+    """True if the API rejected the request's input, so resending the same batch can't succeed."""
+    try:
+        from openai import BadRequestError
+    except ImportError:
+        return False
+    return isinstance(error, BadRequestError)
+
+def _response_vectors(response):
+    data = sorted(response.data, key=lambda item: item.index)
+    return np.array([item.embedding for item in data], dtype='float32')
+
+def _openai_embed_batch(texts):
+    """Embed texts in a single API request, retrying with exponential backoff on rate limits."""
+    # Retries are handled here with our own backoff
+    client = get_client(max_retries=0)
+    inputs = _request_inputs(texts)
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        try:
+            response = client.embeddings.create(model=OPENAI_EMBEDDING_MODEL, input=inputs)
+        except _retryable_errors() as e:
+            metrics.record_api_call("embeddings", error=e)
+            if attempt == EMBEDDING_MAX_RETRIES:
+                raise
+            time.sleep(_retry_delay(attempt, e))
+            continue
+        except Exception as e:
+            metrics.record_api_call("embeddings", error=e)
+            raise
+        metrics.record_api_call("embeddings", response)
+        return _response_vectors(response)
+
+async def _aopenai_embed_batch(texts):
+    """Async _openai_embed_batch: waits on the event loop instead of blocking a thread."""
+    async_client = get_async_client(max_retries=0)
+    inputs = _request_inputs(texts)
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        try:
+            response = await async_client.embeddings.create(model=OPENAI_EMBEDDING_MODEL, input=inputs)
+        except _retryable_errors() as e:
+            metrics.record_api_call("embeddings", error=e)
+            if attempt == EMBEDDING_MAX_RETRIES:
+                raise
+            await asyncio.sleep(_retry_delay(attempt, e))
+            continue
+        except Exception as e:
+            metrics.record_api_call("embeddings", error=e)
+            raise
+        metrics.record_api_call("embeddings", response)
+        return _response_vectors(response)
+
+def embedding_model_name():
+    """Name under which embeddings from the active backend are cached."""
+    if EMBEDDING_BACKEND == "fake":
+        return f"fake-{EMBEDDING_DIM}"
+    return OPENAI_EMBEDDING_MODEL
+
+def get_embedding_cache():
+    """Open the shared embedding cache on first use; None if disabled or unavailable."""
+    global _cache, _cache_failed
+    if not ENABLE_EMBEDDING_CACHE or _cache_failed:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None and not _cache_failed:
+                try:
+                    _cache = EmbeddingCache(EMBEDDING_CACHE_FILE, int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024))
+                except Exception as e:
+                    print(f"Embedding cache disabled, could not open {EMBEDDING_CACHE_FILE}: {e}")
+                    _cache_failed = True
+    return _cache
+
+def _backend_embed_batch(texts):
+    with metrics.span("embedding_request"):
+        if EMBEDDING_BACKEND == "fake":
+            return fake_embed_batch(texts)
+        return _openai_embed_batch(texts)
+
+def _collect_cache_metrics():
+    if _cache is not None:
+        stats = _cache.stats()
+        yield "coderag_cache_hits_total", {"cache": "embeddings"}, stats["hits"]
+        yield "coderag_cache_misses_total", {"cache": "embeddings"}, stats["misses"]
+
+metrics.register_collector(_collect_cache_metrics)
+
+def embed_batch(texts):
+    """
+    Embed a list of texts; returns a (len(texts), dim) float32 array.
+    Texts already in the embedding cache are served from it, the rest go out in one request.
+    """
+    cache = get_embedding_cache()
+    if cache is None:
+        return _backend_embed_batch(texts)
+
+    model = embedding_model_name()
+    hashes = [content_hash(text) for text in texts]
+    cached = cache.get_many(model, hashes)
+    missing = [i for i, key in enumerate(hashes) if key not in cached]
+    if missing:
+        fresh = _backend_embed_batch([texts[i] for i in missing])
+        cache.put_many(model, [(hashes[i], vector) for i, vector in zip(missing, fresh)])
+        cached.update((hashes[i], vector) for i, vector in zip(missing, fresh))
+    return np.stack([cached[key] for key in hashes]).astype('float32', copy=False)
 
 def generate_embeddings(text):
     """Generate embeddings using the updated OpenAI API."""
     try:
-        response = client.embeddings.create(
-            model=OPENAI_EMBEDDING_MODEL,
-            input=[text]  # Input should be a list of strings
-        )
-        # Extract the embedding from the response
-        embeddings = response.data[0].embedding
-        return np.array(embeddings).astype('float32').reshape(1, -1)
+        return embed_batch([text])
     except Exception as e:
         print(f"Error generating embeddings with OpenAI: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def embed_query_batch(texts):
+    """
+    Embed query texts without the on-disk embedding cache: one-off questions would push
+    chunk vectors out of it, and repeated queries hit the in-memory query cache instead.
+    """
+    return _backend_embed_batch(texts)
+
+async def aembed_query_batch(texts):
+    """Async embed_query_batch: waits on the event loop instead of blocking a thread."""
+    if EMBEDDING_BACKEND == "fake":
+        await asyncio.sleep(FAKE_EMBEDDING_LATENCY_MS / 1000.0)
+        return fake_embed_batch(texts, latency_ms=0)
+    return await _aopenai_embed_batch(texts)
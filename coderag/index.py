@@ -1,93 +1,703 @@
 import os
+import re
+import hashlib
+import pickle
+import shutil
+import threading
+import time
+from collections import namedtuple
 import faiss
 import numpy as np
-from .config import EMBEDDING_DIM, FAISS_INDEX_FILE, WATCHED_DIR
+from . import storage
+from .bm25 import BM25Index
+from .symbols import SymbolIndex
+from .metrics import span
+from .embeddings import embedding_model_name
+from .index_factory import build_index, index_type_of, target_index_type, tune, needs_retraining, TRAINED_TYPES
+from .vector_store import VectorStore
+from .config import (
+    EMBEDDING_DIM, FAISS_INDEX_FILE, FAISS_INDEX_TYPE, INDEX_DIR, INDEX_MANIFEST_FILE, INDEX_SHARDS,
+    SEARCH_SHARDS, RAG_DISTANCE_METRIC, WATCHED_DIR, BM25_K1, BM25_B,
+    INDEX_COMPACT_INTERVAL, INDEX_COMPACT_MIN_TOMBSTONES, INDEX_MERGE_SEGMENTS, INDEX_MERGE_RATIO, DEFAULT_SHARD
+)
 
-index = faiss.IndexFlatL2(EMBEDDING_DIM)
-metadata = []
-embeddings_storage = []  # Store embeddings for cosine similarity
+# Files written by the previous (pickled) format; removed by clear_index
+LEGACY_FILES = (FAISS_INDEX_FILE, "metadata.npy", "embeddings.npy", "bm25.pkl")
+
+# Process-resident, read-only view of a shard's on-disk index shared by every query.
+# `stamp` is the (inode, mtime, size) fingerprint of the header it was loaded from.
+IndexSnapshot = namedtuple(
+    "IndexSnapshot", ["index", "metadata", "embeddings", "bm25", "generation", "stamp", "shard", "symbols"],
+    defaults=(None, None)
+)
+
+def _new_faiss_index():
+    """Empty index addressed by stable 64-bit chunk ids instead of row positions."""
+    return build_index([], np.zeros((0, EMBEDDING_DIM), dtype='float32'), index_type="flat")
+
+def _text_indexes(columns):
+    """The base's keyword index and symbol table, brought up to date with the published segments."""
+    bm25 = BM25Index.load(columns.path("bm25", "pkl"))
+    symbols_path = columns.path("symbols", "pkl")
+    if os.path.exists(symbols_path):
+        symbols = SymbolIndex.load(symbols_path)
+    else:
+        # Written before symbol tables existed
+        symbols = SymbolIndex.from_entries(
+            (chunk, columns.base.meta(row)) for row, chunk in enumerate(columns.base.ids.tolist())
+        )
+    removed, added = columns.segment_changes()
+    for chunk, entry in removed:
+        bm25.remove(chunk, entry['content'])
+        symbols.remove(chunk, entry)
+    for chunk, entry in added:
+        bm25.add(chunk, entry['content'])
+        symbols.add(chunk, entry)
+    return bm25, symbols
+
+def chunk_id(relative_path, ordinal, content):
+    """
+    Stable id for the ordinal-th chunk of a file with the given content.
+    Unchanged chunks keep their id across re-indexing, so upserting them is a no-op.
+    """
+    key = f"{relative_path}\0{ordinal}\0{content}".encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') & 0x7FFFFFFFFFFFFFFF
+
+class IndexShard:
+    """
+    The index of one repository or path prefix: the writable in-memory index used
+    by the indexer and the file monitor, and the memory-mapped snapshot served to
+    queries. Each shard has its own directory, manifest and generations, so adding,
+    reindexing or removing a repository never touches the other shards.
+    """
+
+    def __init__(self, name, root, directory, manifest_file):
+        self.name = name
+        self.root = root
+        self.directory = directory
+        self.manifest_file = manifest_file
+        self.index = _new_faiss_index()
+        self.metadata = {}  # chunk id -> {"content", "filename", "filepath", ...}
+        self.embeddings = VectorStore(EMBEDDING_DIM)  # Normalized embeddings for exact rescoring
+        self.bm25 = BM25Index(k1=BM25_K1, b=BM25_B)  # Keyword index over chunk ids
+        self.symbols = SymbolIndex()  # Function, method and class names -> chunk ids
+        self._trained_on = 0  # Vectors the IVF index was trained on (0 for untrained types)
+        # Ids grouped by file (relative path), and ids deleted from metadata but still
+        # physically present in the FAISS index until the next compaction.
+        self.path_ids = {}
+        self.tombstones = set()
+        # True when there are changes that save() hasn't published yet: the ids added and
+        # removed since the last publish, which the next save appends as a segment
+        self.dirty = False
+        self._added = set()
+        self._removed = set()
+        # True once the in-memory index matches what is on disk (loaded or saved)
+        self._on_disk = False
+        # Serializes every mutation (indexer, file monitor and background compactor)
+        self.write_lock = threading.RLock()
+        # Serializes header.json updates (saves and the end of a background merge) and file ids
+        self._publish_lock = threading.Lock()
+        self._next_file_id = 0
+        self._snapshot = None
+        self._snapshot_lock = threading.Lock()
+        self._generation = 0
+
+    def __repr__(self):
+        return f"IndexShard({self.name!r}, root={self.root!r})"
+
+    def relative_path(self, filepath):
+        """Path relative to the shard root, as stored in metadata."""
+        return os.path.relpath(filepath, self.root)
+
+    def contains(self, path):
+        path = os.path.abspath(path)
+        return path == self.root or path.startswith(self.root.rstrip(os.sep) + os.sep)
+
+    def clear(self):
+        """Delete the shard's index directory and reinitialize its in-memory index."""
+        with self.write_lock:
+            if os.path.isdir(self.directory):
+                shutil.rmtree(self.directory)
+                print(f"Deleted index directory: {self.directory}")
+            self.index = _new_faiss_index()
+            self.metadata = {}
+            self.embeddings = VectorStore(EMBEDDING_DIM)
+            self.bm25 = BM25Index(k1=BM25_K1, b=BM25_B)
+            self.symbols = SymbolIndex()
+            self._trained_on = 0
+            self.path_ids = {}
+            self.tombstones = set()
+            self._added = set()
+            self._removed = set()
+            self._on_disk = False
+            self.dirty = True
+
+    def _rebuild(self, index_type=None):
+        """Rebuild the FAISS index from the stored embeddings (retrains IVF indexes)."""
+        self.index = build_index(self.embeddings.ids, self.embeddings.raw_matrix(), index_type=index_type)
+        self._trained_on = len(self.embeddings) if index_type_of(self.index) in TRAINED_TYPES else 0
+
+    def _maybe_upgrade(self):
+        """
+        Switch to the configured index type once there are enough vectors to train it,
+        or when FAISS_INDEX_TYPE changed. An index of the configured type is kept as is.
+        Called when saving, so an IVF index is trained on everything indexed so far
+        rather than on the first chunks of a reindex.
+        """
+        current = index_type_of(self.index)
+        target = target_index_type(len(self.embeddings))
+        if current != target and current != FAISS_INDEX_TYPE:
+            print(f"Building {target} index over {len(self.embeddings)} vectors for shard {self.name} (was {current}).")
+            self._rebuild(target)
+
+    def _maybe_retrain(self):
+        """Retrain an IVF index that has grown well past the vectors it was trained on (see merge)."""
+        current = index_type_of(self.index)
+        if needs_retraining(current, self._trained_on, len(self.embeddings)):
+            print(f"Retraining {current} index over {len(self.embeddings)} vectors for shard {self.name} "
+                  f"(trained on {self._trained_on}).")
+            self._rebuild(current)
+
+    def _purge(self, ids):
+        """Physically remove ids from the FAISS index (O(index size) for flat indexes)."""
+        if ids:
+            self.embeddings.remove(ids)
+            try:
+                self.index.remove_ids(np.array(sorted(ids), dtype='int64'))
+            except RuntimeError:
+                # HNSW cannot remove vectors; rebuild it from the remaining embeddings
+                self._rebuild(index_type_of(self.index))
+            self.tombstones.difference_update(ids)
+
+    def _tombstone(self, ids):
+        """Logically delete ids: hidden from search immediately, purged from FAISS on compaction."""
+        for chunk in ids:
+            data = self.metadata.pop(chunk, None)
+            if data is not None:
+                self.bm25.remove(chunk, data['content'])
+                self.symbols.remove(chunk, data)
+                self.tombstones.add(chunk)
+                self._added.discard(chunk)
+                self._removed.add(chunk)
+                self.dirty = True
+
+    def _add_chunk(self, chunk, embedding, entry):
+        embedding = np.asarray(embedding, dtype='float32').reshape(1, -1)
+        if embedding.shape[1] != self.index.d:
+            raise ValueError(
+                f"Embedding dimension {embedding.shape[1]} does not match FAISS index dimension {self.index.d}"
+            )
+        if chunk in self.tombstones:
+            # Same content came back before compaction; drop the stale vector first
+            self._purge([chunk])
+        self.index.add_with_ids(embedding, np.array([chunk], dtype='int64'))
+        self.metadata[chunk] = entry
+        self.embeddings.add([chunk], embedding)
+        self.bm25.add(chunk, entry['content'])
+        self.symbols.add(chunk, entry)
+        self._added.add(chunk)
+        self.dirty = True
+
+    def add_to_index(self, embeddings, full_content, filename, filepath):
+        """Append one chunk to a file's entries (use upsert to replace a file's chunks)."""
+        relative_filepath = self.relative_path(filepath)
+        with self.write_lock:
+            ids = self.path_ids.setdefault(relative_filepath, [])
+            chunk = chunk_id(relative_filepath, len(ids), full_content)
+            if chunk in self.metadata:
+                return chunk
+            self._add_chunk(chunk, embeddings, {
+                "content": full_content,
+                "filename": filename,
+                "filepath": relative_filepath
+            })
+            ids.append(chunk)
+            return chunk
+
+    def upsert(self, filepath, chunks):
+        """
+        Replace all indexed chunks of a file.
+
+        chunks is a list of dicts with an "embedding" and a "content" key; any other
+        keys are stored as metadata. Chunks whose content is unchanged keep their id
+        and vector, stale ones are tombstoned. Returns the file's chunk ids.
+        """
+        relative_filepath = self.relative_path(filepath)
+        filename = os.path.basename(filepath)
+        with self.write_lock:
+            old_ids = self.path_ids.get(relative_filepath, [])
+            new_ids = [chunk_id(relative_filepath, i, chunk['content']) for i, chunk in enumerate(chunks)]
+            self._tombstone(set(old_ids) - set(new_ids))
+
+            for chunk, data in zip(new_ids, chunks):
+                if chunk in self.metadata:
+                    continue
+                entry = {key: value for key, value in data.items() if key != 'embedding'}
+                entry.setdefault('filename', filename)
+                entry['filepath'] = relative_filepath
+                self._add_chunk(chunk, data['embedding'], entry)
+
+            if new_ids:
+                self.path_ids[relative_filepath] = new_ids
+            else:
+                self.path_ids.pop(relative_filepath, None)
+            return new_ids
+
+    def delete(self, path):
+        """
+        Remove a file from the shard, or every file under it if path is a directory.
+        Returns the number of chunks removed.
+        """
+        relative = self.relative_path(path)
+        prefix = relative.rstrip(os.sep) + os.sep
+        with self.write_lock:
+            doomed = [p for p in self.path_ids if p == relative or p.startswith(prefix) or relative == "."]
+            removed = 0
+            for p in doomed:
+                ids = self.path_ids.pop(p)
+                self._tombstone(ids)
+                removed += len(ids)
+            return removed
+
+    def compact(self):
+        """
+        Purge tombstoned vectors from the in-memory FAISS index; returns how many were
+        removed. The published index already records the deletions (see merge).
+        """
+        with self.write_lock:
+            count = len(self.tombstones)
+            self._purge(set(self.tombstones))
+            return count
+
+    def file_rows(self):
+        """Map each indexed file (relative path) to its chunk ids."""
+        with self.write_lock:
+            return {path: list(ids) for path, ids in self.path_ids.items()}
+
+    def files_exist(self):
+        return storage.header_exists(self.directory)
+
+    def _header_fields(self, index_type, trained_on):
+        return dict(
+            dim=EMBEDDING_DIM, model=embedding_model_name(), metric=RAG_DISTANCE_METRIC, index_type=index_type,
+            shard=self.name, trained_on=trained_on
+        )
+
+    def _reserve_file_id(self):
+        """A file id for a new base or segment, unique even while a merge is writing one."""
+        with self._publish_lock:
+            self._next_file_id = max(self._next_file_id, storage.next_file_id(self.directory))
+            file_id = self._next_file_id
+            self._next_file_id += 1
+            return file_id
+
+    def _capture(self):
+        """Copy the live rows and serialize the keyword, symbol and FAISS indexes, for writing a new base."""
+        ids = list(self.metadata)
+        rows = self.embeddings.rows_for(ids)
+        index_type = index_type_of(self.index)
+        # Flat indexes are searched straight over the vector columns; only ANN structures are serialized
+        faiss_bytes = None if index_type == "flat" else faiss.serialize_index(self.index).tobytes()
+        return dict(
+            ids=ids, unit=self.embeddings.unit[rows], norms=self.embeddings.norms[rows],
+            entries=[self.metadata[chunk] for chunk in ids],
+            tombstones=set(self.tombstones) if faiss_bytes is not None else (),
+            bm25=pickle.dumps(self.bm25, protocol=pickle.HIGHEST_PROTOCOL), faiss_bytes=faiss_bytes,
+            symbols=pickle.dumps(self.symbols, protocol=pickle.HIGHEST_PROTOCOL)
+        ), index_type
+
+    def save(self):
+        """
+        Publish unsaved changes; readers switch to them on their next query. The ids added
+        and removed since the last publish are appended as a segment, so a save costs about
+        as much as the change. A full base is written when there is none yet or the FAISS
+        index type changed.
+        """
+        with self.write_lock, span("save_index"):
+            self._maybe_upgrade()
+            try:
+                header = storage.read_header(self.directory) if self._on_disk else None
+            except (OSError, ValueError):
+                header = None
+            index_type = index_type_of(self.index)
+            if header is None or header.get("index_type") != index_type:
+                state, index_type = self._capture()
+                file_id = self._reserve_file_id()
+                storage.write_base(self.directory, file_id, **state)
+                with self._publish_lock:
+                    storage.publish_base(
+                        self.directory, file_id, len(state["ids"]), state["faiss_bytes"] is not None,
+                        **self._header_fields(index_type, self._trained_on)
+                    )
+            else:
+                ids = [chunk for chunk in self._added if chunk in self.metadata]
+                rows = self.embeddings.rows_for(ids)
+                file_id = self._reserve_file_id()
+                with self._publish_lock, span("append_segment"):
+                    storage.append_segment(
+                        self.directory, file_id, ids, self.embeddings.unit[rows], self.embeddings.norms[rows],
+                        [self.metadata[chunk] for chunk in ids], self._removed, count=len(self.metadata)
+                    )
+            self._added = set()
+            self._removed = set()
+            self._on_disk = True
+            self.dirty = False
+
+    def needs_merge(self, max_segments=INDEX_MERGE_SEGMENTS, ratio=INDEX_MERGE_RATIO):
+        """True when the published segments are numerous or large enough to merge into a new base."""
+        try:
+            header = storage.read_header(self.directory)
+        except (OSError, ValueError):
+            return False
+        segments = header["segments"]
+        rows = sum(segment["count"] + segment.get("deleted", 0) for segment in segments)
+        return bool(segments) and (len(segments) >= max_segments or rows >= ratio * header["base_count"])
+
+    def merge(self):
+        """
+        Rewrite the published base and segments as a new base without deleted rows,
+        retraining an IVF index that has outgrown its training set (RETRAIN_GROWTH);
+        returns how many segments were merged. Writers are blocked only while the state
+        is copied; the files are written without the lock, and segments saved meanwhile
+        stay on top of the new base.
+        """
+        with span("merge_index"):
+            with self.write_lock:
+                if self.dirty or not self._on_disk:
+                    self.save()
+                self.compact()
+                self._maybe_retrain()
+                header = storage.read_header(self.directory)
+                merged = [segment["id"] for segment in header["segments"]]
+                state, index_type = self._capture()
+                trained_on = self._trained_on
+                file_id = self._reserve_file_id()
+            storage.write_base(self.directory, file_id, **state)
+            with self._publish_lock:
+                # A full save or clear() while the files were written supersedes this merge;
+                # its files are removed when the next base is published
+                try:
+                    current = storage.read_header(self.directory)
+                except (OSError, ValueError):
+                    return 0
+                if current["base"] != header["base"]:
+                    return 0
+                storage.publish_base(
+                    self.directory, file_id, len(state["ids"]), state["faiss_bytes"] is not None,
+                    merged_segments=merged, **self._header_fields(index_type, trained_on)
+                )
+            return len(merged)
+
+    def _open_columns(self):
+        """Open the current generation, refusing one built with a different embedding model or dimension."""
+        columns = storage.ColumnarIndex(self.directory)
+        header = columns.header
+        if header["dim"] != EMBEDDING_DIM or header["model"] != embedding_model_name():
+            raise ValueError(
+                f"Index in {self.directory} was built with {header['model']} ({header['dim']} dims); "
+                f"a full reindex is required for {embedding_model_name()} ({EMBEDDING_DIM} dims)."
+            )
+        return columns
+
+    def _read_index_files(self):
+        """Memory-map the current generation: (search index, columns, keyword index, symbol table)."""
+        columns = self._open_columns()
+        if columns.header["has_faiss"]:
+            loaded_index = tune(faiss.read_index(columns.path("faiss", "index")))
+        else:
+            loaded_index = storage.MemmapFlatIndex(columns.base)
+        if len(columns.parts) > 1:
+            loaded_index = storage.SegmentedIndex(loaded_index, columns)
+        return loaded_index, columns, *_text_indexes(columns)
+
+    def load(self):
+        """Load the current generation into the writable in-memory index."""
+        with self.write_lock:
+            columns = self._open_columns()
+            self.metadata = dict(columns.metadata.items())
+            self.embeddings = VectorStore.from_arrays(columns.ids, *columns.live_vectors(), EMBEDDING_DIM)
+            self.bm25, self.symbols = _text_indexes(columns)
+            if columns.header["has_faiss"]:
+                self.index = tune(faiss.read_index(columns.path("faiss", "index")))
+                self._trained_on = 0
+                if index_type_of(self.index) in TRAINED_TYPES:
+                    self._trained_on = columns.header.get("trained_on") or columns.header["base_count"]
+                # Vectors deleted but not yet compacted are still in the FAISS file, as are
+                # base rows that segments deleted or replaced
+                self.tombstones = set(columns.tombstones) | set(columns.hidden[0].tolist())
+                added = columns.ids[columns.live_rows() >= columns.offsets[1]]
+                if self.tombstones.intersection(added.tolist()):
+                    # A segment brought back a chunk whose old vector is still in the FAISS file
+                    self._rebuild(index_type_of(self.index))
+                    self.tombstones = set()
+                elif len(added):
+                    rows = self.embeddings.rows_for(added)
+                    self.index.add_with_ids(self.embeddings.unit[rows] * self.embeddings.norms[rows][:, None], added)
+            else:
+                self.index = build_index(self.embeddings.ids, self.embeddings.raw_matrix(), index_type="flat")
+                self._trained_on = 0
+                self.tombstones = set()
+            self.path_ids = {}
+            for chunk, data in self.metadata.items():
+                self.path_ids.setdefault(data['filepath'], []).append(chunk)
+            self._added = set()
+            self._removed = set()
+            self._on_disk = True
+            self.dirty = False
+            # FAISS_INDEX_TYPE may have changed since the index was written
+            self._maybe_upgrade()
+        return self.index
+
+    def _disk_stamp(self):
+        """
+        Fingerprint the published header by (inode, mtime, size); None if there is no index.
+        Every publish replaces the header file, so the inode tells apart two publishes
+        within the filesystem's timestamp granularity.
+        """
+        try:
+            st = os.stat(os.path.join(self.directory, storage.HEADER_FILE))
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def get_snapshot(self):
+        """
+        Return the shard's shared snapshot, reloading from disk only when a new generation was published.
+
+        Grab the snapshot once per query and use it throughout: a reload maps the new
+        generation and swaps the reference, so queries already holding the old one are
+        never blocked or see a half-updated index. Vectors, contents and metadata stay
+        memory-mapped; only the pages a query touches are read.
+        """
+        stamp = self._disk_stamp()
+        current = self._snapshot
+        if current is not None and current.stamp == stamp:
+            return current
+
+        # Another thread is already reloading; keep serving the current generation.
+        if not self._snapshot_lock.acquire(blocking=current is None):
+            return current
+        try:
+            current = self._snapshot
+            if current is not None and current.stamp == stamp:
+                return current
+            if stamp is None:
+                if current is None:
+                    raise FileNotFoundError(
+                        f"No index found in {self.directory} for shard {self.name}; run main.py to build it."
+                    )
+                return current
+
+            try:
+                loaded_index, columns, loaded_bm25, loaded_symbols = self._read_index_files()
+            except (OSError, ValueError, RuntimeError) as e:
+                if current is None:
+                    raise
+                print(f"Index reload failed for shard {self.name}, keeping generation {current.generation}: {e}")
+                return current
+
+            self._generation += 1
+            self._snapshot = IndexSnapshot(
+                loaded_index, columns.metadata, columns, loaded_bm25, self._generation, stamp, self.name, loaded_symbols
+            )
+            return self._snapshot
+        finally:
+            self._snapshot_lock.release()
+
+    def get_generation(self):
+        """Return the generation number of the loaded snapshot (0 if nothing is loaded)."""
+        return self._snapshot.generation if self._snapshot is not None else 0
+
+def _configured_shards():
+    if not INDEX_SHARDS:
+        # Unsharded layout: the index lives directly in INDEX_DIR, as before shards existed
+        return {DEFAULT_SHARD: IndexShard(DEFAULT_SHARD, os.path.abspath(WATCHED_DIR), INDEX_DIR, INDEX_MANIFEST_FILE)}
+    shards = {}
+    for name, root in INDEX_SHARDS.items():
+        if not re.fullmatch(r'[A-Za-z0-9_.-]+', name):
+            raise ValueError(f"Invalid shard name {name!r} in INDEX_SHARDS (use letters, digits, '_', '-' or '.')")
+        shards[name] = IndexShard(
+            name, root, os.path.join(INDEX_DIR, name), os.path.join(INDEX_DIR, f"{name}.manifest.json")
+        )
+    return shards
+
+SHARDS = _configured_shards()
+
+_compactor = None
+
+def get_shard(name=None):
+    """Shard by name; the first configured shard if name is None."""
+    if name is None:
+        return next(iter(SHARDS.values()))
+    try:
+        return SHARDS[name]
+    except KeyError:
+        raise KeyError(f"Unknown index shard {name!r}; configured shards: {', '.join(SHARDS)}") from None
+
+def shard_for_path(path):
+    """The shard whose root contains path (the most specific one for nested roots), or None."""
+    matches = [shard for shard in SHARDS.values() if shard.contains(path)]
+    return max(matches, key=lambda shard: len(shard.root)) if matches else None
+
+def search_shard_names(names=None):
+    """Shards a query searches: names if given, else SEARCH_SHARDS, else all of them."""
+    return list(names or SEARCH_SHARDS or SHARDS)
+
+def get_snapshots(names=None):
+    """
+    Snapshots of the shards to search. Shards that have not been built yet are
+    skipped; raises FileNotFoundError if none of them has an index.
+    """
+    snapshots = []
+    missing = []
+    for name in search_shard_names(names):
+        try:
+            snapshots.append(get_shard(name).get_snapshot())
+        except FileNotFoundError as e:
+            missing.append(e)
+    if not snapshots:
+        raise missing[0] if missing else FileNotFoundError("No index shards configured.")
+    return snapshots
+
+def snapshots_generation(snapshots):
+    """Cache key identifying the generations of a set of shard snapshots."""
+    return tuple((snapshot.shard, snapshot.generation) for snapshot in snapshots)
+
+def remove_shard(name):
+    """Delete a shard's files (also for shards no longer in INDEX_SHARDS); other shards are untouched."""
+    directory = os.path.join(INDEX_DIR, name)
+    if not INDEX_SHARDS or not re.fullmatch(r'[A-Za-z0-9_.-]+', name) or not os.path.isdir(directory):
+        raise ValueError(f"No shard named {name!r} in {INDEX_DIR}")
+    shutil.rmtree(directory)
+    manifest = os.path.join(INDEX_DIR, f"{name}.manifest.json")
+    if os.path.exists(manifest):
+        os.remove(manifest)
+    SHARDS.pop(name, None)
+    print(f"Removed index shard {name}")
+
+def unconfigured_shards():
+    """Shard directories in INDEX_DIR that are not in INDEX_SHARDS (e.g. a repository that was removed)."""
+    if not INDEX_SHARDS or not os.path.isdir(INDEX_DIR):
+        return []
+    return sorted(
+        entry for entry in os.listdir(INDEX_DIR)
+        if entry not in SHARDS and storage.header_exists(os.path.join(INDEX_DIR, entry))
+    )
+
+def _require_shard(path):
+    shard = shard_for_path(path)
+    if shard is None:
+        raise ValueError(f"{path} is not under any index shard root ({', '.join(s.root for s in SHARDS.values())})")
+    return shard
+
+def remove_legacy_files():
+    """Delete files left by the pickled format."""
+    for path in LEGACY_FILES:
+        if os.path.exists(path):
+            os.remove(path)
+            print(f"Deleted legacy index file: {path}")
 
 def clear_index():
-    """Delete the FAISS index and metadata files if they exist, and reinitialize the index."""
-    global index, metadata, embeddings_storage
-    
-    # Delete the FAISS index file
-    if os.path.exists(FAISS_INDEX_FILE):
-        os.remove(FAISS_INDEX_FILE)
-        print(f"Deleted FAISS index file: {FAISS_INDEX_FILE}")
-
-    # Delete the metadata file
-    metadata_file = "metadata.npy"
-    if os.path.exists(metadata_file):
-        os.remove(metadata_file)
-        print(f"Deleted metadata file: {metadata_file}")
-
-    # Delete embeddings file
-    embeddings_file = "embeddings.npy"
-    if os.path.exists(embeddings_file):
-        os.remove(embeddings_file)
-        print(f"Deleted embeddings file: {embeddings_file}")
-
-    # Reinitialize
-    index = faiss.IndexFlatL2(EMBEDDING_DIM)
-    metadata = []
-    embeddings_storage = []
+    """Delete every shard's index (and any legacy index files), and reinitialize them."""
+    for shard in SHARDS.values():
+        shard.clear()
+    remove_legacy_files()
     print("FAISS index and metadata cleared and reinitialized.")
 
 def add_to_index(embeddings, full_content, filename, filepath):
-    global index, metadata, embeddings_storage
-
-    if embeddings.shape[1] != index.d:
-        raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match FAISS index dimension {index.d}")
+    """Append one chunk to a file's entries in the shard owning the file."""
+    return _require_shard(filepath).add_to_index(embeddings, full_content, filename, filepath)
 
-    # Convert absolute filepath to relative path
-    relative_filepath = os.path.relpath(filepath, WATCHED_DIR)
+def upsert(filepath, chunks):
+    """Replace all indexed chunks of a file in the shard owning it; see IndexShard.upsert."""
+    return _require_shard(filepath).upsert(filepath, chunks)
 
-    index.add(embeddings)
-    metadata.append({
-        "content": full_content,
-        "filename": filename,
-        "filepath": relative_filepath
-    })
-    # Store the embedding for cosine similarity
-    embeddings_storage.append(embeddings[0])
+def delete(path):
+    """Remove a file, or every file under a directory, from the shards containing it; returns the chunks removed."""
+    path = os.path.abspath(path)
+    removed = 0
+    for shard in SHARDS.values():
+        # A deleted directory may contain the root of a nested shard
+        if shard.contains(path) or shard.root.startswith(path.rstrip(os.sep) + os.sep):
+            removed += shard.delete(path if shard.contains(path) else shard.root)
+    return removed
 
 def save_index():
-    faiss.write_index(index, FAISS_INDEX_FILE)
-    with open("metadata.npy", "wb") as f:
-        np.save(f, metadata)
-    with open("embeddings.npy", "wb") as f:
-        np.save(f, np.array(embeddings_storage))
+    """Publish the unsaved changes of every shard (as a new segment)."""
+    for shard in SHARDS.values():
+        if shard.dirty:
+            shard.save()
 
 def load_index():
-    global index, metadata, embeddings_storage
-    index = faiss.read_index(FAISS_INDEX_FILE)
-    with open("metadata.npy", "rb") as f:
-        metadata = np.load(f, allow_pickle=True).tolist()
-    if os.path.exists("embeddings.npy"):
-        with open("embeddings.npy", "rb") as f:
-            embeddings_storage = np.load(f).tolist()
-    return index
-
-def get_metadata():
-    return metadata
-
-def get_embeddings():
-    return embeddings_storage
-
-def retrieve_vectors(n=5):
-    n = min(n, index.ntotal)
-    vectors = np.zeros((n, EMBEDDING_DIM), dtype=np.float32)
-    for i in range(n):
-        vectors[i] = index.reconstruct(i)
-    return vectors
-
-def inspect_metadata(n=5):
-    metadata = get_metadata()
+    """Load every shard that has an index on disk into its writable in-memory index."""
+    for shard in SHARDS.values():
+        if shard.files_exist():
+            shard.load()
+
+def compact_index():
+    """Purge tombstoned vectors from every shard; returns how many were removed."""
+    return sum(shard.compact() for shard in SHARDS.values())
+
+def tombstone_count():
+    return sum(len(shard.tombstones) for shard in SHARDS.values())
+
+def _compaction_loop(interval, min_tombstones):
+    while True:
+        time.sleep(interval)
+        for shard in list(SHARDS.values()):
+            try:
+                if len(shard.tombstones) >= min_tombstones:
+                    removed = shard.compact()
+                    print(f"Compacted shard {shard.name}: purged {removed} deleted vectors.")
+                if shard.needs_merge():
+                    merged = shard.merge()
+                    if merged:
+                        print(f"Merged {merged} segments of shard {shard.name} into a new base.")
+            except Exception as e:
+                print(f"Index compaction failed for shard {shard.name}: {e}")
+
+def start_compactor(interval=INDEX_COMPACT_INTERVAL, min_tombstones=INDEX_COMPACT_MIN_TOMBSTONES):
+    """
+    Start (once) a daemon thread that compacts a shard once enough tombstones have
+    accumulated, and merges its published segments once there are enough of them.
+    """
+    global _compactor
+    if _compactor is None:
+        _compactor = threading.Thread(
+            target=_compaction_loop, args=(interval, min_tombstones), name="index-compactor", daemon=True
+        )
+        _compactor.start()
+    return _compactor
+
+def index_files_exist():
+    """True if every shard has an index on disk."""
+    return all(shard.files_exist() for shard in SHARDS.values())
+
+def get_snapshot(name=None):
+    """Snapshot of one shard (the first configured one by default); see IndexShard.get_snapshot."""
+    return get_shard(name).get_snapshot()
+
+def get_generation(name=None):
+    return get_shard(name).get_generation()
+
+def get_metadata(name=None):
+    return get_shard(name).metadata
+
+def get_embeddings(name=None):
+    return get_shard(name).embeddings
+
+def get_bm25(name=None):
+    return get_shard(name).bm25
+
+def retrieve_vectors(n=5, name=None):
+    return get_shard(name).embeddings.raw_matrix()[:n]
+
+def inspect_metadata(n=5, name=None):
+    metadata = get_metadata(name)
     print(f"Inspecting the first {n} metadata entries:")
-    for i, data in enumerate(metadata[:n]):
-        print(f"Entry {i}:")
+    for chunk, data in list(metadata.items())[:n]:
+        print(f"Entry {chunk}:")
         print(f"Filename: {data['filename']}")
         print(f"Filepath: {data['filepath']}")
         print(f"Content: {data['content'][:100]}...")
-        print()
\ No newline at end of file
+        print()
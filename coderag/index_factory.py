@@ -0,0 +1,116 @@
+import math
+import faiss
+import numpy as np
+from .config import (
+    EMBEDDING_DIM, FAISS_INDEX_TYPE, FAISS_NLIST, FAISS_NPROBE, FAISS_HNSW_M,
+    FAISS_EF_CONSTRUCTION, FAISS_EF_SEARCH, FAISS_PQ_M, FAISS_PQ_NBITS, FAISS_TRAIN_MIN_VECTORS
+)
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+TRAINED_TYPES = ("ivf_flat", "ivf_pq")
+
+# FAISS wants roughly this many training points per IVF centroid
+MIN_POINTS_PER_CENTROID = 39
+
+# An IVF index holding this many times the vectors it was trained on is retrained (by IndexShard.merge)
+RETRAIN_GROWTH = 4
+
+if FAISS_INDEX_TYPE not in INDEX_TYPES:
+    raise ValueError(f"FAISS_INDEX_TYPE must be one of {', '.join(INDEX_TYPES)}, got {FAISS_INDEX_TYPE!r}")
+
+def min_training_vectors(index_type):
+    """
+    Vectors needed before an index type can be trained: FAISS wants MIN_POINTS_PER_CENTROID
+    points per IVF list and, for IVF-PQ, per centroid of each 2**nbits PQ codebook.
+    """
+    if index_type not in TRAINED_TYPES:
+        return 0
+    needed = MIN_POINTS_PER_CENTROID * max(FAISS_NLIST, 1)
+    if index_type == "ivf_pq":
+        needed = max(needed, MIN_POINTS_PER_CENTROID * 2 ** FAISS_PQ_NBITS)
+    return max(FAISS_TRAIN_MIN_VECTORS, needed)
+
+def target_index_type(n_vectors, index_type=FAISS_INDEX_TYPE):
+    """Index type to use for n_vectors: IVF types stay flat until there is enough data to train."""
+    if n_vectors < min_training_vectors(index_type):
+        return "flat"
+    return index_type
+
+def ivf_nlist(n_vectors, nlist=FAISS_NLIST):
+    """Number of IVF lists: configured value, or ~sqrt(n) capped by the available training data."""
+    if nlist <= 0:
+        nlist = int(math.sqrt(n_vectors))
+    return max(1, min(nlist, n_vectors // MIN_POINTS_PER_CENTROID))
+
+def needs_retraining(index_type, trained_on, n_vectors, growth=RETRAIN_GROWTH):
+    """True when an IVF index has grown well past the vectors its centroids (and nlist) were trained on."""
+    return index_type in TRAINED_TYPES and n_vectors >= growth * max(trained_on, 1)
+
+def pq_subquantizers(dim=EMBEDDING_DIM, m=FAISS_PQ_M):
+    """Largest number of PQ sub-quantizers <= m that divides the dimension."""
+    m = max(1, min(m, dim))
+    while dim % m:
+        m -= 1
+    return m
+
+def index_type_of(index):
+    """Name the index type of a FAISS index built by this module."""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(base, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    return "flat"
+
+def tune(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH):
+    """Apply query-time parameters (IVF nprobe, HNSW efSearch)."""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(base, faiss.IndexIVF):
+        base.nprobe = nprobe
+    elif isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search
+    return index
+
+def new_index(index_type="flat", vectors=None, dim=EMBEDDING_DIM, nlist=FAISS_NLIST, pq_m=FAISS_PQ_M,
+              hnsw_m=FAISS_HNSW_M, ef_construction=FAISS_EF_CONSTRUCTION):
+    """
+    Create an empty index that accepts add_with_ids.
+
+    Flat and HNSW are wrapped in IndexIDMap2; IVF indexes store ids natively and
+    are trained on `vectors`, which is required for them.
+    """
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+    if index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(dim, hnsw_m)
+        base.hnsw.efConstruction = ef_construction
+        return tune(faiss.IndexIDMap2(base))
+
+    if vectors is None or len(vectors) == 0:
+        raise ValueError(f"A {index_type} index needs training vectors")
+    n_lists = ivf_nlist(len(vectors), nlist)
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, n_lists, faiss.METRIC_L2)
+    elif index_type == "ivf_pq":
+        index = faiss.IndexIVFPQ(quantizer, dim, n_lists, pq_subquantizers(dim, pq_m), FAISS_PQ_NBITS)
+    else:
+        raise ValueError(f"Unknown index type {index_type!r}")
+    # Train on a bounded sample; more than ~256 points per list adds time, not quality
+    sample = vectors
+    limit = n_lists * 256
+    if len(vectors) > limit:
+        sample = vectors[np.random.default_rng(0).choice(len(vectors), limit, replace=False)]
+    index.train(np.ascontiguousarray(sample, dtype='float32'))
+    return tune(index)
+
+def build_index(ids, vectors, index_type=None, **kwargs):
+    """Build and populate an index over (ids, vectors); index_type defaults to the configured target."""
+    vectors = np.ascontiguousarray(vectors, dtype='float32').reshape(-1, kwargs.get('dim', EMBEDDING_DIM))
+    index_type = index_type or target_index_type(len(vectors))
+    index = new_index(index_type, vectors, **kwargs)
+    if len(vectors):
+        index.add_with_ids(vectors, np.asarray(ids, dtype='int64'))
+    return index
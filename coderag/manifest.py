@@ -0,0 +1,43 @@
+import json
+import os
+from .config import INDEX_MANIFEST_FILE
+from .code_chunker import CHUNKER_VERSION
+
+MANIFEST_VERSION = 3  # 2: rows are stable chunk ids, 3: columnar index in INDEX_DIR
+
+def load_manifest(path=INDEX_MANIFEST_FILE):
+    """Return {relative path: entry} from the manifest file, or None if there is no usable manifest."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != MANIFEST_VERSION or data.get("chunker") != CHUNKER_VERSION:
+        # Written by an older format or with different chunking: every chunk id is stale
+        return None
+    return data.get("files", {})
+
+def save_manifest(files, path=INDEX_MANIFEST_FILE):
+    """Atomically write the manifest (write to a temp file, then rename over the old one)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"version": MANIFEST_VERSION, "chunker": CHUNKER_VERSION, "files": files}, f)
+    os.replace(tmp_path, path)
+
+def document_entry(document, rows=()):
+    """Manifest entry for a document prepared by discovery.prepare_file (stat taken before the read)."""
+    return {
+        "mtime": document["mtime"],
+        "size": document["size"],
+        "hash": document["hash"],
+        "rows": list(rows)
+    }
+
+def stat_matches(entry, filepath):
+    """True if the file's mtime and size are unchanged since the entry was recorded."""
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return False
+    return entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size
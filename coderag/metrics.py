@@ -0,0 +1,157 @@
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from .config import METRICS_FILE
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+HELP = {
+    "coderag_stage_seconds": ("histogram", "Time spent in each stage of indexing and query processing"),
+    "coderag_api_calls_total": ("counter", "OpenAI API requests by API and outcome"),
+    "coderag_tokens_total": ("counter", "Tokens billed by the OpenAI API, as reported in responses"),
+    "coderag_cache_hits_total": ("counter", "Cache lookups that were served from the cache"),
+    "coderag_cache_misses_total": ("counter", "Cache lookups that had to compute the value"),
+    "coderag_query_batches_total": ("counter", "Micro-batches run by the query server"),
+    "coderag_batched_queries_total": ("counter", "Searches served by the query server's micro-batches"),
+    "coderag_symbol_answers_total": ("counter", "Searches answered from the symbol table without an embedding request"),
+}
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [count per bucket, sum, count]
+_collectors = []  # Callables yielding (name, labels dict, value) for counters kept elsewhere
+
+# Spans of the query being traced, and the nesting depth of the current span
+_trace = contextvars.ContextVar("coderag_trace", default=None)
+_depth = contextvars.ContextVar("coderag_span_depth", default=0)
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def increment(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[0][i] += 1
+                break
+        histogram[1] += value
+        histogram[2] += 1
+
+def register_collector(collect):
+    """Add a callable yielding (metric name, labels, value) for counters another module keeps itself."""
+    _collectors.append(collect)
+
+def record_api_call(api, response=None, error=None):
+    """Count one OpenAI request, and the tokens it used if the response reports them."""
+    increment("coderag_api_calls_total", api=api, status="error" if error is not None else "ok")
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        record_usage(api, usage)
+
+def record_usage(api, usage):
+    for kind in ("prompt_tokens", "completion_tokens"):
+        tokens = getattr(usage, kind, None)
+        if tokens:
+            increment("coderag_tokens_total", tokens, api=api, kind=kind.split("_")[0])
+
+@contextmanager
+def span(stage):
+    """
+    Time a stage: the duration goes into the coderag_stage_seconds histogram and,
+    inside trace(), into the current query's breakdown.
+    """
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        try:
+            _depth.reset(token)
+        except ValueError:
+            pass  # A generator closed from another context; its depth there is already gone
+        observe("coderag_stage_seconds", elapsed, stage=stage)
+        spans = _trace.get()
+        if spans is not None:
+            spans.append((start, depth, stage, elapsed))
+
+@contextmanager
+def trace():
+    """Collect the spans of everything run inside the block (including tasks and to_thread calls it starts)."""
+    spans = []
+    token = _trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _trace.reset(token)
+
+def format_trace(spans):
+    """Per-stage breakdown of a trace, indented by nesting and in start order."""
+    lines = []
+    for start, depth, stage, elapsed in sorted(spans):
+        lines.append(f"{'  ' * depth}{stage:<{28 - 2 * depth}} {elapsed * 1000:>9.1f} ms")
+    return "\n".join(lines)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (list(buckets), total, count) for key, (buckets, total, count) in _histograms.items()}
+    for collect in _collectors:
+        for name, labels, value in collect():
+            counters[_key(name, labels)] = value
+
+    by_name = {}
+    for (name, labels), value in counters.items():
+        by_name.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), (buckets, total, count) in histograms.items():
+        lines = by_name.setdefault(name, [])
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, buckets):
+            cumulative += bucket_count
+            le = "+Inf" if bound == math.inf else repr(bound)
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    output = []
+    for name in sorted(by_name):
+        kind, description = HELP.get(name, ("untyped", name))
+        output.append(f"# HELP {name} {description}")
+        output.append(f"# TYPE {name} {kind}")
+        output.extend(sorted(by_name[name]) if kind != "histogram" else by_name[name])
+    return "\n".join(output) + "\n"
+
+def write_metrics(path=METRICS_FILE):
+    """Atomically write the metrics to path (e.g. for node_exporter's textfile collector); no-op if path is empty."""
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
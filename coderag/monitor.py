@@ -1,40 +1,218 @@
 import time
 import os
+import threading
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from .index import add_to_index, save_index
-from .embeddings import generate_embeddings
-from .config import WATCHED_DIR, IGNORE_PATHS
+from .index import SHARDS, shard_for_path, delete, save_index, start_compactor
+from .manifest import load_manifest, save_manifest, document_entry
+from .pipeline import embed_files
+from .metrics import span, write_metrics
+from .discovery import should_ignore_path, is_source_file, prepare_documents
+from .config import MONITOR_DEBOUNCE_SECONDS, MONITOR_WORKERS, MONITOR_BATCH_SIZE
 
-def should_ignore_path(path):
-    """Check if the given path should be ignored based on the IGNORE_PATHS list."""
-    for ignore_path in IGNORE_PATHS:
-        if path.startswith(ignore_path):
-            return True
-    return False
+def is_indexable(path):
+    shard = shard_for_path(path)
+    return shard is not None and is_source_file(path) and not should_ignore_path(path, root_dir=shard.root)
+
+def is_ignored_dir(path):
+    shard = shard_for_path(path)
+    return shard is None or should_ignore_path(path, is_dir=True, root_dir=shard.root)
+
+class ChangeQueue:
+    """
+    Debouncing, coalescing queue of changed paths.
+
+    Every event for a path pushes its deadline back by `debounce` seconds, so a
+    burst of events collapses into one entry that becomes ready once the path
+    has been quiet. A path being processed is not handed out again until it is
+    marked done, which keeps updates to the same file in order.
+    """
+
+    def __init__(self, debounce=MONITOR_DEBOUNCE_SECONDS):
+        self.debounce = debounce
+        self._due = {}  # path -> monotonic time at which it becomes ready
+        self._in_progress = set()
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._due)
+
+    def put(self, path):
+        with self._cond:
+            self._due[path] = time.monotonic() + self.debounce
+            self._cond.notify()
+
+    def take_batch(self, max_items=MONITOR_BATCH_SIZE):
+        """
+        Block until some paths are ready and return up to max_items of them.
+        Returns an empty list once the queue is closed and drained.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                ready = [
+                    path for path, due in self._due.items()
+                    if (due <= now or self._closed) and path not in self._in_progress
+                ]
+                if ready:
+                    batch = ready[:max_items]
+                    for path in batch:
+                        del self._due[path]
+                    self._in_progress.update(batch)
+                    return batch
+                if self._closed and not self._due:
+                    return []
+                waiting = [due for path, due in self._due.items() if path not in self._in_progress]
+                self._cond.wait(timeout=max(0.0, min(waiting) - now) if waiting else None)
+
+    def done(self, paths):
+        with self._cond:
+            self._in_progress.difference_update(paths)
+            self._cond.notify_all()
+
+    def close(self):
+        """Flush: make every pending path ready immediately and let workers exit once drained."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+_manifest_lock = threading.Lock()
+
+def _update_manifests(indexed, removed):
+    """
+    Record a batch's upserted documents (shard -> documents) and removed paths in the
+    shard manifests, so the next startup only re-reads files changed while nothing was
+    watching. Returns {shard: manifest} to save once the index is saved. Shards without a
+    usable manifest are skipped: they are rebuilt from scratch on the next startup.
+    """
+    manifests = {}
+    for shard in SHARDS.values():
+        gone = [
+            shard.relative_path(path if shard.contains(path) else shard.root) for path in removed
+            if shard.contains(path) or shard.root.startswith(path.rstrip(os.sep) + os.sep)
+        ]
+        if not gone and shard not in indexed:
+            continue
+        manifest = load_manifest(shard.manifest_file)
+        if manifest is None:
+            continue
+        for relative in gone:
+            prefix = relative.rstrip(os.sep) + os.sep
+            for relpath in [p for p in manifest if p == relative or p.startswith(prefix) or relative == "."]:
+                del manifest[relpath]
+        file_rows = shard.file_rows()
+        for document in indexed.get(shard, ()):
+            manifest[document["relpath"]] = document_entry(document, file_rows.get(document["relpath"], []))
+        manifests[shard] = manifest
+    return manifests
+
+def process_batch(paths):
+    """
+    Apply one batch of changes to the index and the shard manifests, and persist them once;
+    returns the number of updates.
+    """
+    existing = [path for path in paths if os.path.isfile(path) and is_indexable(path)]
+    removed = [os.path.abspath(path) for path in paths if not os.path.exists(path)]
+
+    updates = 0
+    for path in removed:
+        # Also covers deleted or moved-away directories
+        if delete(path):
+            print(f"Removed from FAISS index: {path}")
+            updates += 1
+
+    by_shard = {}
+    for path in existing:
+        by_shard.setdefault(shard_for_path(path), []).append(path)
+    indexed = {}
+    for shard, shard_paths in by_shard.items():
+        # Parsed in-process: change batches are small, and forking from the watcher's threads is unsafe
+        for document, chunks in embed_files(prepare_documents(shard_paths, workers=1, root_dir=shard.root)):
+            if chunks is None:
+                print(f"Failed to generate embeddings for {document['filepath']}")
+                continue
+            shard.upsert(document["filepath"], chunks)
+            indexed.setdefault(shard, []).append(document)
+            updates += 1
+
+    if updates:
+        # Workers share the manifest files; the manifest is written after the index, so a
+        # crash in between leaves files to re-read on startup rather than stale chunks
+        with _manifest_lock:
+            manifests = _update_manifests(indexed, removed)
+            save_index()
+            for shard, manifest in manifests.items():
+                save_manifest(manifest, shard.manifest_file)
+        print(f"Updated FAISS index: {updates} of {len(paths)} changed paths applied.")
+    return updates
+
+def _worker_loop(queue):
+    while True:
+        paths = queue.take_batch()
+        if not paths:
+            return
+        try:
+            with span("monitor_batch"):
+                process_batch(paths)
+            write_metrics()
+        except Exception as e:
+            print(f"Failed to apply changes for {len(paths)} paths: {e}")
+        finally:
+            queue.done(paths)
 
 class CodeChangeHandler(FileSystemEventHandler):
+    """Pushes changed paths onto the queue; all indexing work happens on the worker threads."""
+
+    def __init__(self, queue):
+        super().__init__()
+        self.queue = queue
+
     def on_modified(self, event):
-        if event.is_directory or should_ignore_path(event.src_path):
+        if event.is_directory or not is_indexable(event.src_path):
             return
+        self.queue.put(event.src_path)
 
-        if event.src_path.endswith(".py"):
-            print(f"Detected change in file: {event.src_path}")
-            with open(event.src_path, 'r', encoding='utf-8') as f:
-                full_content = f.read()
-            embeddings = generate_embeddings(full_content)
-            if embeddings is not None and len(embeddings) > 0:
-                filename = os.path.basename(event.src_path)
-                add_to_index(embeddings, full_content, filename, event.src_path)
-                save_index()
-                print(f"Updated FAISS index for file: {event.src_path}")
+    def on_created(self, event):
+        if event.is_directory or not is_indexable(event.src_path):
+            return
+        self.queue.put(event.src_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory and not is_indexable(event.src_path):
+            return
+        # Directory deletions remove every indexed file underneath
+        self.queue.put(event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory and not is_ignored_dir(event.src_path) or is_indexable(event.src_path):
+            self.queue.put(event.src_path)
+        # Watchdog reports the files inside a moved directory as separate moves
+        if not event.is_directory and is_indexable(event.dest_path):
+            self.queue.put(event.dest_path)
 
 def start_monitoring():
-    event_handler = CodeChangeHandler()
+    # Purge deleted vectors and merge the segments each save appends, in the background
+    start_compactor()
+
+    queue = ChangeQueue()
+    workers = [
+        threading.Thread(target=_worker_loop, args=(queue,), name=f"index-worker-{i}", daemon=True)
+        for i in range(max(1, MONITOR_WORKERS))
+    ]
+    for worker in workers:
+        worker.start()
+
+    event_handler = CodeChangeHandler(queue)
     observer = Observer()
-    observer.schedule(event_handler, path=WATCHED_DIR, recursive=True)
+    roots = sorted({shard.root for shard in SHARDS.values()})
+    for root in roots:
+        # Nested roots are already covered by the recursive watch on their parent
+        if not any(root.startswith(other.rstrip(os.sep) + os.sep) for other in roots):
+            observer.schedule(event_handler, path=root, recursive=True)
     observer.start()
-    print(f"Started monitoring {WATCHED_DIR}...")
+    print(f"Started monitoring {', '.join(roots)}...")
 
     try:
         while True:
@@ -42,3 +220,8 @@ def start_monitoring():
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+
+    # Apply whatever is still queued before exiting
+    queue.close()
+    for worker in workers:
+        worker.join()
@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .embeddings import embed_batch, is_input_error
+from .context import estimate_tokens
+from .code_chunker import file_chunks
+from .config import EMBEDDING_BATCH_TOKENS, EMBEDDING_BATCH_SIZE, EMBEDDING_CONCURRENCY
+
+def pack_batches(documents, max_tokens=EMBEDDING_BATCH_TOKENS, max_items=EMBEDDING_BATCH_SIZE):
+    """Group documents (dicts with a "text" key) into batches that fit one embedding request."""
+    batch = []
+    batch_tokens = 0
+    for document in documents:
+        tokens = estimate_tokens(document["text"])
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_items):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(document)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def _embed_or_split(embed_fn, texts):
+    """
+    Embeddings of texts, None for a text the API rejects: a batch rejected for its
+    input is split in halves and retried, so only the bad document is lost.
+    """
+    try:
+        return list(embed_fn(texts))
+    except Exception as e:
+        if not is_input_error(e):
+            raise
+        if len(texts) == 1:
+            print(f"Embedding input rejected: {e}")
+            return [None]
+        middle = len(texts) // 2
+        return _embed_or_split(embed_fn, texts[:middle]) + _embed_or_split(embed_fn, texts[middle:])
+
+def _drain(done, pending):
+    """Yield (document, embedding) pairs for finished batches; a failed batch yields None embeddings."""
+    for future in done:
+        batch = pending.pop(future)
+        try:
+            vectors = future.result()
+        except Exception as e:
+            print(f"Embedding batch of {len(batch)} documents failed: {e}")
+            vectors = [None] * len(batch)
+        for document, vector in zip(batch, vectors):
+            yield document, vector.reshape(1, -1) if vector is not None else None
+
+def embed_documents(documents, concurrency=EMBEDDING_CONCURRENCY, embed_fn=embed_batch,
+                    max_tokens=EMBEDDING_BATCH_TOKENS, max_items=EMBEDDING_BATCH_SIZE):
+    """
+    Embed a stream of documents with up to `concurrency` requests in flight.
+
+    Documents are packed into token-budgeted batches and results are yielded as
+    (document, embedding) pairs as soon as each batch completes, so callers can
+    index incrementally. Embeddings have shape (1, dim); None marks a failed batch or a
+    document the API rejected.
+    """
+    concurrency = max(1, concurrency)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed") as pool:
+        for batch in pack_batches(documents, max_tokens, max_items):
+            # Bound the number of queued batches so huge repositories don't sit in memory
+            if len(pending) >= concurrency * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from _drain(done, pending)
+            future = pool.submit(_embed_or_split, embed_fn, [document["text"] for document in batch])
+            pending[future] = batch
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from _drain(done, pending)
+
+def embedding_text(document, chunk):
+    """Text embedded for a chunk: its span, prefixed with where it lives so methods keep their class."""
+    location = document.get("relpath", document["filepath"])
+    if chunk.get("type") == "file":
+        return f"# {location}\n{chunk['content']}"
+    return f"# {location} ({chunk['type']} {chunk['name']})\n{chunk['content']}"
+
+def embed_files(documents, chunk_fn=file_chunks, **kwargs):
+    """
+    Chunk each file document (unless it already carries "chunks") and embed all
+    chunks through embed_documents.
+
+    Yields (document, chunks) once every chunk of a file has been embedded, where
+    chunks are the chunk dicts with an added "embedding" key, ready for upsert;
+    chunks is None if any of the file's chunks failed to embed.
+    """
+    files = {}  # id(document) -> [document, chunks, chunks still pending]
+
+    def chunk_documents():
+        for document in documents:
+            chunks = document.get("chunks") or chunk_fn(document["text"], document["filepath"])
+            files[id(document)] = [document, chunks, len(chunks)]
+            for chunk in chunks:
+                yield {"text": embedding_text(document, chunk), "file": id(document), "chunk": chunk}
+
+    for item, embedding in embed_documents(chunk_documents(), **kwargs):
+        state = files[item["file"]]
+        if embedding is None:
+            state[1] = None
+        elif state[1] is not None:
+            item["chunk"]["embedding"] = embedding
+        state[2] -= 1
+        if state[2] == 0:
+            del files[item["file"]]
+            yield state[0], state[1]
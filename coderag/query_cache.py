@@ -0,0 +1,124 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from .config import ENABLE_QUERY_CACHE, QUERY_CACHE_TTL, QUERY_CACHE_MAX_ENTRIES
+from .metrics import register_collector
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire `ttl` seconds after being stored."""
+
+    def __init__(self, max_entries=QUERY_CACHE_MAX_ENTRIES, ttl=QUERY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def discard(self, predicate):
+        """Drop the entries whose key satisfies predicate; returns how many were dropped."""
+        with self._lock:
+            doomed = [key for key in self._entries if predicate(key)]
+            for key in doomed:
+                del self._entries[key]
+            return len(doomed)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+# Three tiers, cheapest to most expensive to recompute
+query_embeddings = TTLCache()  # (normalized query, embedding model) -> query embedding
+results = TTLCache()           # (normalized query, options, ((shard, generation), ...)) -> ranked results
+answers = TTLCache()           # (normalized query, context hash, chat model) -> final answer
+
+_generations = {}  # shard -> newest generation seen
+_generation_lock = threading.Lock()
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of a query, used in every cache key."""
+    return re.sub(r'\s+', ' ', query).strip().casefold()
+
+def context_hash(*parts):
+    return hashlib.sha256("\0".join(parts).encode('utf-8')).hexdigest()
+
+def check_generation(generation):
+    """
+    Drop the cached results of older generations of the shards in generation (the
+    ((shard, generation), ...) tuple ending a results key). Results for other shard
+    selections stay cached unless they include one of these shards.
+    """
+    with _generation_lock:
+        changed = {shard for shard, number in generation if _generations.get(shard, number) != number}
+        _generations.update(generation)
+        if changed:
+            current = dict(_generations)
+            results.discard(lambda key: any(
+                shard in changed and number != current[shard] for shard, number in key[-1]
+            ))
+
+def lookup(cache, key):
+    """Cached value for key, or None on a miss (always None when the cache is disabled)."""
+    return cache.get(key) if ENABLE_QUERY_CACHE else None
+
+def store(cache, key, value):
+    if ENABLE_QUERY_CACHE and value is not None:
+        cache.put(key, value)
+
+def cached(cache, key, compute):
+    """Return the cached value for key, computing and storing it on a miss (None results are not cached)."""
+    value = lookup(cache, key)
+    if value is None:
+        value = compute()
+        store(cache, key, value)
+    return value
+
+def stats():
+    """Hit/miss counters and sizes of every tier."""
+    return {
+        "query_embeddings": query_embeddings.stats(),
+        "results": results.stats(),
+        "answers": answers.stats()
+    }
+
+def _collect_metrics():
+    for tier, counts in stats().items():
+        yield "coderag_cache_hits_total", {"cache": tier}, counts["hits"]
+        yield "coderag_cache_misses_total", {"cache": tier}, counts["misses"]
+
+register_collector(_collect_metrics)
+
+def clear():
+    for cache in (query_embeddings, results, answers):
+        cache.clear()
@@ -0,0 +1,31 @@
+import json
+from .config import QUERY_SERVER_URL, QUERY_SERVER_TIMEOUT
+
+def _request(path, payload=None, url=QUERY_SERVER_URL):
+    import urllib.error
+    import urllib.request  # Only clients of a query server pay for importing http.client and ssl
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(
+        url.rstrip("/") + path, data=data, headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=QUERY_SERVER_TIMEOUT) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.load(e).get("error", e.reason)
+        except ValueError:
+            message = e.reason
+        raise RuntimeError(f"Query server error ({e.code}): {message}") from None
+
+def search(query, k=5, alpha=None, metric=None, shards=None, variants=None, url=QUERY_SERVER_URL):
+    """
+    search_code through the query server at url; returns the same result dicts.
+    alpha defaults to the server's HYBRID_SEARCH_ALPHA.
+    """
+    payload = {"query": query, "k": k, "alpha": alpha, "metric": metric, "shards": shards, "variants": variants}
+    return _request("/search", payload, url)["results"]
+
+def health(url=QUERY_SERVER_URL):
+    """Server status and the generation each shard is serving."""
+    return _request("/health", url=url)
@@ -1,8 +1,7 @@
 import re
-from openai import OpenAI
-from .config import OPENAI_API_KEY, OPENAI_CHAT_MODEL
-
-client = OpenAI(api_key=OPENAI_API_KEY)
+from .config import OPENAI_CHAT_MODEL, ENABLE_LLM_RERANKING, RERANKER, RERANK_SKIP_MARGIN, ENABLE_QUERY_EXPANSION
+from .clients import get_client, get_async_client
+from .metrics import record_api_call
 
 def expand_query(query):
     """Expand user query with programming synonyms and context."""
@@ -19,26 +18,49 @@ def expand_query(query):
     }
     
     words = re.findall(r'\w+', query.lower())
-    expanded_terms = set(words)
+    expanded_terms = dict.fromkeys(words)  # Ordered, so the expansion (and its cached embedding) is stable
     
     for word in words:
         if word in expansions:
-            expanded_terms.update(expansions[word])
+            expanded_terms.update(dict.fromkeys(expansions[word]))
     
     return ' '.join(expanded_terms)
 
-def rerank_by_relevance(query, results, top_k=None):
-    """Rerank results using LLM for better relevance."""
+SIGNALS = ('semantic_score', 'keyword_score', 'symbol_score')
+
+def top_lead(results):
+    """
+    How far the top hit leads every other result on its strongest raw signal: the
+    semantic similarity, the BM25 score relative to the best keyword hit, or the
+    symbol match. Fused scores are rank-based, so they can't tell a decisive hit from
+    a close call.
+    """
+    return max(
+        results[0].get(signal, 0) - max(result.get(signal, 0) for result in results[1:])
+        for signal in SIGNALS
+    )
+
+def should_rerank(results):
+    """
+    Whether reranking is worth it: a reranker is enabled, there are more than 3
+    results, and the top hit doesn't already lead by RERANK_SKIP_MARGIN (see top_lead).
+    """
+    if RERANKER == "none" or (RERANKER == "llm" and not ENABLE_LLM_RERANKING):
+        return False
     if not results or len(results) <= 3:
-        return results
-    
+        return False
+    if RERANK_SKIP_MARGIN > 0:
+        return top_lead(results) < RERANK_SKIP_MARGIN
+    return True
+
+def _rerank_prompt(query, results):
     # Create compact summaries for reranking
     summaries = []
     for i, result in enumerate(results[:10]):  # Limit for token efficiency
         content_preview = result['content'][:200] + "..." if len(result['content']) > 200 else result['content']
         summaries.append(f"{i}: {result['filename']} - {content_preview}")
     
-    prompt = f"""Query: "{query}"
+    return f"""Query: "{query}"
 
 Rank these code snippets by relevance to the query (most relevant first).
 Return only numbers separated by commas (e.g., "2,0,4,1,3"):
@@ -47,48 +69,115 @@ Return only numbers separated by commas (e.g., "2,0,4,1,3"):
 
 Rankings:"""
 
+def _apply_rankings(results, rankings, top_k):
+    indices = [int(x.strip()) for x in rankings.split(',') if x.strip().isdigit()]
+    
+    # Reorder results based on LLM ranking
+    reranked = []
+    for idx in indices:
+        if 0 <= idx < len(results):
+            reranked.append(results[idx])
+    
+    # Add any missed results at the end
+    used_indices = set(indices)
+    for i, result in enumerate(results):
+        if i not in used_indices:
+            reranked.append(result)
+    
+    return reranked[:top_k] if top_k else reranked
+
+def rerank_by_relevance(query, results, top_k=None):
+    """Rerank results using LLM for better relevance."""
+    if not results or len(results) <= 3:
+        return results
+
     try:
-        response = client.chat.completions.create(
+        response = get_client().chat.completions.create(
             model=OPENAI_CHAT_MODEL,
-            messages=[{"role": "user", "content": prompt}],
+            messages=[{"role": "user", "content": _rerank_prompt(query, results)}],
             temperature=0,
             max_tokens=100
         )
-        
-        rankings = response.choices[0].message.content.strip()
-        indices = [int(x.strip()) for x in rankings.split(',') if x.strip().isdigit()]
-        
-        # Reorder results based on LLM ranking
-        reranked = []
-        for idx in indices:
-            if 0 <= idx < len(results):
-                reranked.append(results[idx])
-        
-        # Add any missed results at the end
-        used_indices = set(indices)
-        for i, result in enumerate(results):
-            if i not in used_indices:
-                reranked.append(result)
-        
-        return reranked[:top_k] if top_k else reranked
+        record_api_call("chat", response)
+        return _apply_rankings(results, response.choices[0].message.content.strip(), top_k)
         
     except Exception as e:
+        record_api_call("chat", error=e)
         print(f"Reranking failed: {e}")
         return results  # Return original order on failure
 
+async def arerank_by_relevance(query, results, top_k=None):
+    """Async rerank_by_relevance using the async OpenAI client."""
+    if not results or len(results) <= 3:
+        return results
+
+    try:
+        response = await get_async_client().chat.completions.create(
+            model=OPENAI_CHAT_MODEL,
+            messages=[{"role": "user", "content": _rerank_prompt(query, results)}],
+            temperature=0,
+            max_tokens=100
+        )
+        record_api_call("chat", response)
+        return _apply_rankings(results, response.choices[0].message.content.strip(), top_k)
+
+    except Exception as e:
+        record_api_call("chat", error=e)
+        print(f"Reranking failed: {e}")
+        return results  # Return original order on failure
+
+INTENT_PATTERNS = {
+    'debug': r'\b(error|bug|fix|issue|problem|exception|traceback)\b',
+    'implement': r'\b(how to|create|make|implement|build|write|code)\b',
+    'understand': r'\b(what|why|how does|explain|understand|meaning)\b',
+    'find': r'\b(find|search|locate|where|show me)\b',
+    'optimize': r'\b(optimize|improve|better|faster|efficient)\b'
+}
+
+# Code that answers each kind of question tends to contain these words; a rewrite pairs them with
+# the question's own terms, so its embedding lands nearer that code than the question's phrasing does
+INTENT_REWRITES = {
+    'debug': "{terms} raise exception error handling except",
+    'implement': "def {terms} implementation",
+    'understand': "{terms} definition docstring",
+    'find': "def class {terms}",
+    'optimize': "{terms} cache batch loop performance",
+}
+
+FILLER_WORDS = frozenset("""
+a an and are can do does for how i in is it me my of on or should the this that to what when where which who why
+with you
+""".split())
+
 def extract_intent(query):
     """Extract intent from query for better search strategy."""
-    patterns = {
-        'debug': r'\b(error|bug|fix|issue|problem|exception|traceback)\b',
-        'implement': r'\b(how to|create|make|implement|build|write|code)\b',
-        'understand': r'\b(what|why|how does|explain|understand|meaning)\b',
-        'find': r'\b(find|search|locate|where|show me)\b',
-        'optimize': r'\b(optimize|improve|better|faster|efficient)\b'
-    }
-    
     query_lower = query.lower()
-    for intent, pattern in patterns.items():
+    for intent, pattern in INTENT_PATTERNS.items():
         if re.search(pattern, query_lower):
             return intent
     
-    return 'general'
\ No newline at end of file
+    return 'general'
+
+def intent_rewrite(query, intent=None):
+    """The query's terms restated in the vocabulary of its intent's code, or None for general queries."""
+    intent = intent or extract_intent(query)
+    template = INTENT_REWRITES.get(intent)
+    if template is None:
+        return None
+    stripped = re.sub(INTENT_PATTERNS[intent], ' ', query, flags=re.IGNORECASE)
+    terms = [word for word in re.findall(r'\w+', stripped) if word.lower() not in FILLER_WORDS]
+    return template.format(terms=' '.join(terms)) if terms else None
+
+def query_variants(query):
+    """
+    Texts to search for a question: the question itself and, with ENABLE_QUERY_EXPANSION,
+    its synonym expansion (when it adds synonyms) and intent rewrite. search_code embeds
+    them in one request and fuses their rankings.
+    """
+    variants = [query]
+    if ENABLE_QUERY_EXPANSION:
+        expanded = expand_query(query)
+        if set(expanded.split()) != set(re.findall(r'\w+', query.lower())):
+            variants.append(expanded)
+        variants.append(intent_rewrite(query))
+    return list(dict.fromkeys(variant for variant in variants if variant))
@@ -0,0 +1,231 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from .index import SHARDS, get_snapshots, search_shard_names
+from .search import (
+    semantic_search_batch, combine_results, shard_rankings, symbol_hits, names_symbol,
+    query_texts, embed_queries, _timed_keyword_search
+)
+from .metrics import span, increment, render_prometheus
+from .distances import METRICS
+from .config import (
+    RAG_DISTANCE_METRIC, QUERY_SERVER_HOST, QUERY_SERVER_PORT, QUERY_BATCH_WINDOW_MS, QUERY_BATCH_MAX,
+    QUERY_SERVER_WORKERS, QUERY_SERVER_TIMEOUT, HYBRID_SEARCH_ALPHA
+)
+
+class SearchRequest:
+    def __init__(self, query, k, alpha, metric, shards, variants=None):
+        self.query = query
+        self.texts = query_texts(query, variants)  # Embedded and searched; one semantic ranking each
+        self.k = k
+        self.alpha = alpha
+        self.metric = metric or RAG_DISTANCE_METRIC
+        self.shards = tuple(search_shard_names(shards))
+        self.symbols = []  # Symbol table hits per searched shard
+        self.future = Future()
+
+class QueryBatcher:
+    """
+    Serves search_code requests from many threads in micro-batches. Requests arriving
+    within window_ms of the first one (up to max_batch) share one embedding request for
+    their uncached queries and query variants, and one FAISS search per shard over the
+    stacked query matrix.
+    Up to `workers` batches run at once, so the next batch forms while one waits on its embedding request.
+    """
+
+    def __init__(self, window_ms=QUERY_BATCH_WINDOW_MS, max_batch=QUERY_BATCH_MAX, workers=QUERY_SERVER_WORKERS):
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._queue = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="query-batch")
+        self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, query, k=5, alpha=HYBRID_SEARCH_ALPHA, metric=None, shards=None, variants=None):
+        """
+        Queue a search; returns a Future resolving to the same results as search_code.
+        A query naming a known symbol needs no embedding, so it is answered right away.
+        """
+        request = SearchRequest(query, k, alpha, metric, shards, variants)
+        try:
+            snapshots = get_snapshots(list(request.shards))
+            request.symbols = symbol_hits(snapshots, query, k * 3)
+            if names_symbol(request.symbols):
+                request.future.set_result(combine_results([
+                    shard_rankings(snapshot, query, None, k, request.metric, symbols=hits)
+                    for snapshot, hits in zip(snapshots, request.symbols)
+                ], k, alpha))
+                return request.future
+        except Exception as e:
+            request.future.set_exception(e)
+            return request.future
+        self._queue.put(request)
+        return request.future
+
+    def search(self, query, k=5, alpha=HYBRID_SEARCH_ALPHA, metric=None, shards=None, variants=None, timeout=QUERY_SERVER_TIMEOUT):
+        return self.submit(query, k, alpha, metric, shards, variants).result(timeout)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._pool.shutdown()
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)  # Finish this batch, then stop
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            increment("coderag_query_batches_total")
+            increment("coderag_batched_queries_total", len(batch))
+            self._pool.submit(self._process, batch)
+
+    def _process(self, batch):
+        try:
+            with span("search_batch"):
+                self._search_batch(batch)
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+
+    def _embed(self, batch):
+        """Each request's query embeddings, from the query cache or one embedding request for the rest."""
+        texts = list(dict.fromkeys(text for request in batch for text in request.texts))
+        rows = dict(zip(texts, embed_queries(texts)))
+        return [np.vstack([rows[text] for text in request.texts]) for request in batch]
+
+    def _search_batch(self, batch):
+        embeddings = self._embed(batch)
+
+        # Requests searching the same shards with the same metric share one FAISS call per shard
+        groups = {}
+        for request, embedding in zip(batch, embeddings):
+            groups.setdefault((request.shards, request.metric), []).append((request, embedding))
+
+        for (shards, metric), members in groups.items():
+            try:
+                snapshots = get_snapshots(list(shards))
+                k = max(request.k for request, _ in members)
+                matrix = np.vstack([embedding for _, embedding in members])
+                bounds = np.cumsum([0] + [len(embedding) for _, embedding in members])
+                rankings = [[] for _ in members]
+                for number, snapshot in enumerate(snapshots):
+                    with span("semantic_search"):
+                        semantic = semantic_search_batch(snapshot, matrix, k, metric)
+                    for shard_lists, (request, _), start, end in zip(rankings, members, bounds, bounds[1:]):
+                        keyword_hits = _timed_keyword_search(request.query, snapshot.bm25, request.k * 3)
+                        symbols = request.symbols[number] if number < len(request.symbols) else ()
+                        shard_lists.append((snapshot, semantic[start:end], keyword_hits, symbols))
+                for shard_lists, (request, _) in zip(rankings, members):
+                    with span("combine_results"):
+                        request.future.set_result(combine_results(shard_lists, request.k, request.alpha))
+            except Exception as e:
+                for request, _ in members:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """POST /search {"query", "k", "alpha", "metric", "shards", "variants"}; GET /health; GET /metrics."""
+
+    def do_POST(self):
+        if self.path != "/search":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("body must be a JSON object")
+            query = body.get("query")
+            if not isinstance(query, str) or not query.strip():
+                raise ValueError("query must be a non-empty string")
+            # Bad fields fail here with a 400, not inside a batch shared with other requests
+            k = body.get("k", 5)
+            if isinstance(k, bool) or not isinstance(k, int) or k < 1:
+                raise ValueError("k must be a positive integer")
+            alpha = body.get("alpha")
+            alpha = HYBRID_SEARCH_ALPHA if alpha is None else float(alpha)
+            if not 0.0 <= alpha <= 1.0:
+                raise ValueError("alpha must be between 0 and 1")
+            metric = body.get("metric")
+            if metric is not None and metric not in METRICS:
+                raise ValueError(f"metric must be one of {', '.join(METRICS)}")
+            shards = body.get("shards")
+            if shards is not None and (not isinstance(shards, list) or not all(isinstance(name, str) for name in shards)):
+                raise ValueError("shards must be a list of shard names")
+            unknown = [name for name in shards or () if name not in SHARDS]
+            if unknown:
+                raise ValueError(f"unknown shards {unknown}; configured shards: {', '.join(SHARDS)}")
+            variants = body.get("variants") or []
+            if not isinstance(variants, list) or not all(isinstance(variant, str) for variant in variants):
+                raise ValueError("variants must be a list of strings")
+        except (ValueError, TypeError, AttributeError) as e:
+            self._send_json(400, {"error": f"Invalid request: {e}"})
+            return
+        try:
+            results = self.server.batcher.search(query, k, alpha, metric, shards, variants)
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200, {"results": results})
+
+    def do_GET(self):
+        if self.path == "/health":
+            try:
+                snapshots = get_snapshots(list(SHARDS))
+            except FileNotFoundError as e:
+                self._send_json(503, {"status": "no index", "error": str(e)})
+                return
+            generations = {snapshot.shard: snapshot.generation for snapshot in snapshots}
+            self._send_json(200, {"status": "ok", "generations": generations})
+        elif self.path == "/metrics":
+            self._send(200, render_prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def _send_json(self, status, payload):
+        # Scores may be numpy floats
+        self._send(status, json.dumps(payload, default=float).encode("utf-8"), "application/json")
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # One line per query would drown the server's own output
+
+class QueryHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # Connections waiting to be accepted under bursts of concurrent clients
+
+def make_server(host=QUERY_SERVER_HOST, port=QUERY_SERVER_PORT, batcher=None):
+    """HTTP query server over one shared copy of the index; call serve_forever() on it."""
+    server = QueryHTTPServer((host, port), QueryRequestHandler)
+    server.batcher = batcher or QueryBatcher()
+    return server
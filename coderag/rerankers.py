@@ -0,0 +1,124 @@
+import asyncio
+import re
+import threading
+from .bm25 import tokenize
+from .config import RERANKER, CROSS_ENCODER_MODEL
+from .query_enhancement import rerank_by_relevance, arerank_by_relevance
+
+RERANKERS = ("features", "cross_encoder", "llm", "none")
+
+if RERANKER not in RERANKERS:
+    raise ValueError(f"RERANKER must be one of {', '.join(RERANKERS)}, got {RERANKER!r}")
+
+# Words that say nothing about which chunk is relevant
+STOPWORDS = frozenset("""
+a an and are as at be by code do does for from how i in is it of on or the this to
+what when where which who why with work works
+""".split())
+
+def identifier_terms(text):
+    """Lowercase terms of text with snake_case and camelCase identifiers split into words."""
+    words = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', text).replace('_', ' ')
+    return [term for term in tokenize(words) if term not in STOPWORDS]
+
+class Reranker:
+    """Reorders search results for a query; subclasses implement rerank()."""
+
+    name = "none"
+
+    def rerank(self, query, results, top_k=None):
+        return results[:top_k] if top_k else results
+
+    async def arerank(self, query, results, top_k=None):
+        # CPU-bound rerankers run off the event loop
+        return await asyncio.to_thread(self.rerank, query, results, top_k)
+
+class FeatureReranker(Reranker):
+    """
+    CPU-only reranker fusing the retrieval scores with cheap lexical features:
+    how many query terms the chunk's name/path and content contain.
+    Costs microseconds per result and needs no model or network.
+    """
+
+    name = "features"
+
+    def __init__(self, semantic=0.45, keyword=0.2, name_match=0.25, coverage=0.1):
+        self.weights = (semantic, keyword, name_match, coverage)
+
+    def score(self, query_terms, result):
+        semantic, keyword, name_weight, coverage_weight = self.weights
+        if not query_terms:
+            return semantic * result.get('semantic_score', 0) + keyword * result.get('keyword_score', 0)
+        location = set(identifier_terms(f"{result.get('name') or ''} {result['filepath']}"))
+        content = set(identifier_terms(result['content']))
+        name_match = len(query_terms & location) / len(query_terms)
+        coverage = len(query_terms & content) / len(query_terms)
+        return (
+            semantic * result.get('semantic_score', 0) + keyword * result.get('keyword_score', 0)
+            + name_weight * name_match + coverage_weight * coverage
+        )
+
+    def rerank(self, query, results, top_k=None):
+        query_terms = set(identifier_terms(query))
+        ranked = sorted(results, key=lambda result: self.score(query_terms, result), reverse=True)
+        return ranked[:top_k] if top_k else ranked
+
+class CrossEncoderReranker(Reranker):
+    """
+    Small local cross-encoder (sentence-transformers), loaded once per process on first use.
+    Requires `pip install sentence-transformers`.
+    """
+
+    name = "cross_encoder"
+
+    def __init__(self, model_name=CROSS_ENCODER_MODEL):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    try:
+                        from sentence_transformers import CrossEncoder
+                    except ImportError as e:
+                        raise ImportError(
+                            "RERANKER=cross_encoder needs sentence-transformers (pip install sentence-transformers)"
+                        ) from e
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def rerank(self, query, results, top_k=None):
+        if not results:
+            return results
+        scores = self._load().predict([(query, result['content']) for result in results])
+        ranked = [result for _, result in sorted(zip(scores, results), key=lambda pair: pair[0], reverse=True)]
+        return ranked[:top_k] if top_k else ranked
+
+class LLMReranker(Reranker):
+    """The original behaviour: ask OPENAI_CHAT_MODEL to order the results."""
+
+    name = "llm"
+
+    def rerank(self, query, results, top_k=None):
+        return rerank_by_relevance(query, results, top_k=top_k)
+
+    async def arerank(self, query, results, top_k=None):
+        return await arerank_by_relevance(query, results, top_k=top_k)
+
+_rerankers = {}
+_rerankers_lock = threading.Lock()
+
+def get_reranker(name=RERANKER):
+    """Shared reranker instance for a backend name (models are loaded once per process)."""
+    with _rerankers_lock:
+        if name not in _rerankers:
+            classes = {
+                "features": FeatureReranker, "cross_encoder": CrossEncoderReranker,
+                "llm": LLMReranker, "none": Reranker
+            }
+            if name not in classes:
+                raise ValueError(f"Unknown reranker {name!r}; expected one of {', '.join(RERANKERS)}")
+            _rerankers[name] = classes[name]()
+        return _rerankers[name]
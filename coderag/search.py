@@ -1,106 +1,287 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import re
-from collections import Counter
-from .index import load_index, get_metadata, get_embeddings
-from .embeddings import generate_embeddings
-from .distances import cosine_similarity
-from .config import RAG_DISTANCE_METRIC
-
-def keyword_search(query, metadata, k=10):
-    """Simple keyword matching with TF-IDF-like scoring."""
-    query_terms = set(re.findall(r'\w+', query.lower()))
-    
-    scores = []
-    for i, data in enumerate(metadata):
-        content = data['content'].lower()
-        # Count term frequencies
-        content_terms = re.findall(r'\w+', content)
-        term_freq = Counter(content_terms)
-        
-        score = 0
-        for term in query_terms:
-            if term in term_freq:
-                # Simple TF scoring with bonus for exact matches
-                tf = term_freq[term] / len(content_terms)
-                score += tf * 10 if term in content else tf
-        
-        scores.append((i, score))
-    
-    # Sort by score and return top k indices
-    scores.sort(key=lambda x: x[1], reverse=True)
-    return [idx for idx, score in scores[:k] if score > 0]
+from .index import IndexSnapshot, get_snapshots
+from .embeddings import embed_query_batch, aembed_query_batch, embedding_model_name
+from .query_cache import lookup, store, normalize_query, query_embeddings
+from .distances import similarity_batch
+from .metrics import span, increment
+from .symbols import query_identifiers
+from .config import (
+    RAG_DISTANCE_METRIC, SHARD_SEARCH_WORKERS, ENABLE_SYMBOL_SEARCH, SYMBOL_BOOST, RRF_K, HYBRID_SEARCH_ALPHA
+)
+
+_shard_pool = None
+_shard_pool_lock = threading.Lock()
 
-def search_code(query, k=5, alpha=0.7):
+def keyword_search(query, bm25, k=10):
     """
-    Hybrid search combining semantic and keyword matching.
-    alpha: weight for semantic search (1-alpha for keyword search)
+    BM25 keyword search over the inverted index.
+    Returns up to k (index, score) pairs, best first; cost depends on the query terms' postings only.
     """
-    index = load_index()
-    query_embedding = generate_embeddings(query)
-    metadata = get_metadata()
-    stored_embeddings = get_embeddings()
+    return [(idx, score) for idx, score in bm25.search(query, k) if score > 0]
 
-    if query_embedding is None:
-        print("Failed to generate query embedding.")
-        return []
+def semantic_scores(metric, query_embedding, ids, distances, stored_embeddings):
+    """
+    Score FAISS candidates with the chosen metric in one batched call over the stored
+    normalized embeddings. Candidates without a stored vector fall back to 1 / (1 + L2 distance).
+    """
+    scores = 1.0 / (1.0 + np.maximum(distances, 0.0))
+    rows = stored_embeddings.rows_for(ids)
+    known = rows >= 0
+    if known.any():
+        similarities = similarity_batch(
+            metric, query_embedding, stored_embeddings.unit[rows[known]], stored_embeddings.norms[rows[known]]
+        )
+        if metric == "euclidean":
+            # Map the negative distance onto (0, 1] like the fallback
+            similarities = 1.0 / (1.0 - similarities)
+        scores[known] = similarities
+    return scores
+
+def semantic_search(snapshot, query_embedding, k, metric):
+    """FAISS candidates for a query embedding and their scores under metric: (ids, scores)."""
+    return semantic_search_batch(snapshot, query_embedding, k, metric)[0]
+
+def semantic_search_batch(snapshot, query_embeddings, k, metric):
+    """semantic_search for every row of a query matrix with a single FAISS search call: [(ids, scores)]."""
+    index = snapshot.index
+    metadata = snapshot.metadata
+    query_embeddings = np.asarray(query_embeddings, dtype='float32').reshape(-1, index.d)
+    # Oversample by the number of deleted-but-not-compacted vectors
+    dead_vectors = max(0, index.ntotal - len(metadata))
+    search_k = min(k * 3 + dead_vectors, index.ntotal)  # Get more candidates
+    distances, indices = index.search(query_embeddings, search_k)
+    results = []
+    for row, query_embedding in enumerate(query_embeddings):
+        candidates = [(i, int(idx)) for i, idx in enumerate(indices[row]) if idx in metadata]
+        ids = [idx for _, idx in candidates]
+        scores = semantic_scores(
+            metric, query_embedding, ids, distances[row][[i for i, _ in candidates]], snapshot.embeddings
+        )
+        results.append((ids, scores))
+    return results
+
+def symbol_hits(snapshots, query, k):
+    """
+    Symbol table hits of each snapshot for the identifiers the query names:
+    [(index, score)] per snapshot, 1.0 for an exact name.
+    """
+    identifiers = query_identifiers(query) if ENABLE_SYMBOL_SEARCH else []
+    if not identifiers:
+        return [[] for _ in snapshots]
+    with span("symbol_search"):
+        return [snapshot.symbols.search(identifiers, k) if snapshot.symbols is not None else []
+                for snapshot in snapshots]
+
+def names_symbol(hits_per_snapshot):
+    """True if the query names a known symbol exactly; it is then answered without an embedding request."""
+    if any(score >= 1.0 for hits in hits_per_snapshot for _, score in hits):
+        increment("coderag_symbol_answers_total")
+        return True
+    return False
+
+def combine_results(rankings, k, alpha):
+    """
+    Fuse the ranked lists of one or more shards into the top k result dicts by weighted
+    reciprocal rank fusion. rankings holds one (snapshot, semantic_lists, keyword_hits,
+    symbol_hits) tuple per shard (see shard_rankings); each kind of list is merged across
+    the shards by its own score first, so ranks are global, and a list of weight w adds
+    w / (RRF_K + rank) to every chunk it ranks. The semantic lists, one (ids, scores) pair
+    per query variant, share alpha; the keyword hits get 1 - alpha and the symbol hits
+    SYMBOL_BOOST, scaled down for partial name matches.
+    Scores are scaled so that a chunk ranked first by the semantic and keyword lists scores
+    1.0, whichever lists are empty, so they compare across queries and shards. The best
+    semantic score over the variants, the BM25 score relative to the top hit and the
+    symbol match score are kept for display and reranking.
+    """
+    def merged(lists):
+        # (shard number, index) pairs of every shard's list, best score first
+        hits = [(float(score), number, idx) for number, shard_hits in enumerate(lists)
+                for idx, score in shard_hits if idx in rankings[number][0].metadata]
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return [((number, idx), score) for score, number, idx in hits]
+
+    n_variants = max((len(semantic_lists) for _, semantic_lists, _, _ in rankings), default=0)
+    ranked_lists = [
+        (alpha / n_variants, "semantic_score", merged(
+            [zip(*semantic_lists[variant]) if variant < len(semantic_lists) else ()
+             for _, semantic_lists, _, _ in rankings]
+        ))
+        for variant in range(n_variants)
+    ]
+    keyword = merged([keyword_hits for _, _, keyword_hits, _ in rankings])
+    max_keyword_score = keyword[0][1] if keyword else 1.0
+    ranked_lists.append((1 - alpha, "keyword_score", [(key, score / max_keyword_score) for key, score in keyword]))
+    ranked_lists.append((SYMBOL_BOOST, "symbol_score", merged([symbols for _, _, _, symbols in rankings])))
 
-    # Semantic search
-    search_k = min(k * 3, index.ntotal)  # Get more candidates
-    distances, indices = index.search(query_embedding, search_k)
-    
-    # Keyword search
-    keyword_indices = keyword_search(query, metadata, k * 3)
-    
-    # Combine results with scores
     results = {}
-    
-    # Add semantic results
-    for i, idx in enumerate(indices[0]):
-        if idx < len(metadata):
-            if RAG_DISTANCE_METRIC == "cosine" and stored_embeddings:
-                sem_score = cosine_similarity(query_embedding.flatten(), stored_embeddings[idx])
-            else:
-                sem_score = 1.0 / (1.0 + distances[0][i])
-            
-            results[idx] = {
-                "data": metadata[idx],
-                "semantic_score": sem_score,
-                "keyword_score": 0
-            }
-    
-    # Add/update keyword results
-    for idx in keyword_indices:
-        if idx < len(metadata):
-            # Recalculate keyword score for normalization
-            content = metadata[idx]['content'].lower()
-            query_terms = set(re.findall(r'\w+', query.lower()))
-            content_terms = Counter(re.findall(r'\w+', content))
-            
-            kw_score = sum(content_terms.get(term, 0) for term in query_terms) / len(content_terms)
-            
-            if idx in results:
-                results[idx]["keyword_score"] = kw_score
-            else:
-                results[idx] = {
-                    "data": metadata[idx],
-                    "semantic_score": 0,
-                    "keyword_score": kw_score
-                }
-    
-    # Calculate final scores and format results
+    for weight, signal, hits in ranked_lists:
+        for rank, (key, score) in enumerate(hits, start=1):
+            if key not in results:
+                results[key] = {"fused": 0.0, "semantic_score": 0, "keyword_score": 0, "symbol_score": 0}
+            entry = results[key]
+            entry["fused"] += weight * (score if signal == "symbol_score" else 1.0) / (RRF_K + rank)
+            entry[signal] = max(entry[signal], score)
+
     final_results = []
-    for idx, data in results.items():
-        final_score = alpha * data["semantic_score"] + (1 - alpha) * data["keyword_score"]
-        
+    for (number, idx), data in results.items():
+        snapshot = rankings[number][0]
+        chunk = snapshot.metadata[idx]
         final_results.append({
-            "filename": data["data"]["filename"],
-            "filepath": data["data"]["filepath"],
-            "content": data["data"]["content"],
-            "score": final_score,
+            "filename": chunk["filename"],
+            "filepath": chunk["filepath"],
+            "content": chunk["content"],
+            "line_start": chunk.get("line_start"),
+            "line_end": chunk.get("line_end"),
+            "name": chunk.get("name"),
+            "score": data["fused"] * (RRF_K + 1),
             "semantic_score": data["semantic_score"],
-            "keyword_score": data["keyword_score"]
+            "keyword_score": data["keyword_score"],
+            "symbol_score": data["symbol_score"],
+            "shard": snapshot.shard
         })
     
-    # Sort by final score and return top k
-    final_results.sort(key=lambda x: x["score"], reverse=True)
-    return final_results[:k]
\ No newline at end of file
+    # Sort by fused score, ties to the better semantic match, and return top k
+    final_results.sort(key=lambda result: (result["score"], result["semantic_score"]), reverse=True)
+    return final_results[:k]
+
+def query_texts(query, variants=None):
+    """The texts embedded for a search: the query and its variants, without duplicates."""
+    return list(dict.fromkeys([query, *(variants or ())]))
+
+def _cached_query_embeddings(texts):
+    """Query cache keys of texts, their cached embeddings (None where missing) and the positions missing."""
+    model = embedding_model_name()
+    keys = [(normalize_query(text), model) for text in texts]
+    vectors = [lookup(query_embeddings, key) for key in keys]
+    return keys, vectors, [i for i, vector in enumerate(vectors) if vector is None]
+
+def _store_query_embeddings(keys, vectors, missing, fresh):
+    for i, vector in zip(missing, fresh):
+        vectors[i] = vector[np.newaxis, :]
+        store(query_embeddings, keys[i], vectors[i])
+    return np.vstack(vectors)
+
+def embed_queries(texts):
+    """
+    Embeddings of query texts as one (len(texts), dim) matrix: from the query cache,
+    and a single embedding request for the rest, which are kept in the query cache only.
+    Raises if the request fails.
+    """
+    keys, vectors, missing = _cached_query_embeddings(texts)
+    fresh = ()
+    if missing:
+        with span("embed_query"):
+            fresh = embed_query_batch([texts[i] for i in missing])
+    return _store_query_embeddings(keys, vectors, missing, fresh)
+
+async def aembed_queries(texts):
+    """Async embed_queries."""
+    keys, vectors, missing = _cached_query_embeddings(texts)
+    fresh = ()
+    if missing:
+        with span("embed_query"):
+            fresh = await aembed_query_batch([texts[i] for i in missing])
+    return _store_query_embeddings(keys, vectors, missing, fresh)
+
+def _get_shard_pool():
+    global _shard_pool
+    with _shard_pool_lock:
+        if _shard_pool is None:
+            _shard_pool = ThreadPoolExecutor(max_workers=SHARD_SEARCH_WORKERS, thread_name_prefix="shard-search")
+        return _shard_pool
+
+def _as_snapshots(snapshot, shards):
+    """The snapshots to search: the given snapshot(s), else the current ones of the selected shards."""
+    if snapshot is None:
+        return get_snapshots(shards)
+    if isinstance(snapshot, IndexSnapshot):
+        return [snapshot]
+    return list(snapshot)
+
+def shard_rankings(snapshot, query, embeddings, k, metric, keyword_hits=None, symbols=()):
+    """
+    One shard's ranked lists for combine_results: (snapshot, semantic_lists, keyword_hits,
+    symbols). embeddings holds one row per query variant, all searched with one FAISS call;
+    without them only the keyword search and the symbol hits are used.
+    """
+    semantic_lists = []
+    if embeddings is not None:
+        with span("semantic_search"):
+            semantic_lists = semantic_search_batch(snapshot, embeddings, k, metric)
+    if keyword_hits is None:
+        keyword_hits = _timed_keyword_search(query, snapshot.bm25, k * 3)
+    return snapshot, semantic_lists, keyword_hits, symbols
+
+def search_code(query, k=5, alpha=HYBRID_SEARCH_ALPHA, metric=None, snapshot=None, shards=None, variants=None):
+    """
+    Hybrid search combining semantic and keyword matching by reciprocal rank fusion. A query
+    naming a known function, method or class (see symbols.query_identifiers) is answered
+    from the symbol table and keyword search, without an embedding request.
+    alpha: weight of the semantic rankings (1-alpha for the keyword ranking; defaults to HYBRID_SEARCH_ALPHA)
+    metric: "cosine", "dot" or "euclidean" (defaults to RAG_DISTANCE_METRIC)
+    snapshot: index snapshot, or list of shard snapshots, to search (defaults to the current ones)
+    shards: names of the shards to search when no snapshot is given (defaults to SEARCH_SHARDS, else all)
+    variants: rephrasings of the query (see query_enhancement.query_variants), embedded with it
+        in one request and searched with it in one FAISS call per shard; keyword search uses the query
+    """
+    metric = metric or RAG_DISTANCE_METRIC
+    snapshots = _as_snapshots(snapshot, shards)
+    symbols = symbol_hits(snapshots, query, k * 3)
+    embeddings = None
+    if not names_symbol(symbols):
+        try:
+            embeddings = embed_queries(query_texts(query, variants))
+        except Exception as e:
+            print(f"Failed to generate query embedding: {e}")
+            return []
+
+    if len(snapshots) == 1:
+        rankings = [shard_rankings(snapshots[0], query, embeddings, k, metric, symbols=symbols[0])]
+    else:
+        # Fan out: FAISS and the keyword scoring release the GIL, so shards are searched in parallel
+        with span("shard_fanout"):
+            pool = _get_shard_pool()
+            futures = [
+                pool.submit(contextvars.copy_context().run, shard_rankings, s, query, embeddings, k, metric,
+                            None, hits)
+                for s, hits in zip(snapshots, symbols)
+            ]
+            rankings = [future.result() for future in futures]
+    with span("combine_results"):
+        return combine_results(rankings, k, alpha)
+
+async def asearch_code(query, k=5, alpha=HYBRID_SEARCH_ALPHA, metric=None, snapshot=None, shards=None, variants=None):
+    """
+    Async search_code: the keyword searches run while the query embedding request is
+    in flight, and the CPU-bound index lookups of every shard run concurrently off the event loop.
+    """
+    metric = metric or RAG_DISTANCE_METRIC
+    snapshots = _as_snapshots(snapshot, shards)
+    symbols = symbol_hits(snapshots, query, k * 3)
+    keyword_tasks = [asyncio.to_thread(_timed_keyword_search, query, s.bm25, k * 3) for s in snapshots]
+    embeddings = None
+    if names_symbol(symbols):
+        keyword_hits = await asyncio.gather(*keyword_tasks)
+    else:
+        try:
+            embeddings, *keyword_hits = await asyncio.gather(
+                aembed_queries(query_texts(query, variants)), *keyword_tasks
+            )
+        except Exception as e:
+            print(f"Failed to generate query embedding: {e}")
+            return []
+
+    rankings = await asyncio.gather(*(
+        asyncio.to_thread(shard_rankings, s, query, embeddings, k, metric, hits, shard_symbols)
+        for s, hits, shard_symbols in zip(snapshots, keyword_hits, symbols)
+    ))
+    with span("combine_results"):
+        return combine_results(rankings, k, alpha)
+
+def _timed_keyword_search(query, bm25, k):
+    with span("keyword_search"):
+        return keyword_search(query, bm25, k)
@@ -0,0 +1,516 @@
+"""
+Versioned, memory-mapped on-disk index format.
+
+An index is a base column set plus a list of small, immutable segments appended
+since, all named by header.json (the manifest). Each column set has its own file
+id <id>:
+
+    header.json               format, version, generation, base, segments, dim, model, metric, count
+    ids.<id>.i64              chunk id of every row
+    sorted_ids.<id>.i64       chunk ids in ascending order (binary search id -> row)
+    id_rows.<id>.i64          row of each entry in sorted_ids
+    unit.<id>.f32             L2-normalized vectors, row-major (count x dim)
+    norms.<id>.f32            original vector norms
+    content.<id>.bin          UTF-8 chunk contents, concatenated
+    content_offsets.<id>.u64  count + 1 offsets into content.bin
+    meta.<id>.bin             per-row JSON metadata (filename, filepath, ...), concatenated
+    meta_offsets.<id>.u64     count + 1 offsets into meta.bin
+
+The base additionally has:
+
+    tombstones.<id>.i64       ids still present in the FAISS file but deleted
+    bm25.<id>.pkl             keyword index
+    symbols.<id>.pkl          symbol table (rebuilt from the metadata if missing)
+    faiss.<id>.index          ANN structure (omitted for flat indexes, rebuilt from unit/norms)
+
+and each segment a deleted.<id>.i64 column: ids it removes from the parts before
+it. A row in a newer part replaces the same id in older ones. Saving changes
+appends a segment, so its cost is proportional to the change rather than to the
+index; a merge rewrites everything as a new base without the deleted rows.
+
+Column files are written first and header.json is replaced atomically last, so
+readers always see a complete index. Files dropped by a publish are deleted at the
+next one, giving readers that just read the old header time to open them.
+Everything is opened with np.memmap: a query only touches the pages of the rows it
+actually scores or returns.
+"""
+
+import json
+import os
+import glob
+import numpy as np
+
+FORMAT_NAME = "coderag-columnar"
+FORMAT_VERSION = 2
+# Version 1 indexes are a base without segments and are still read
+READABLE_VERSIONS = (1, 2)
+HEADER_FILE = "header.json"
+
+def _column_path(directory, name, file_id, ext):
+    return os.path.join(directory, f"{name}.{file_id}.{ext}")
+
+def _write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def _write_array(path, array):
+    _write_file(path, np.ascontiguousarray(array).tobytes())
+
+def _memmap(path, dtype, shape=None):
+    if os.path.getsize(path) == 0:
+        return np.zeros(shape if shape is not None else 0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+def _pack_blob(values):
+    """Concatenate byte strings; returns (blob, offsets) with len(values) + 1 offsets."""
+    offsets = np.zeros(len(values) + 1, dtype='uint64')
+    if values:
+        offsets[1:] = np.cumsum([len(v) for v in values], dtype='uint64')
+    return b"".join(values), offsets
+
+def read_header(directory):
+    with open(os.path.join(directory, HEADER_FILE), "r", encoding="utf-8") as f:
+        header = json.load(f)
+    if header.get("format") != FORMAT_NAME or header.get("version") not in READABLE_VERSIONS:
+        raise ValueError(f"Unsupported index format in {directory}: {header.get('format')} v{header.get('version')}")
+    if header["version"] == 1:
+        header.update(base=header["generation"], base_count=header["count"], segments=[], retired=[])
+    return header
+
+def header_exists(directory):
+    return os.path.exists(os.path.join(directory, HEADER_FILE))
+
+def _referenced(header):
+    return [header["base"]] + [segment["id"] for segment in header["segments"]]
+
+def next_file_id(directory):
+    """A file id above every id the published header uses or has retired."""
+    try:
+        header = read_header(directory)
+    except (OSError, ValueError):
+        return 1
+    return max(_referenced(header) + header["retired"] + [header["generation"]]) + 1
+
+def _write_columns(directory, file_id, ids, unit, norms, entries):
+    ids = np.asarray(ids, dtype='int64')
+    order = np.argsort(ids, kind='stable').astype('int64')
+    content, content_offsets = _pack_blob([entry["content"].encode("utf-8") for entry in entries])
+    meta, meta_offsets = _pack_blob([
+        json.dumps({key: value for key, value in entry.items() if key != "content"}).encode("utf-8")
+        for entry in entries
+    ])
+
+    _write_array(_column_path(directory, "ids", file_id, "i64"), ids)
+    _write_array(_column_path(directory, "sorted_ids", file_id, "i64"), ids[order])
+    _write_array(_column_path(directory, "id_rows", file_id, "i64"), order)
+    _write_array(_column_path(directory, "unit", file_id, "f32"), np.asarray(unit, dtype='float32'))
+    _write_array(_column_path(directory, "norms", file_id, "f32"), np.asarray(norms, dtype='float32'))
+    _write_file(_column_path(directory, "content", file_id, "bin"), content)
+    _write_array(_column_path(directory, "content_offsets", file_id, "u64"), content_offsets)
+    _write_file(_column_path(directory, "meta", file_id, "bin"), meta)
+    _write_array(_column_path(directory, "meta_offsets", file_id, "u64"), meta_offsets)
+
+def _publish(directory, header, previous):
+    """
+    Atomically replace header.json, then delete the files the previous publish
+    retired. Files this publish stops referencing are retired in turn.
+    """
+    kept = set(_referenced(header))
+    header["retired"] = sorted(set(_referenced(previous)) - kept) if previous else []
+    tmp_path = os.path.join(directory, HEADER_FILE + ".tmp")
+    _write_file(tmp_path, json.dumps(header, indent=2).encode("utf-8"))
+    os.replace(tmp_path, os.path.join(directory, HEADER_FILE))
+    if previous:
+        _remove_file_sets(directory, lambda file_id: file_id in previous["retired"] and file_id not in kept)
+
+def _remove_file_sets(directory, doomed):
+    """Delete column files whose file id satisfies doomed (open memmaps stay valid on POSIX)."""
+    for path in glob.glob(os.path.join(directory, "*.*.*")):
+        parts = os.path.basename(path).split(".")
+        if len(parts) == 3 and parts[1].isdigit() and doomed(int(parts[1])):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def _previous_header(directory):
+    try:
+        return read_header(directory)
+    except (OSError, ValueError):
+        return None
+
+def _write_pickled(path, value):
+    """Write an index object (with a save method) or its pickled bytes."""
+    if isinstance(value, bytes):
+        _write_file(path, value)
+    else:
+        value.save(path)
+
+def write_base(directory, file_id, ids, unit, norms, entries, tombstones, bm25, faiss_bytes, symbols=None):
+    """
+    Write the files of a new base without publishing it. ids/unit/norms are the live
+    rows; entries are their metadata dicts (with "content") in the same order; bm25 and
+    symbols are the keyword index and symbol table, or their pickled bytes; faiss_bytes
+    is the serialized ANN index or None for flat indexes.
+    """
+    os.makedirs(directory, exist_ok=True)
+    _write_columns(directory, file_id, ids, unit, norms, entries)
+    _write_array(_column_path(directory, "tombstones", file_id, "i64"), np.asarray(sorted(tombstones), dtype='int64'))
+    _write_pickled(_column_path(directory, "bm25", file_id, "pkl"), bm25)
+    if symbols is not None:
+        _write_pickled(_column_path(directory, "symbols", file_id, "pkl"), symbols)
+    if faiss_bytes is not None:
+        _write_file(_column_path(directory, "faiss", file_id, "index"), faiss_bytes)
+
+def publish_base(directory, file_id, count, has_faiss, merged_segments=None, **header_fields):
+    """
+    Publish a base written by write_base. merged_segments are the ids of the segments
+    its rows include (None: all of them); segments published since stay on top of it.
+    Returns the new generation number.
+    """
+    previous = _previous_header(directory)
+    segments = [segment for segment in previous["segments"]
+                if merged_segments is not None and segment["id"] not in merged_segments] if previous else []
+    header = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "generation": previous["generation"] + 1 if previous else 1,
+        "count": int(count),
+        "has_faiss": has_faiss,
+        "base": file_id,
+        "base_count": int(count),
+        "segments": segments,
+        **header_fields
+    }
+    _publish(directory, header, previous)
+    # Column sets older than the new base that no header names, e.g. left by an interrupted save
+    named = set(_referenced(header)) | set(header["retired"])
+    _remove_file_sets(directory, lambda old: old < file_id and old not in named)
+    return header["generation"]
+
+def write_generation(directory, ids, unit, norms, entries, tombstones, bm25, faiss_bytes, symbols=None,
+                     **header_fields):
+    """
+    Write a new base replacing the whole index and publish it by atomically replacing
+    header.json (see write_base for the arguments). Returns the new generation number.
+    """
+    file_id = next_file_id(directory)
+    write_base(directory, file_id, ids, unit, norms, entries, tombstones, bm25, faiss_bytes, symbols)
+    return publish_base(directory, file_id, len(ids), faiss_bytes is not None, **header_fields)
+
+def append_segment(directory, file_id, ids, unit, norms, entries, deleted, **header_fields):
+    """
+    Write a segment of added or replaced rows plus the ids it deletes, and publish it
+    on top of the current index. Returns the new generation number. Callers serialize
+    publishes to one directory.
+    """
+    previous = read_header(directory)
+    _write_columns(directory, file_id, ids, unit, norms, entries)
+    _write_array(_column_path(directory, "deleted", file_id, "i64"), np.asarray(sorted(deleted), dtype='int64'))
+    header = dict(previous, **header_fields)
+    header.update(
+        version=FORMAT_VERSION,
+        generation=previous["generation"] + 1,
+        segments=previous["segments"] + [{"id": file_id, "count": int(len(ids)), "deleted": len(deleted)}]
+    )
+    _publish(directory, header, previous)
+    return header["generation"]
+
+class ColumnSet:
+    """Memory-mapped columns of one base or segment."""
+
+    def __init__(self, directory, file_id, count, dim):
+        self.directory = directory
+        self.file_id = file_id
+        self.count = count
+        self.dim = dim
+
+        def column(name, ext, dtype, shape=None):
+            return _memmap(_column_path(directory, name, file_id, ext), dtype, shape)
+
+        self.ids = column("ids", "i64", 'int64')
+        self._sorted_ids = column("sorted_ids", "i64", 'int64')
+        self._id_rows = column("id_rows", "i64", 'int64')
+        self.unit = column("unit", "f32", 'float32', (count, dim))
+        self.norms = column("norms", "f32", 'float32')
+        self._content = column("content", "bin", 'uint8')
+        self._content_offsets = column("content_offsets", "u64", 'uint64')
+        self._meta = column("meta", "bin", 'uint8')
+        self._meta_offsets = column("meta_offsets", "u64", 'uint64')
+        deleted_path = _column_path(directory, "deleted", file_id, "i64")
+        self.deleted = _memmap(deleted_path, 'int64') if os.path.exists(deleted_path) else np.zeros(0, 'int64')
+
+    def path(self, name, ext):
+        return _column_path(self.directory, name, self.file_id, ext)
+
+    def rows_for(self, ids):
+        """Row of each chunk id, -1 where the id is not stored (vectorized binary search)."""
+        ids = np.asarray(ids, dtype='int64').reshape(-1)
+        if not self.count or not len(ids):
+            return np.full(len(ids), -1, dtype='int64')
+        positions = np.searchsorted(self._sorted_ids, ids)
+        positions = np.minimum(positions, self.count - 1)
+        found = self._sorted_ids[positions] == ids
+        return np.where(found, self._id_rows[positions], -1)
+
+    def content(self, row):
+        start, end = int(self._content_offsets[row]), int(self._content_offsets[row + 1])
+        return bytes(self._content[start:end]).decode("utf-8")
+
+    def meta(self, row):
+        start, end = int(self._meta_offsets[row]), int(self._meta_offsets[row + 1])
+        return json.loads(bytes(self._meta[start:end]).decode("utf-8"))
+
+    def entry(self, row):
+        """Full metadata dict of a row, content included."""
+        data = self.meta(row)
+        data["content"] = self.content(row)
+        return data
+
+class StackedRows:
+    """Row-indexable view over the same column of several parts (global row = part offset + row)."""
+
+    def __init__(self, columns, offsets):
+        self._columns = columns
+        self._offsets = offsets
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def __getitem__(self, rows):
+        rows = np.asarray(rows, dtype='int64')
+        parts = np.searchsorted(self._offsets, rows, side='right') - 1
+        out = np.empty(rows.shape + self._columns[0].shape[1:], dtype=self._columns[0].dtype)
+        for part in np.unique(parts):
+            selected = parts == part
+            out[selected] = self._columns[part][rows[selected] - self._offsets[part]]
+        return out
+
+class ColumnarIndex:
+    """
+    Read-only, memory-mapped view of the published index: the base and its segments.
+    Rows are numbered across the parts in order; rows replaced or deleted by a newer
+    segment are hidden.
+    """
+
+    def __init__(self, directory, header=None):
+        self.directory = directory
+        self.header = header or read_header(directory)
+        self.generation = self.header["generation"]
+        self.dim = self.header["dim"]
+        self.parts = [ColumnSet(directory, self.header["base"], self.header["base_count"], self.dim)] + [
+            ColumnSet(directory, segment["id"], segment["count"], self.dim) for segment in self.header["segments"]
+        ]
+        self.base = self.parts[0]
+        self.offsets = np.cumsum([0] + [part.count for part in self.parts]).astype('int64')
+        self.tombstones = set(_memmap(self.base.path("tombstones", "i64"), 'int64').tolist())
+
+        # Ids each part hides from the parts before it
+        self.hidden = [np.zeros(0, dtype='int64') for _ in self.parts]
+        newer = np.zeros(0, dtype='int64')
+        for i in range(len(self.parts) - 1, -1, -1):
+            part = self.parts[i]
+            rows = part.rows_for(newer)
+            self.hidden[i] = np.asarray(part.ids[rows[rows >= 0]], dtype='int64')
+            newer = np.union1d(newer, np.union1d(part.ids, part.deleted)) if i else newer
+
+        if len(self.parts) == 1:
+            self.unit = self.base.unit
+            self.norms = self.base.norms
+        else:
+            self.unit = StackedRows([part.unit for part in self.parts], self.offsets)
+            self.norms = StackedRows([part.norms for part in self.parts], self.offsets)
+        self.count = sum(part.count - len(hidden) for part, hidden in zip(self.parts, self.hidden))
+
+        # Global row of every id a segment adds, -1 for those it deletes; other ids are in the base
+        self._segment_rows = {}
+        for i, part in enumerate(self.parts[1:], 1):
+            self._segment_rows.update(dict.fromkeys(part.deleted.tolist(), -1))
+            self._segment_rows.update(zip(part.ids.tolist(), range(self.offsets[i], self.offsets[i + 1])))
+        self._ids = None
+        self._live_rows = None
+        self.metadata = ColumnarMetadata(self)
+
+    def path(self, name, ext):
+        """A file of the base (its FAISS index or keyword index)."""
+        return self.base.path(name, ext)
+
+    def __len__(self):
+        return self.count
+
+    def _part_live_rows(self, i):
+        part = self.parts[i]
+        rows = np.arange(part.count, dtype='int64')
+        if len(self.hidden[i]):
+            rows = rows[~np.isin(part.ids, self.hidden[i])]
+        return rows
+
+    def live_rows(self):
+        """Global row of every live id, in the order of ids."""
+        if self._live_rows is None:
+            self._live_rows = np.concatenate([
+                self._part_live_rows(i) + self.offsets[i] for i in range(len(self.parts))
+            ])
+        return self._live_rows
+
+    @property
+    def ids(self):
+        if len(self.parts) == 1:
+            return self.base.ids
+        if self._ids is None:
+            rows = self.live_rows()
+            self._ids = np.concatenate([
+                part.ids[rows[(rows >= self.offsets[i]) & (rows < self.offsets[i + 1])] - self.offsets[i]]
+                for i, part in enumerate(self.parts)
+            ])
+        return self._ids
+
+    def rows_for(self, ids):
+        """Global row of each chunk id, -1 where the id is not stored; the newest part holding an id wins."""
+        ids = np.asarray(ids, dtype='int64').reshape(-1)
+        rows = self.base.rows_for(ids)
+        if self._segment_rows:
+            # -2: not touched by any segment
+            segment_rows = np.fromiter((self._segment_rows.get(chunk, -2) for chunk in ids.tolist()),
+                                       dtype='int64', count=len(ids))
+            rows = np.where(segment_rows != -2, segment_rows, rows)
+        return rows
+
+    def _locate(self, row):
+        i = int(np.searchsorted(self.offsets, row, side='right')) - 1
+        return self.parts[i], int(row - self.offsets[i])
+
+    def content(self, row):
+        part, local = self._locate(row)
+        return part.content(local)
+
+    def meta(self, row):
+        part, local = self._locate(row)
+        return part.meta(local)
+
+    def entry(self, row):
+        """Full metadata dict of a row, content included."""
+        part, local = self._locate(row)
+        return part.entry(local)
+
+    def segment_changes(self):
+        """
+        (removed, added) lists of (id, entry): the base rows hidden by segments and the live
+        segment rows, which turn the base's keyword index and symbol table into those of
+        the whole index.
+        """
+        removed = [(int(self.base.ids[row]), self.base.entry(row))
+                   for row in self.base.rows_for(self.hidden[0]).tolist()]
+        added = [(int(part.ids[row]), part.entry(row))
+                 for i, part in enumerate(self.parts[1:], 1) for row in self._part_live_rows(i).tolist()]
+        return removed, added
+
+    def live_vectors(self):
+        """(unit, norms) of the live rows, in the order of ids."""
+        if len(self.parts) == 1:
+            return self.base.unit, self.base.norms
+        rows = self.live_rows()
+        return self.unit[rows], self.norms[rows]
+
+    def raw_matrix(self):
+        unit, norms = self.live_vectors()
+        return np.asarray(unit) * np.asarray(norms)[:, None]
+
+class ColumnarMetadata:
+    """Mapping of chunk id -> metadata dict; rows are decoded only when accessed."""
+
+    def __init__(self, columns):
+        self._columns = columns
+
+    def __len__(self):
+        return self._columns.count
+
+    def __contains__(self, chunk):
+        return self._columns.rows_for([chunk])[0] >= 0
+
+    def __getitem__(self, chunk):
+        row = self._columns.rows_for([chunk])[0]
+        if row < 0:
+            raise KeyError(chunk)
+        return self._columns.entry(row)
+
+    def get(self, chunk, default=None):
+        row = self._columns.rows_for([chunk])[0]
+        return self._columns.entry(row) if row >= 0 else default
+
+    def __iter__(self):
+        return iter(self._columns.ids.tolist())
+
+    def items(self):
+        for chunk, row in zip(self._columns.ids.tolist(), self._columns.live_rows().tolist()):
+            yield chunk, self._columns.entry(row)
+
+class MemmapFlatIndex:
+    """
+    Exact L2 search straight over the memory-mapped unit/norms columns, with the
+    same search() contract as a FAISS index (squared distances, ids, -1 padding).
+    Used for flat indexes so readers don't keep a second copy of every vector.
+    """
+
+    def __init__(self, columns):
+        self._columns = columns
+        self.ntotal = columns.count
+        self.d = columns.dim
+
+    def search(self, queries, k):
+        queries = np.asarray(queries, dtype='float32').reshape(-1, self.d)
+        distances = np.full((len(queries), k), np.inf, dtype='float32')
+        labels = np.full((len(queries), k), -1, dtype='int64')
+        if not self.ntotal or k <= 0:
+            return distances, labels
+        norms = np.asarray(self._columns.norms)
+        dots = (queries @ np.asarray(self._columns.unit).T) * norms
+        squared = (queries * queries).sum(axis=1)[:, None] + (norms * norms)[None, :] - 2.0 * dots
+        top = min(k, self.ntotal)
+        for i, row_distances in enumerate(squared):
+            best = np.argpartition(row_distances, top - 1)[:top]
+            best = best[np.argsort(row_distances[best])]
+            distances[i, :top] = row_distances[best]
+            labels[i, :top] = self._columns.ids[best]
+        return distances, labels
+
+class SegmentedIndex:
+    """
+    search() over the base's index plus an exact search of every segment, merged by
+    distance. Labels of rows hidden by a newer segment (and the base's tombstones)
+    are dropped before merging, so ntotal only counts rows search() can return.
+    """
+
+    def __init__(self, base_index, columns):
+        self._indexes = [base_index] + [MemmapFlatIndex(part) for part in columns.parts[1:]]
+        self._hidden = list(columns.hidden)
+        if columns.tombstones:
+            self._hidden[0] = np.union1d(self._hidden[0], np.fromiter(columns.tombstones, dtype='int64'))
+        self.ntotal = sum(index.ntotal for index in self._indexes) - sum(len(hidden) for hidden in self._hidden)
+        self.d = columns.dim
+
+    def search(self, queries, k):
+        queries = np.asarray(queries, dtype='float32').reshape(-1, self.d)
+        all_distances, all_labels = [], []
+        for index, hidden in zip(self._indexes, self._hidden):
+            if not index.ntotal:
+                continue
+            distances, labels = index.search(queries, min(k + len(hidden), index.ntotal))
+            if len(hidden):
+                dropped = np.isin(labels, hidden)
+                distances[dropped] = np.inf
+                labels[dropped] = -1
+            all_distances.append(distances)
+            all_labels.append(labels)
+        distances = np.full((len(queries), k), np.inf, dtype='float32')
+        labels = np.full((len(queries), k), -1, dtype='int64')
+        if all_distances:
+            merged_distances = np.concatenate(all_distances, axis=1)
+            merged_labels = np.concatenate(all_labels, axis=1)
+            order = np.argsort(merged_distances, axis=1, kind='stable')[:, :k]
+            top = order.shape[1]
+            distances[:, :top] = np.take_along_axis(merged_distances, order, axis=1)
+            labels[:, :top] = np.take_along_axis(merged_labels, order, axis=1)
+        return distances, labels
@@ -0,0 +1,128 @@
+import heapq
+import pickle
+import re
+from operator import itemgetter
+
+IDENTIFIER_PATTERN = re.compile(r'[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*')
+QUOTED_PATTERN = re.compile(r'`([^`]+)`')
+CAMEL_CASE = re.compile(r'[a-z0-9][A-Z]')
+
+# Chunk types that define a symbol; module-level blocks and whole files don't
+SYMBOL_TYPES = ("function", "method", "class")
+
+# Shortest partial name looked up through trigrams, and the score of a partial match relative to an exact one
+MIN_PARTIAL_LENGTH = 4
+PARTIAL_WEIGHT = 0.5
+
+def trigrams(name):
+    return {name[i:i + 3] for i in range(len(name) - 2)}
+
+def query_identifiers(query):
+    """
+    Identifiers a query names explicitly: anything in `backticks`, and words that look
+    like code (snake_case, camelCase, dotted, or called with parentheses). Plain words
+    are left to the semantic and keyword search.
+    """
+    found = []
+    for quoted in QUOTED_PATTERN.findall(query):
+        found.extend(IDENTIFIER_PATTERN.findall(quoted))
+    unquoted = QUOTED_PATTERN.sub(" ", query)
+    for match in IDENTIFIER_PATTERN.finditer(unquoted):
+        word = match.group()
+        if '_' in word or '.' in word or CAMEL_CASE.search(word) or unquoted[match.end():match.end() + 1] == '(':
+            found.append(word)
+    return list(dict.fromkeys(found))
+
+class SymbolIndex:
+    """
+    Symbol table of the functions, methods and classes in the index.
+
+    Each definition is found by its qualified name (IndexShard.save), every dotted
+    suffix of it and its short name (save), case-insensitively. Names are also indexed
+    by trigram, so a partial name only checks the names sharing all of its trigrams.
+    """
+
+    def __init__(self):
+        self.names = {}  # lowercase name -> set of doc ids
+        self.grams = {}  # trigram -> set of names containing it
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def _keys(entry):
+        name = entry.get("name")
+        if entry.get("type") not in SYMBOL_TYPES or not name:
+            return ()
+        parts = name.lower().split(".")
+        return {".".join(parts[i:]) for i in range(len(parts))}
+
+    def add(self, doc_id, entry):
+        """Index a chunk's definition under doc_id; entry is its metadata dict."""
+        for key in self._keys(entry):
+            if key not in self.names:
+                self.names[key] = set()
+                for gram in trigrams(key):
+                    self.grams.setdefault(gram, set()).add(key)
+            self.names[key].add(doc_id)
+
+    def remove(self, doc_id, entry):
+        """Remove a chunk; entry must be the metadata it was indexed with."""
+        for key in self._keys(entry):
+            docs = self.names.get(key)
+            if docs is None:
+                continue
+            docs.discard(doc_id)
+            if not docs:
+                del self.names[key]
+                for gram in trigrams(key):
+                    names = self.grams.get(gram)
+                    if names is not None:
+                        names.discard(key)
+                        if not names:
+                            del self.grams[gram]
+
+    def _partial(self, key):
+        """Names containing key, found by intersecting its trigrams' name sets (smallest first)."""
+        sets = sorted((self.grams.get(gram, set()) for gram in trigrams(key)), key=len)
+        if not sets or not sets[0]:
+            return []
+        candidates = sets[0].intersection(*sets[1:])
+        return [name for name in candidates if key in name]
+
+    def search(self, identifiers, k=10):
+        """
+        Return up to k (doc_id, score) pairs defining the identifiers, best first: 1.0
+        for an exact name, less for a name that merely contains the identifier.
+        """
+        scores = {}
+        for identifier in identifiers:
+            key = identifier.lower()
+            if key in self.names:
+                matches = [(key, 1.0)]
+            elif len(key) >= MIN_PARTIAL_LENGTH:
+                matches = [(name, PARTIAL_WEIGHT * len(key) / len(name)) for name in self._partial(key)]
+            else:
+                matches = []
+            for name, score in matches:
+                for doc_id in self.names[name]:
+                    if score > scores.get(doc_id, 0.0):
+                        scores[doc_id] = score
+        return heapq.nlargest(k, scores.items(), key=itemgetter(1))
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    @classmethod
+    def from_entries(cls, entries):
+        """Build a symbol table from an iterable of (doc_id, metadata dict) pairs."""
+        symbols = cls()
+        for doc_id, entry in entries:
+            symbols.add(doc_id, entry)
+        return symbols
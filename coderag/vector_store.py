@@ -0,0 +1,133 @@
+import numpy as np
+
+class VectorStore:
+    """
+    Embeddings kept as one contiguous float32 matrix of L2-normalized rows plus
+    a vector of their original norms, addressed by chunk id.
+
+    Keeping unit rows and norms lets cosine, dot and euclidean scores all be
+    computed from a single matrix-vector product (see distances.py).
+    """
+
+    def __init__(self, dim, capacity=0):
+        self.dim = dim
+        self.size = 0
+        self._ids = np.zeros(capacity, dtype='int64')
+        self._unit = np.zeros((capacity, dim), dtype='float32')
+        self._norms = np.zeros(capacity, dtype='float32')
+        self._rows = {}  # chunk id -> row
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, chunk):
+        return chunk in self._rows
+
+    def __iter__(self):
+        return iter(self._ids[:self.size].tolist())
+
+    @property
+    def ids(self):
+        return self._ids[:self.size]
+
+    @property
+    def unit(self):
+        return self._unit[:self.size]
+
+    @property
+    def norms(self):
+        return self._norms[:self.size]
+
+    def _grow(self, needed):
+        capacity = max(needed, 2 * len(self._ids), 64)
+        for name in ("_ids", "_unit", "_norms"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def add(self, ids, vectors):
+        """Add (or overwrite) vectors for the given ids."""
+        vectors = np.asarray(vectors, dtype='float32').reshape(-1, self.dim)
+        ids = np.asarray(ids, dtype='int64').reshape(-1)
+        norms = np.linalg.norm(vectors, axis=1)
+        unit = vectors / np.where(norms == 0, 1.0, norms)[:, None]
+        for chunk, row_unit, norm in zip(ids.tolist(), unit, norms):
+            row = self._rows.get(chunk)
+            if row is None:
+                if self.size == len(self._ids):
+                    self._grow(self.size + 1)
+                row = self.size
+                self.size += 1
+                self._rows[chunk] = row
+                self._ids[row] = chunk
+            self._unit[row] = row_unit
+            self._norms[row] = norm
+
+    def remove(self, ids):
+        """Remove ids by moving the last row into each freed slot."""
+        for chunk in ids:
+            row = self._rows.pop(chunk, None)
+            if row is None:
+                continue
+            last = self.size - 1
+            if row != last:
+                moved = int(self._ids[last])
+                self._ids[row] = moved
+                self._unit[row] = self._unit[last]
+                self._norms[row] = self._norms[last]
+                self._rows[moved] = row
+            self.size = last
+
+    def rows_for(self, ids):
+        """Row index of each id, -1 where the id is not stored."""
+        return np.fromiter((self._rows.get(int(chunk), -1) for chunk in ids), dtype='int64', count=len(ids))
+
+    def get(self, chunk):
+        """Original (un-normalized) vector for a chunk id."""
+        row = self._rows[chunk]
+        return self._unit[row] * self._norms[row]
+
+    def raw_matrix(self):
+        """All vectors with their original norms restored, in row order."""
+        return self.unit * self.norms[:, None]
+
+    @classmethod
+    def from_arrays(cls, ids, unit, norms, dim):
+        """Copy already-normalized rows (e.g. from a memory-mapped generation) into a new store."""
+        store = cls(dim)
+        store._ids = np.array(ids, dtype='int64')
+        store._unit = np.array(unit, dtype='float32').reshape(-1, dim)
+        store._norms = np.array(norms, dtype='float32')
+        store.size = len(ids)
+        store._rows = {chunk: row for row, chunk in enumerate(store._ids.tolist())}
+        return store
+
+    def save(self, f):
+        np.save(f, self.ids)
+        np.save(f, self.unit)
+        np.save(f, self.norms)
+
+    @classmethod
+    def load(cls, f, dim):
+        """
+        Read a store written by save(). Also accepts the older layouts: a single
+        raw matrix (rows are ids), or ids followed by a raw matrix.
+        """
+        arrays = []
+        while len(arrays) < 3:
+            try:
+                arrays.append(np.load(f))
+            except (EOFError, ValueError):
+                break
+        store = cls(dim)
+        if len(arrays) == 3:
+            ids, unit, norms = arrays
+            store._ids, store._unit, store._norms = ids.astype('int64'), unit.astype('float32'), norms.astype('float32')
+            store.size = len(ids)
+            store._rows = {chunk: row for row, chunk in enumerate(ids.tolist())}
+        elif len(arrays) == 2:
+            store.add(arrays[0], arrays[1])
+        elif len(arrays) == 1 and len(arrays[0]):
+            store.add(np.arange(len(arrays[0])), arrays[0])
+        return store
@@ -1,11 +1,15 @@
 import os
 import logging
+import argparse
 import atexit
 import warnings
-from coderag.index import clear_index, add_to_index, save_index
-from coderag.embeddings import generate_embeddings
-from coderag.config import WATCHED_DIR
-from coderag.monitor import start_monitoring, should_ignore_path
+from coderag.index import SHARDS, shard_for_path, remove_shard, unconfigured_shards, remove_legacy_files
+from coderag.pipeline import embed_files
+from coderag.embeddings import get_embedding_cache
+from coderag.discovery import iter_source_paths, prepare_documents
+from coderag.manifest import load_manifest, save_manifest, document_entry, stat_matches
+from coderag.metrics import span, trace, format_trace, write_metrics
+from coderag.monitor import start_monitoring
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -13,48 +17,157 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Suppress transformers warnings
 warnings.filterwarnings("ignore", category=FutureWarning, module="transformers.tokenization_utils_base")
 
-def full_reindex():
-    """Perform a full reindex of the entire codebase."""
-    logging.info("Starting full reindexing of the codebase...")
+def index_documents(shard, documents, manifest):
+    """Chunk and embed documents, add them to the shard and record them in the manifest; returns the count indexed."""
     files_processed = 0
-    for root, _, files in os.walk(WATCHED_DIR):
-        if should_ignore_path(root):  # Check if the directory should be ignored
-            logging.info(f"Ignoring directory: {root}")
+    # Chunks are embedded in batches with several requests in flight; a file is
+    # added to the index as soon as all of its chunks have returned.
+    for document, chunks in embed_files(documents):
+        filepath = document["filepath"]
+        if chunks is None:
+            logging.warning(f"Failed to generate embeddings for {filepath}")
             continue
+        try:
+            shard.upsert(filepath, chunks)
+            manifest[document["relpath"]] = document_entry(document)
+            files_processed += 1
+        except Exception as e:
+            logging.error(f"Error processing file {filepath}: {e}")
+    return files_processed
 
-        for file in files:
-            filepath = os.path.join(root, file)
-            if should_ignore_path(filepath):  # Check if the file should be ignored
-                logging.info(f"Ignoring file: {filepath}")
+def persist(shard, manifest):
+    """Compact and save the shard, plus a manifest whose row ids match the saved index."""
+    with span("compact_index"):
+        shard.compact()
+    file_rows = shard.file_rows()
+    for relpath, entry in manifest.items():
+        entry["rows"] = file_rows.get(relpath, [])
+    # An unchanged shard keeps its current generation
+    if shard.dirty or not shard.files_exist():
+        shard.save()
+    save_manifest(manifest, shard.manifest_file)
+
+def log_cache_stats():
+    cache = get_embedding_cache()
+    if cache is not None:
+        stats = cache.stats()
+        logging.info(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses.")
+
+def log_stage_times(spans):
+    logging.info("Stage times:\n" + format_trace(spans))
+    write_metrics()
+
+def shard_source_paths(shard):
+    """Source files of a shard, leaving out those that belong to a shard nested inside its root."""
+    for filepath in iter_source_paths(shard.root):
+        if shard_for_path(filepath) is shard:
+            yield filepath
+
+def full_reindex(shard):
+    """Rebuild a shard from scratch."""
+    logging.info(f"Starting full reindexing of shard {shard.name} ({shard.root})...")
+    shard.clear()
+    remove_legacy_files()
+    manifest = {}
+    with trace() as spans, span("full_reindex"):
+        # Files are read, hashed and chunked in worker processes while earlier ones are embedded
+        with span("index_documents"):
+            documents = prepare_documents(shard_source_paths(shard), root_dir=shard.root)
+            files_processed = index_documents(shard, documents, manifest)
+        with span("persist"):
+            persist(shard, manifest)
+    logging.info(f"Full reindexing of shard {shard.name} completed. {files_processed} files processed.")
+    log_cache_stats()
+    log_stage_times(spans)
+
+def incremental_reindex(shard, manifest):
+    """
+    Bring a persisted shard up to date with the working tree.
+
+    Files whose mtime and size match the manifest are skipped without being read;
+    the rest are hashed, and only added or modified files are re-embedded and
+    upserted. Chunks of deleted files are removed from the index.
+    """
+    logging.info(f"Starting incremental reindexing of shard {shard.name} ({shard.root})...")
+    seen = set()
+    added = []
+    modified = []
+
+    def stale_paths():
+        for filepath in shard_source_paths(shard):
+            relpath = shard.relative_path(filepath)
+            seen.add(relpath)
+            entry = manifest.get(relpath)
+            if entry is None or not stat_matches(entry, filepath):
+                yield filepath
+
+    def changed_documents():
+        for document in prepare_documents(stale_paths(), root_dir=shard.root):
+            entry = manifest.get(document["relpath"])
+            if entry is not None and entry["hash"] == document["hash"]:
+                # Touched but not changed: refresh mtime/size only
+                manifest[document["relpath"]] = document_entry(document, entry["rows"])
                 continue
+            (modified if entry is not None else added).append(document["relpath"])
+            yield document
 
-            if file.endswith(".py"):
-                logging.info(f"Processing file: {filepath}")
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        full_content = f.read()
+    with trace() as spans, span("incremental_reindex"):
+        with span("index_documents"):
+            files_processed = index_documents(shard, changed_documents(), manifest)
 
-                    embeddings = generate_embeddings(full_content)  # Generate embeddings
-                    if embeddings is not None:
-                        add_to_index(embeddings, full_content, file, filepath)
-                    else:
-                        logging.warning(f"Failed to generate embeddings for {filepath}")
-                    files_processed += 1
-                except Exception as e:
-                    logging.error(f"Error processing file {filepath}: {e}")
+        # The walk is complete now, so anything in the manifest that wasn't seen is gone
+        deleted = [relpath for relpath in manifest if relpath not in seen]
+        rows_removed = 0
+        with span("delete_missing"):
+            for relpath in deleted:
+                rows_removed += shard.delete(os.path.join(shard.root, relpath))
+                del manifest[relpath]
+        with span("persist"):
+            persist(shard, manifest)
+    logging.info(
+        f"Incremental reindexing of shard {shard.name} completed. {files_processed} files (re)indexed "
+        f"({len(added)} added, {len(modified)} modified), "
+        f"{len(deleted)} deleted ({rows_removed} rows removed)."
+    )
+    log_cache_stats()
+    log_stage_times(spans)
 
-    save_index()
-    logging.info(f"Full reindexing completed. {files_processed} files processed.")
+def reindex_shard(shard):
+    """Incrementally update a shard from its manifest, or rebuild it if it has no usable index."""
+    manifest = load_manifest(shard.manifest_file)
+    if manifest is not None and shard.files_exist():
+        try:
+            shard.load()
+        except Exception as e:
+            logging.warning(f"Could not load existing index of shard {shard.name}, rebuilding from scratch: {e}")
+        else:
+            # Only touch files that changed since the last run
+            incremental_reindex(shard, manifest)
+            return
+    full_reindex(shard)
 
 def main():
-    # Completely clear the FAISS index and metadata
-    clear_index()
+    parser = argparse.ArgumentParser(description="Index the configured repositories and keep them up to date")
+    parser.add_argument(
+        '--drop-shard', action='append', default=[], metavar='NAME',
+        help='Delete the files of a shard that is no longer in INDEX_SHARDS, then exit'
+    )
+    args = parser.parse_args()
+
+    if args.drop_shard:
+        for name in args.drop_shard:
+            remove_shard(name)
+        return
+
+    for name in unconfigured_shards():
+        logging.warning(f"Index shard {name} is not in INDEX_SHARDS; remove it with: python main.py --drop-shard {name}")
 
-    # Perform a full reindex of the codebase
-    full_reindex()
+    # Each shard is updated on its own: adding a repository only builds its shard
+    for shard in SHARDS.values():
+        reindex_shard(shard)
 
-    # Start monitoring the directory for changes
+    # Start monitoring the shard roots for changes
     start_monitoring()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
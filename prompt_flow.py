@@ -1,9 +1,16 @@
-from openai import OpenAI
-from coderag.config import OPENAI_API_KEY, OPENAI_CHAT_MODEL, RAG_DISTANCE_METRIC
-from coderag.search import search_code
-from coderag.query_enhancement import expand_query, rerank_by_relevance, extract_intent
+import asyncio
+from coderag.config import (
+    OPENAI_CHAT_MODEL, RAG_DISTANCE_METRIC, CONTEXT_MAX_TOKENS, QUERY_SERVER_URL, DEFAULT_SHARD
+)
+from coderag.context import pack_context
+from coderag.clients import get_client, get_async_client
+from coderag import query_cache, query_client
+from coderag.metrics import span, record_api_call, record_usage
+from coderag.query_enhancement import query_variants, should_rerank, extract_intent
+from coderag.rerankers import get_reranker
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# coderag.index and coderag.search (and faiss with them) are imported on first local search,
+# so clients of the query server never load them
 
 def get_intent_prompt(intent):
     """Get specialized system prompt based on query intent."""
@@ -16,53 +23,194 @@ def get_intent_prompt(intent):
     }
     return prompts.get(intent, "You're an expert coding assistant providing comprehensive help.")
 
-def format_code_context(results, max_chars=8000):
-    """Format search results with token management."""
-    context_parts = []
-    total_chars = 0
-    
-    for i, result in enumerate(results, 1):
-        score_info = ""
-        if 'semantic_score' in result and 'keyword_score' in result:
-            score_info = f" (sem:{result['semantic_score']:.2f}, kw:{result['keyword_score']:.2f})"
-        elif 'score' in result:
-            score_info = f" (score:{result['score']:.3f})"
-            
-        content = result['content']
-        if total_chars + len(content) > max_chars:
-            content = content[:max_chars - total_chars - 100] + "...[truncated]"
-        
-        part = f"=== File {i}: {result['filename']}{score_info} ===\nPath: {result['filepath']}\nContent:\n{content}\n"
-        context_parts.append(part)
-        total_chars += len(part)
-        
-        if total_chars >= max_chars:
-            break
-    
-    return "\n".join(context_parts)
-
-def execute_rag_flow(user_query, k=5):
-    try:
-        # Extract intent and expand query
-        intent = extract_intent(user_query)
-        expanded_query = expand_query(user_query)
-        
-        # Search with both original and expanded query
-        search_results = search_code(user_query, k=k*2)  # Get more candidates
-        
-        if not search_results:
-            return "No relevant code found for your query."
-        
-        # Rerank results using LLM
-        reranked_results = rerank_by_relevance(user_query, search_results, top_k=k)
-        
-        # Format context efficiently
+def format_result(number, result):
+    score_info = ""
+    if 'semantic_score' in result and 'keyword_score' in result:
+        symbol_info = f", sym:{result['symbol_score']:.2f}" if result.get('symbol_score') else ""
+        score_info = f" (sem:{result['semantic_score']:.2f}, kw:{result['keyword_score']:.2f}{symbol_info})"
+    elif 'score' in result:
+        score_info = f" (score:{result['score']:.3f})"
+
+    location = result['filepath']
+    if result.get('shard') not in (None, DEFAULT_SHARD):
+        location = f"{result['shard']}:{location}"
+    if result.get('line_start'):
+        location += f" (lines {result['line_start']}-{result['line_end']}"
+        location += f", {result['name']})" if result.get('name') else ")"
+    return f"=== File {number}: {result['filename']}{score_info} ===\nPath: {location}\nContent:\n{result['content']}\n"
+
+def format_code_context(results, max_tokens=CONTEXT_MAX_TOKENS):
+    """
+    Format search results within a token budget: duplicates are dropped, adjacent
+    chunks of a file are merged, and blocks are packed by score per token.
+    """
+    return "\n".join(pack_context(results, format_result, max_tokens))
+
+def retrieve(user_query, k=5, metric=None, snapshot=None, shards=None):
+    """
+    Search and LLM-rerank; returns the top k results (empty if nothing matched).
+    With QUERY_SERVER_URL set, the search runs on the query server instead of a local index.
+    """
+    # Search with the original query, its synonym expansion and its intent rewrite
+    variants = query_variants(user_query)
+    with span("search"):
+        if QUERY_SERVER_URL:
+            search_results = query_client.search(user_query, k=k*2, metric=metric, shards=shards, variants=variants)
+        else:
+            from coderag.search import search_code
+            search_results = search_code(
+                user_query, k=k*2, metric=metric, snapshot=snapshot, variants=variants
+            )  # Get more candidates
+    if not should_rerank(search_results):
+        return search_results[:k]
+
+    # Rerank results with the configured backend (local by default, LLM optional)
+    with span("rerank"):
+        return get_reranker().rerank(user_query, search_results, top_k=k)
+
+async def aretrieve(user_query, k=5, metric=None, snapshot=None, shards=None):
+    """Async retrieve."""
+    variants = query_variants(user_query)
+    with span("search"):
+        if QUERY_SERVER_URL:
+            search_results = await asyncio.to_thread(
+                query_client.search, user_query, k=k*2, metric=metric, shards=shards, variants=variants
+            )
+        else:
+            from coderag.search import asearch_code
+            search_results = await asearch_code(
+                user_query, k=k*2, metric=metric, snapshot=snapshot, variants=variants
+            )
+    if not should_rerank(search_results):
+        return search_results[:k]
+    with span("rerank"):
+        return await get_reranker().arerank(user_query, search_results, top_k=k)
+
+def _messages(system_prompt, prompt):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ]
+
+def _chat_request(system_prompt, prompt, **kwargs):
+    return dict(
+        model=OPENAI_CHAT_MODEL,
+        messages=_messages(system_prompt, prompt),
+        temperature=0.1,
+        max_tokens=1500,
+        **kwargs
+    )
+
+def _stream_request(system_prompt, prompt):
+    # The last chunk then reports the token usage
+    return _chat_request(system_prompt, prompt, stream=True, stream_options={"include_usage": True})
+
+def generate_answer(system_prompt, prompt):
+    with span("generate"):
+        try:
+            response = get_client().chat.completions.create(**_chat_request(system_prompt, prompt))
+        except Exception as e:
+            record_api_call("chat", error=e)
+            raise
+        record_api_call("chat", response)
+        return response.choices[0].message.content.strip()
+
+async def agenerate_answer(system_prompt, prompt):
+    with span("generate"):
+        try:
+            response = await get_async_client().chat.completions.create(**_chat_request(system_prompt, prompt))
+        except Exception as e:
+            record_api_call("chat", error=e)
+            raise
+        record_api_call("chat", response)
+        return response.choices[0].message.content.strip()
+
+def stream_answer(system_prompt, prompt):
+    """Yield the answer text piece by piece as the model generates it."""
+    with span("generate"):
+        try:
+            stream = get_client().chat.completions.create(**_stream_request(system_prompt, prompt))
+        except Exception as e:
+            record_api_call("chat", error=e)
+            raise
+        record_api_call("chat")
+        for chunk in stream:
+            if chunk.usage is not None:
+                record_usage("chat", chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+async def astream_answer(system_prompt, prompt):
+    """Async stream_answer."""
+    with span("generate"):
+        try:
+            stream = await get_async_client().chat.completions.create(**_stream_request(system_prompt, prompt))
+        except Exception as e:
+            record_api_call("chat", error=e)
+            raise
+        record_api_call("chat")
+        async for chunk in stream:
+            if chunk.usage is not None:
+                record_usage("chat", chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+def prepare_prompt(user_query, k=5, metric=None, shards=None):
+    """
+    Retrieve and format the context for a question.
+
+    Returns (answer cache key, system prompt, prompt), or None if no code matched.
+    Ranked results are cached per index generation, so a repeated question skips
+    the query embedding and the rerank call.
+    """
+    if QUERY_SERVER_URL:
+        # The server holds the index, so its generation (the results cache key) isn't known here
+        with span("retrieve"):
+            return _build_prompt(user_query, retrieve(user_query, k, metric, shards=shards))
+    snapshots, results_key = _load_snapshots(user_query, k, metric, shards)
+    with span("retrieve"):
+        reranked_results = query_cache.cached(
+            query_cache.results, results_key, lambda: retrieve(user_query, k, metric, snapshots)
+        )
+    return _build_prompt(user_query, reranked_results)
+
+async def aprepare_prompt(user_query, k=5, metric=None, shards=None):
+    """Async prepare_prompt: keyword and semantic retrieval overlap, and no thread waits on the network."""
+    if QUERY_SERVER_URL:
+        with span("retrieve"):
+            return _build_prompt(user_query, await aretrieve(user_query, k, metric, shards=shards))
+    snapshots, results_key = _load_snapshots(user_query, k, metric, shards)
+    with span("retrieve"):
+        reranked_results = query_cache.lookup(query_cache.results, results_key)
+        if reranked_results is None:
+            reranked_results = await aretrieve(user_query, k, metric, snapshots)
+            query_cache.store(query_cache.results, results_key, reranked_results)
+    return _build_prompt(user_query, reranked_results)
+
+def _load_snapshots(user_query, k, metric, shards):
+    """Current snapshots of the shards to search, and the results cache key for the question."""
+    from coderag.index import get_snapshots, snapshots_generation
+    with span("load_snapshot"):
+        snapshots = get_snapshots(shards)
+    generation = snapshots_generation(snapshots)
+    query_cache.check_generation(generation)
+    return snapshots, (query_cache.normalize_query(user_query), k, metric or RAG_DISTANCE_METRIC, generation)
+
+def _build_prompt(user_query, reranked_results):
+    if not reranked_results:
+        return None
+
+    # Extract intent (the query expansion was already searched in retrieve)
+    intent = extract_intent(user_query)
+
+    # Format context efficiently
+    with span("pack_context"):
         code_context = format_code_context(reranked_results)
-        
-        # Use intent-specific system prompt
-        system_prompt = get_intent_prompt(intent)
-        
-        prompt = f"""User Query: {user_query}
+
+    # Use intent-specific system prompt
+    system_prompt = get_intent_prompt(intent)
+
+    prompt = f"""User Query: {user_query}
 Query Intent: {intent}
 
 Retrieved Code Context:
@@ -70,17 +218,94 @@ Retrieved Code Context:
 
 Provide a focused, actionable response based on the code context above."""
 
-        response = client.chat.completions.create(
-            model=OPENAI_CHAT_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,
-            max_tokens=1500
-        )
-        
-        return response.choices[0].message.content.strip()
-    
+    answer_key = (
+        query_cache.normalize_query(user_query), query_cache.context_hash(intent, code_context), OPENAI_CHAT_MODEL
+    )
+    return answer_key, system_prompt, prompt
+
+def execute_rag_flow(user_query, k=5, metric=None, shards=None):
+    """
+    Answer a question from retrieved code; metric overrides RAG_DISTANCE_METRIC for retrieval
+    and shards selects the index shards searched (default SEARCH_SHARDS, else all).
+    Answers are cached per retrieved context.
+    """
+    try:
+        with span("rag_flow"):
+            prepared = prepare_prompt(user_query, k, metric, shards)
+            if prepared is None:
+                return "No relevant code found for your query."
+            answer_key, system_prompt, prompt = prepared
+            return query_cache.cached(query_cache.answers, answer_key, lambda: generate_answer(system_prompt, prompt))
+
+    except Exception as e:
+        return f"Error in RAG flow execution: {e}"
+
+def stream_rag_flow(user_query, k=5, metric=None, shards=None):
+    """
+    Streaming variant of execute_rag_flow: yields the answer in pieces as they are
+    generated, so the first words show up long before the full answer is done.
+    A cached answer is yielded in one piece.
+    """
+    try:
+        with span("rag_flow"):
+            prepared = prepare_prompt(user_query, k, metric, shards)
+            if prepared is None:
+                yield "No relevant code found for your query."
+                return
+            answer_key, system_prompt, prompt = prepared
+
+            answer = query_cache.lookup(query_cache.answers, answer_key)
+            if answer is not None:
+                yield answer
+                return
+
+            pieces = []
+            for piece in stream_answer(system_prompt, prompt):
+                pieces.append(piece)
+                yield piece
+            query_cache.store(query_cache.answers, answer_key, "".join(pieces).strip() or None)
+
+    except Exception as e:
+        yield f"Error in RAG flow execution: {e}"
+
+async def aexecute_rag_flow(user_query, k=5, metric=None, shards=None):
+    """Async execute_rag_flow, for serving many concurrent questions from one event loop."""
+    try:
+        with span("rag_flow"):
+            prepared = await aprepare_prompt(user_query, k, metric, shards)
+            if prepared is None:
+                return "No relevant code found for your query."
+            answer_key, system_prompt, prompt = prepared
+
+            answer = query_cache.lookup(query_cache.answers, answer_key)
+            if answer is None:
+                answer = await agenerate_answer(system_prompt, prompt)
+                query_cache.store(query_cache.answers, answer_key, answer)
+            return answer
+
+    except Exception as e:
+        return f"Error in RAG flow execution: {e}"
+
+async def astream_rag_flow(user_query, k=5, metric=None, shards=None):
+    """Async stream_rag_flow."""
+    try:
+        with span("rag_flow"):
+            prepared = await aprepare_prompt(user_query, k, metric, shards)
+            if prepared is None:
+                yield "No relevant code found for your query."
+                return
+            answer_key, system_prompt, prompt = prepared
+
+            answer = query_cache.lookup(query_cache.answers, answer_key)
+            if answer is not None:
+                yield answer
+                return
+
+            pieces = []
+            async for piece in astream_answer(system_prompt, prompt):
+                pieces.append(piece)
+                yield piece
+            query_cache.store(query_cache.answers, answer_key, "".join(pieces).strip() or None)
+
     except Exception as e:
-        return f"Error in RAG flow execution: {e}"
\ No newline at end of file
+        yield f"Error in RAG flow execution: {e}"
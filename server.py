@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+CodeRAG query server - one shared copy of the index for every client (no indexing)
+"""
+
+import argparse
+from coderag.config import (
+    QUERY_SERVER_HOST, QUERY_SERVER_PORT, QUERY_BATCH_WINDOW_MS, QUERY_BATCH_MAX, QUERY_SERVER_WORKERS
+)
+from coderag.index import get_snapshots
+from coderag.query_server import QueryBatcher, make_server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve hybrid code search over HTTP/JSON, batching concurrent queries",
+        epilog="Point cli.py and app.py at it with QUERY_SERVER_URL=http://HOST:PORT"
+    )
+    parser.add_argument('--host', default=QUERY_SERVER_HOST, help='Address to listen on')
+    parser.add_argument('--port', type=int, default=QUERY_SERVER_PORT, help='Port to listen on')
+    parser.add_argument(
+        '--batch-window-ms', type=float, default=QUERY_BATCH_WINDOW_MS,
+        help='How long to gather concurrent queries into one batch'
+    )
+    parser.add_argument('--batch-max', type=int, default=QUERY_BATCH_MAX, help='Largest batch')
+    parser.add_argument(
+        '--workers', type=int, default=QUERY_SERVER_WORKERS, help='Batches processed at the same time'
+    )
+    args = parser.parse_args()
+
+    # Load the index up front; later requests reuse it until the files change
+    try:
+        get_snapshots()
+    except Exception as e:
+        print(f"⚠️  Index not loaded yet: {e}")
+
+    server = make_server(args.host, args.port, QueryBatcher(args.batch_window_ms, args.batch_max, args.workers))
+    print(f"CodeRAG query server listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down.")
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()